@@ -1,38 +1,41 @@
 import pandas as pd
-import numpy as np
 import requests
 import datetime
-import json
-from collections import defaultdict
 import time
 import os
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from http_client import create_session, HostRateLimiter
+from response_cache import ResponseCache, cached_get, OWM_CACHE_TTL_SEC, CACHE_DIR
+from weather_store import (
+    open_store, upsert_forecasts, upsert_forecast_steps, prune_forecasts, WEATHER_DB_FILE, WEATHER_KEYS, STEP_KEYS
+)
+from resort_registry import load_resort_registry
 
 # ---  定数とリゾート設定 ---
-API_KEY = "APIkey" 
+API_KEY = os.environ.get('OWM_API_KEY', "APIkey")
+# 予報APIのURL (ローカルのモックサーバーに向ける場合は OWM_BASE_URL で上書き)
+OWM_BASE_URL = os.environ.get('OWM_BASE_URL', "https://api.openweathermap.org/data/2.5/forecast")
 TODAY = datetime.date.today()
 TARGET_FORECAST_DAYS = 5 
+# 同時に問い合わせるリゾート数の上限
+MAX_CONCURRENT_REQUESTS = 16
 
-RESORT_SETTINGS = {
-    'Kandatsu': {
-        'name': '神立スノーリゾート', 'elev': 1000, 'adj_val': 3.96,
-        'lat': 36.565, 'lon': 138.486
-    },
-    'Marunuma': {
-        'name': '丸沼高原スキー場', 'elev': 2000, 'adj_val': 9.78,
-        'lat': 36.464, 'lon': 138.579 
-    }
-}
+# リゾートの座標は resorts.json で定義 (予報の標高補正値 forecast_adj_val は観測所標高と GRADIENT_RATE から計算)
+RESORT_SETTINGS = load_resort_registry().resorts
 
 # --- 未来の予報データ取得 (OpenWeatherMap API) ---
-def get_future_weather_forecast_owm(api_key, lat, lon):
+def get_future_weather_forecast_owm(api_key, lat, lon, session=None, rate_limiter=None, base_url=None, cache=None):
     """今日から未来5日間のOpenWeatherMap予報データを取得する"""
     
-    BASE_URL = "https://api.openweathermap.org/data/2.5/forecast" 
     params = {'lat': lat, 'lon': lon, 'units': 'metric', 'appid': api_key}
     
     try:
-        response = requests.get(BASE_URL, params=params, timeout=5)
-        response.raise_for_status() 
+        response = cached_get(
+            session or requests, base_url or OWM_BASE_URL, params=params, ttl=OWM_CACHE_TTL_SEC,
+            cache=cache, timeout=5, rate_limiter=rate_limiter
+        )
         data = response.json()
         return data
         
@@ -40,116 +43,143 @@ def get_future_weather_forecast_owm(api_key, lat, lon):
         print(f"APIアクセスエラーが発生しました: {e}")
         return None
 
-# --- メイン処理 ---
 
-def generate_full_cache_file():
-    master_cache = {}
-    master_cache['timestamp'] = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+def fetch_all_forecasts(resort_settings, api_key, max_workers=MAX_CONCURRENT_REQUESTS, base_url=None, cache=None):
+    """全リゾートの予報を並列に取得する (同時接続数を制限し、接続はプールで使い回す)
 
+    cache に ResponseCache を渡すと、TTL内の予報はAPIを呼ばずにディスクから返す。
+    """
+    workers = max(1, min(max_workers, len(resort_settings)))
+    session = create_session(pool_size=workers)
+    rate_limiter = HostRateLimiter()
 
-    for resort_key, settings in RESORT_SETTINGS.items():
-        
-        # 4.2 未来の予報データ (API) を取得
-        api_json = get_future_weather_forecast_owm(API_KEY, settings['lat'], settings['lon'])
-        
-        if api_json:
-            # 標高補正値 (adj_val) を取得
-            correction_value = settings['adj_val'] 
+    def fetch(settings):
+        return get_future_weather_forecast_owm(
+            api_key, settings['lat'], settings['lon'],
+            session=session, rate_limiter=rate_limiter, base_url=base_url, cache=cache
+        )
+
+    with metrics.span('fetch', source='owm'), session, ThreadPoolExecutor(max_workers=workers) as executor:
+        results = dict(zip(resort_settings.keys(), executor.map(fetch, resort_settings.values())))
+    metrics.inc('stage_errors_total', sum(1 for r in results.values() if r is None), stage='forecast')
+    return results
+
+
+# --- 3時間ごとの予報 ---
+def forecast_steps_frame(api_json, correction_value):
+    """予報の list を3時間ごとの列の DataFrame にする (時刻はローカル時刻、気温は標高補正後)"""
+    items = api_json.get('list', [])
+    local_tz = datetime.datetime.now().astimezone().tzinfo
+    times = pd.to_datetime([item['dt'] for item in items], unit='s', utc=True).tz_convert(local_tz).tz_localize(None)
+    steps = pd.DataFrame({
+        'time': times,
+        'temp_c': [item['main']['temp'] for item in items],
+        'temp_max_c': [item['main']['temp_max'] for item in items],
+        'temp_min_c': [item['main']['temp_min'] for item in items],
+        'wind_ms': [item['wind']['speed'] for item in items],
+        # 降雪量はcmに変換し、降水量はmmで保持
+        'snowfall_cm': [item.get('snow', {}).get('3h', 0) / 10 for item in items],
+        'precipitation_mm': [item.get('rain', {}).get('3h', 0) for item in items],
+    }, columns=['time'] + STEP_KEYS)
+    # 標高補正の適用 (気温)
+    steps[['temp_c', 'temp_max_c', 'temp_min_c']] -= correction_value
+    return steps.sort_values('time', ignore_index=True)
+
+
+# --- 日別集計 ---
+def aggregate_daily_forecast(api_json, correction_value, today=None, steps=None):
+    """3時間ごとの予報を日別の最高/最低/平均などに集計する (日付ごとの groupby で一括集計)"""
+    today = today or TODAY
+    steps = forecast_steps_frame(api_json, correction_value) if steps is None else steps
+
+    # 今日から5日間のデータに限定
+    date_keys = steps['time'].dt.date
+    lead_days = (steps['time'].dt.normalize() - pd.Timestamp(today)).dt.days
+    in_range = (lead_days >= 0) & (lead_days < TARGET_FORECAST_DAYS)
+    daily = steps[in_range].groupby(date_keys[in_range], sort=True).agg(
+        temp_max=('temp_max_c', 'max'),
+        temp_min=('temp_min_c', 'min'),
+        temp_avg=('temp_c', 'mean'),
+        wind_avg=('wind_ms', 'mean'),
+        wind_max=('wind_ms', 'max'),
+        snowfall_cm=('snowfall_cm', 'sum'),
+        precipitation_total_mm=('precipitation_mm', 'sum'),
+    )
+
+    # 最終的なリストを作成 (過去データキーに統一)
+    return [
+        {
+            "date": date_key.isoformat(),                                       # ISO形式の日付
+            "precipitation_total_mm": round(d.precipitation_total_mm, 1),      # 小数点1桁
+            "temp_avg_c": round(d.temp_avg, 1),
+            "temp_max_c": round(d.temp_max, 1),
+            "temp_min_c": round(d.temp_min, 1),
+            "wind_avg_ms": round(float(d.wind_avg), 1),
+            "wind_max_ms": round(d.wind_max, 1),
+            "sunshine_h": float('nan'), # OpenWeatherMapには日照時間がないため、NaN
+            "snowfall_cm": round(d.snowfall_cm, 1),
+            "snow_depth_max_cm": float('nan') # OpenWeatherMapには最深積雪がないため、NaN
+        }
+        for date_key, d in daily.iterrows()
+    ]
+
+
+# --- ストアへの書き込み ---
+def store_forecasts(conn, resort_settings, forecasts, fetched_at, today=None):
+    """取得した予報 ({リゾート: APIのJSON}) を日別に集計し、3時間ごとの値と一緒にストアへ書き込む"""
+    with metrics.span('parse', source='owm'):
+        for resort_key, settings in resort_settings.items():
             
-            #JSON形式で格納
-            daily_data = defaultdict(lambda: {
-                'temp_max': -float('inf'), 
-                'temp_min': float('inf'), 
-                'temp_sum': 0.0, # 平均気温算出用
-                'temp_count': 0, # 平均気温算出用
-                'winds': [], 
-                'snowfall_cm': 0.0, 
-                'precipitation_total_mm': 0.0, # 降水量
-                'wind_max_ms': -float('inf'), # 最大風速
-                'date_str': ''
-            })
+            api_json = forecasts.get(resort_key)
             
-            for item in api_json.get('list', []):
-                dt_object = datetime.datetime.fromtimestamp(item['dt'])
-                date_key = dt_object.date()
-                
-                # 今日から5日間のデータに限定
-                if date_key < TODAY or (date_key - TODAY).days >= TARGET_FORECAST_DAYS:
-                    continue
-
-                # === 1. 標高補正の適用 (気温) ===
-                temp_corrected = item['main']['temp'] - correction_value
-                temp_max_corrected = item['main']['temp_max'] - correction_value
-                temp_min_corrected = item['main']['temp_min'] - correction_value
-                
-                # === 2. 日別集計 ===
-                daily_data[date_key]['temp_max'] = max(daily_data[date_key]['temp_max'], temp_max_corrected)
-                daily_data[date_key]['temp_min'] = min(daily_data[date_key]['temp_min'], temp_min_corrected)
-                
-                # 平均気温算出のため、全要素を積算
-                daily_data[date_key]['temp_sum'] += temp_corrected
-                daily_data[date_key]['temp_count'] += 1
-                
-                daily_data[date_key]['winds'].append(item['wind']['speed'])
-                
-                # 最大風速を更新
-                daily_data[date_key]['wind_max_ms'] = max(daily_data[date_key]['wind_max_ms'], item['wind']['speed'])
-
-                # 降雪量 を積算し、cmに変換
-                daily_data[date_key]['snowfall_cm'] += item.get('snow', {}).get('3h', 0) / 10 
-                
-                # 降水量 を積算し、mmで保持
-                daily_data[date_key]['precipitation_total_mm'] += item.get('rain', {}).get('3h', 0)
-                
-                daily_data[date_key]['date_str'] = date_key.strftime('%m月%d日')
-
-            # 4.4 最終的なリストを作成 (過去データキーに統一)
-            forecast_list = []
-            for date_key, values in sorted(daily_data.items()):
-                d = values
-                # データがない日 (スキップされた日) を除外
-                if d['temp_count'] == 0:
-                    continue
-                    
-                # 平均気温の計算
-                temp_avg = d['temp_sum'] / d['temp_count']
-                
-                forecast_list.append({
-                    "date": d['date_str'],
-                    "precipitation_total_mm": str(round(d['precipitation_total_mm'], 1)), # 文字列, 小数点1桁
-                    "temp_avg_c": str(round(temp_avg, 1)),                              # 文字列, 小数点1桁
-                    "temp_max_c": str(round(d['temp_max'], 1)),                           # 文字列, 小数点1桁
-                    "temp_min_c": str(round(d['temp_min'], 1)),                           # 文字列, 小数点1桁
-                    "wind_avg_ms": str(round(np.mean(d['winds']), 1)),                 # 文字列, 小数点1桁
-                    "wind_max_ms": str(round(d['wind_max_ms'], 1)),                     # 文字列, 小数点1桁
-                    "sunshine_h": "NaN", # OpenWeatherMapには日照時間がないため、NaN
-                    "snowfall_cm": str(round(d['snowfall_cm'], 1)),                     # 文字列, 小数点1桁
-                    "snow_depth_max_cm": "NaN" # OpenWeatherMapには最深積雪がないため、NaN
-                })
-
-            # 同じ構造に格納
-            master_cache[resort_key] = forecast_list 
-
-        else:
-            print(f"Skipping {resort_key} due to API error.")
-
-    # --- JSONファイルへの出力 ---
-    output_json_filename = 'GELACON/CF_data.json'
-    
-    with open(output_json_filename, 'w', encoding='utf-8') as f:
-        master_cache_final = {
-            "metadata": {
-                "date_run": datetime.datetime.now().isoformat(),
-                "target_period_days": TARGET_FORECAST_DAYS,
-                "data_source": "OpenWeatherMap API Forecast"
-            },
-        }
-        master_cache_final.update({k: v for k, v in master_cache.items() if k != 'timestamp'})
-        
-        json.dump(master_cache_final, f, ensure_ascii=False, indent=4)
+            if api_json:
+                # 標高補正値 (forecast_adj_val) を取得し、日別に集計して書き込む
+                steps = forecast_steps_frame(api_json, settings['forecast_adj_val'])
+                daily = aggregate_daily_forecast(api_json, settings['forecast_adj_val'], today=today, steps=steps)
+                upsert_forecasts(
+                    conn, resort_key, [row['date'] for row in daily],
+                    [[row[key] for key in WEATHER_KEYS] for row in daily], fetched_at=fetched_at
+                )
+                # 3時間ごとの予報もそのまま保存 (subdaily_timeline.py で時間帯別に予測)
+                upsert_forecast_steps(
+                    conn, resort_key, steps['time'].dt.strftime('%Y-%m-%dT%H:%M:%S'), steps[STEP_KEYS].to_numpy(), fetched_at=fetched_at
+                )
+                metrics.inc('rows_total', len(daily), stage='forecast')
+                metrics.inc('rows_total', len(steps), stage='forecast_steps')
+
+            else:
+                print(f"Skipping {resort_key} due to API error.")
+
+
+# --- メイン処理 ---
+
+def generate_full_cache_file(db_path=None, today=None):
+    """全リゾートの予報を取得してストアに保存する
+
+    today を省略するとモジュール読み込み時の日付 (TODAY) を使うので、常駐プロセスからは毎回渡す。
+    取得できたリゾートは保存し、取得に失敗したリゾートがあれば最後に RuntimeError を送出する。
+    """
+    db_path = db_path or os.path.join(os.path.dirname(os.path.abspath(__file__)), WEATHER_DB_FILE)
+    fetched_at = datetime.datetime.now().replace(microsecond=0)
+
+    # 4.2 未来の予報データ (API) を全リゾート並列に取得
+    http_cache = ResponseCache(os.path.join(os.path.dirname(os.path.abspath(__file__)), CACHE_DIR))
+    forecasts = fetch_all_forecasts(RESORT_SETTINGS, API_KEY, cache=http_cache)
+
+    # --- ストアへの出力 (リゾート, 日付, 取得元, 取得時刻) ---
+    conn = open_store(db_path)
+    try:
+        store_forecasts(conn, RESORT_SETTINGS, forecasts, fetched_at, today=today)
+        # 取得に失敗したリゾートは前回の取得分が最新として残る
+        prune_forecasts(conn)
+    finally:
+        conn.close()
+    failed = sorted(key for key, api_json in forecasts.items() if not api_json)
+    if failed:
+        raise RuntimeError(f"リゾート {failed} の予報の取得に失敗しました。")
 
     print("\n" + "="*60)
-    print(f"気象のデータ取得とキャッシュファイル '{output_json_filename}' の生成が完了しました。")
+    print(f"気象のデータ取得と '{db_path}' への保存が完了しました。")
     print("="*60)
 # --- 実行 ---
 if __name__ == '__main__':
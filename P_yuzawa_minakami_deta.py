@@ -1,41 +1,44 @@
 import datetime
 import requests
-from bs4 import BeautifulSoup
-import urllib.parse
 import sys
-import json
+import os
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import metrics
+from http_client import create_session, HostRateLimiter
+from response_cache import ResponseCache, cached_get, jma_month_ttl, CACHE_DIR
+from jma_parser import parse_daily_table
+from weather_store import open_store, upsert_observations, WEATHER_DB_FILE, WEATHER_KEYS
+from resort_registry import load_resort_registry
 
 # --- 1. 共通設定 ---
 # 取得したいデータの基準日
-TODAY = datetime.date(2025, 11, 11) # 動作確認のため固定。実際は datetime.date.today() を使用してください。
+TODAY = datetime.date.today()
 TARGET_DAYS = 5
-OUTPUT_FILENAME = "GELACON/past_data.json" 
-
-# 観測所のパラメータ（JSON出力のために地点名も追加）
-OBSERVATORIES = {
-    "yuzawa": { # 湯沢
-        "name": "湯沢",
-        "prec_no": 54,
-        "block_no": '0544'
-    },
-    "minakami": { # 水上（みなかみ）
-        "name": "水上",
-        "prec_no": 42,
-        "block_no": '1019'
-    }
-}
-
-# ヘッダー項目 (JSONのキーとして使用)
-DATA_KEYS = [
-    'date', 'precipitation_total_mm', 'temp_avg_c', 'temp_max_c', 'temp_min_c', 
-    'wind_avg_ms', 'wind_max_ms', 'sunshine_h', 'snowfall_cm', 'snow_depth_max_cm'
-]
+# 取得した観測値の保存先 (型付きの列と ISO 日付で保存)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_FILENAME = os.path.join(BASE_DIR, WEATHER_DB_FILE)
+# 気象庁 日別値ページのURL (ローカルのモックサーバーに向ける場合は JMA_BASE_URL で上書き)
+JMA_BASE_URL = os.environ.get('JMA_BASE_URL', "https://www.data.jma.go.jp/stats/etrn/view/daily_a1.php")
+# 同時に取得する観測所数の上限 (ホスト単位のレート制限は http_client で共通)
+MAX_CONCURRENT_STATIONS = 8
+
+# 観測所のパラメータ (地点名・気象庁の地点番号。resorts.json で定義)
+OBSERVATORIES = load_resort_registry().stations
+
+# 取得済みページのディスクキャッシュ (確定済みの過去月は再取得しない)
+HTTP_CACHE = ResponseCache(os.path.join(BASE_DIR, CACHE_DIR))
+
+# ヘッダー項目 (ストアの列名として使用)
+DATA_KEYS = ['date'] + WEATHER_KEYS
 # ---------------------
 
 
 # --- 2. 過去の実績データ取得 (Webスクレイピング) ---
-def get_past_weather_data(today, target_days, obs_code):
+def get_past_weather_data(today, target_days, obs_code, session=None, rate_limiter=None):
     """指定された観測所の過去N日間の気象庁実績データを取得する"""
     
     print(f"\n### 過去データ取得: {OBSERVATORIES[obs_code]['name']} ({target_days}日間)")
@@ -43,8 +46,7 @@ def get_past_weather_data(today, target_days, obs_code):
     # 取得期間の定義
     END_DATE = today
     START_DATE = END_DATE - datetime.timedelta(days=target_days - 1)
-    BASE_URL = "https://www.data.jma.go.jp/stats/etrn/view/daily_a1.php"
-    weather_data_list = [] # データを辞書で格納するリスト
+    dates, values, flags = [], [], [] # 日付・数値・品質フラグを日ごとに格納
     
     # 処理する月を特定 (月またぎ対応)
     target_months = set([
@@ -65,76 +67,98 @@ def get_past_weather_data(today, target_days, obs_code):
             'view': 'p1'
         }
         
-        full_url = BASE_URL + '?' + urllib.parse.urlencode(params)
         print(f"-> アクセス: {year}年{month}月")
 
         try:
-            response = requests.get(full_url, timeout=10)
+            response = cached_get(
+                session or requests, JMA_BASE_URL, params=params, ttl=jma_month_ttl(year, month),
+                cache=HTTP_CACHE, rate_limiter=rate_limiter
+            )
             response.encoding = 'EUC-JP'
-            soup = BeautifulSoup(response.text, 'html.parser')
+            page_html = response.text
         except requests.exceptions.RequestException as e:
+            # 月が欠けたまま保存しない (呼び出し側で取得失敗として扱う)
             print(f"エラー: {year}年{month}月のURLへのアクセス中にエラーが発生しました: {e}")
-            continue
+            raise
 
-        data_table = soup.find('table', id='tablefix1')
-        if not data_table:
-            continue
+        # tablefix1 から必要な列だけを数値で抽出 (ヘッダー行は日付列が数字でないため除外される)
+        # [1:降水計, 4:気温平均, 5:最高, 6:最低, 9:風速平均, 10:最大風速, 15:日照, 16:降雪計, 17:最深積雪]
+        with metrics.span('parse', source='jma'):
+            table = parse_daily_table(page_html)
 
-        rows = data_table.find_all('tr')
-        
-        # データ行の処理 (3行目から)
-        for i in range(2, len(rows)):
-            cols = rows[i].find_all(['td', 'th'])
-            cols = [ele.text.strip() for ele in cols]
-            
-            if cols and cols[0].isdigit():
-                day = int(cols[0])
-                current_date = datetime.date(year, month, day)
-
-                # 範囲内のデータのみを抽出
-                if START_DATE <= current_date <= END_DATE:
-                    
-                    # 必要な要素を抽出 (リスト形式)
-                    # [0:日付, 1:降水計, 4:気温平均, 5:最高, 6:最低, 9:風速平均, 10:最大風速, 15:日照, 16:降雪計, 17:最深積雪]
-                    raw_data = [f"{month}月{day}日"] + [cols[i] for i in [1, 4, 5, 6, 9, 10, 15, 16, 17]]
-                    
-                    # データを辞書形式に変換
-                    day_dict = dict(zip(DATA_KEYS, raw_data))
-                    weather_data_list.append(day_dict)
-
-    # 日付順に並び替え
-    weather_data_list.sort(key=lambda x: datetime.datetime.strptime(str(today.year) + x['date'], '%Y%m月%d日'))
-    return weather_data_list
+        for day, day_values, day_flags in zip(table['day'], table['values'], table['flags']):
+            current_date = datetime.date(year, month, int(day))
+
+            # 範囲内のデータのみを抽出
+            if START_DATE <= current_date <= END_DATE:
+                dates.append(current_date)
+                values.append(day_values)
+                flags.append(day_flags)
+
+    # 年を含む日付で並び替え (12月→1月をまたいでも順序が崩れない)
+    order = sorted(range(len(dates)), key=lambda i: dates[i])
+    return (
+        [dates[i] for i in order],
+        np.asarray([values[i] for i in order], dtype=float).reshape(len(order), len(WEATHER_KEYS)),
+        np.asarray([flags[i] for i in order], dtype=np.int64).reshape(len(order), len(WEATHER_KEYS))
+    )
 
 
 # --- 3. メイン処理とJSONファイル出力 ---
+def generate_past_cache_file(today=None, db_path=None):
+    """全観測所の過去N日間の観測値を取得してストアに保存する
+
+    today を省略するとモジュール読み込み時の日付 (TODAY) を使うので、常駐プロセスからは毎回渡す。
+    取得できた観測所は保存し、取得に失敗した観測所があれば最後に RuntimeError を送出する
+    (パイプラインはそのステージを失敗として扱う)。
+    """
+    today = today or TODAY
+    db_path = db_path or OUTPUT_FILENAME
+    fetched_at = datetime.datetime.now().replace(microsecond=0)
+
+    # 全観測所のデータを並列に取得し、(観測所, 日付, 取得元, 取得時刻) をキーにストアへ書き込む
+    workers = max(1, min(MAX_CONCURRENT_STATIONS, len(OBSERVATORIES)))
+    session = create_session(pool_size=workers)
+    rate_limiter = HostRateLimiter()
+
+    def fetch(obs_code):
+        try:
+            return get_past_weather_data(today, TARGET_DAYS, obs_code, session=session, rate_limiter=rate_limiter)
+        except Exception as e:
+            return e
 
-# 湯沢と水上のデータを取得
-yuzawa_data = get_past_weather_data(TODAY, TARGET_DAYS, "yuzawa")
-minakami_data = get_past_weather_data(TODAY, TARGET_DAYS, "minakami")
-
-# 最終的なJSON構造にまとめる
-final_json_output = {
-    "metadata": {
-        "date_run": datetime.datetime.now().isoformat(),
-        "target_period_days": TARGET_DAYS,
-        "data_source": "JMA Past Weather Data (Web Scraping)"
-    },
-    "yuzawa": yuzawa_data,
-    "minakami": minakami_data
-}
-
-# JSON形式でファイルに保存 
-try:
-    with open(OUTPUT_FILENAME, 'w', encoding='utf-8') as f:
-        # indent=4 で整形し、ensure_ascii=False で日本語をそのまま保存
-        json.dump(final_json_output, f, indent=4, ensure_ascii=False)
-    
-    print("\n" + "="*50)
-    print(f"データ保存完了！")
-    print(f"データはファイル '{OUTPUT_FILENAME}' にJSON形式で保存されました。")
-    print("="*50)
-
-except Exception as e:
-    print(f"\n--- エラー: ファイル保存に失敗しました ---")
-    print(f"詳細: {e}")
\ No newline at end of file
+    try:
+        with metrics.span('fetch', source='jma'), session, ThreadPoolExecutor(max_workers=workers) as executor:
+            results = dict(zip(OBSERVATORIES, executor.map(fetch, OBSERVATORIES)))
+        failed = {obs_code: e for obs_code, e in results.items() if isinstance(e, Exception)}
+
+        conn = open_store(db_path)
+        try:
+            n_rows = 0
+            for obs_code, result in results.items():
+                if obs_code not in failed:
+                    dates, values, flags = result
+                    n_rows += upsert_observations(conn, obs_code, dates, values, flags, fetched_at=fetched_at)
+        finally:
+            conn.close()
+        metrics.inc('rows_total', n_rows, stage='scrape')
+        metrics.inc('stations_total', len(results) - len(failed), stage='scrape')
+        if failed:
+            raise RuntimeError(f"観測所 {sorted(failed)} の取得に失敗しました: {list(failed.values())[0]}")
+
+        print("\n" + "="*50)
+        print(f"データ保存完了！")
+        print(f"{n_rows}日分の観測値 (新しい日と値が変わった日) はファイル '{db_path}' に保存されました。")
+        print("="*50)
+        return n_rows
+
+    except Exception as e:
+        metrics.inc('stage_errors_total', stage='scrape')
+        print(f"\n--- エラー: ファイル保存に失敗しました ---")
+        print(f"詳細: {e}")
+        raise
+
+
+# --- 実行 ---
+if __name__ == '__main__':
+    generate_past_cache_file()
@@ -0,0 +1,315 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import numpy as np
+
+import metrics
+from resort_registry import load_resort_registry, RESORT_REGISTRY_FILE
+from station_state import SEASON_START_MONTH, STATION_STATE_FILE, OBSERVATION_LOG_FILE
+from weather_store import open_store, upsert_observations, upsert_forecasts, WEATHER_DB_FILE, WEATHER_KEYS
+
+# --- 定数とファイル名 ---
+# 計測結果 (JSON) とベースライン
+BENCHMARK_REPORT_FILE = 'benchmark_report.json'
+BENCHMARK_BASELINE_FILE = 'benchmark_baseline.json'
+# ベースラインより何割以上遅い (またはメモリが多い) と劣化とみなすか
+REGRESSION_THRESHOLD = 0.2
+# この時間・メモリ未満の計測値は誤差が大きいため劣化の判定に使わない
+MIN_COMPARABLE_SEC = 0.05
+MIN_COMPARABLE_MB = 1.0
+# 合成データの既定の規模 (リゾート数 × コース数 × 予報日数 × 観測シーズン数)
+DEFAULT_SCALE = {'resorts': 50, 'courses': 4, 'days': 5, 'seasons': 3}
+# 1観測所あたりのリゾート数 (観測所の共有も再現する)
+RESORTS_PER_STATION = 2
+
+
+# --- 合成データ ---
+def synthetic_weather(rng, n_days, temp_offset=0.0):
+    """WEATHER_KEYS の並びで冬季らしい日別の値 (日 × 要素) を作る"""
+    temp_avg = rng.normal(-3 + temp_offset, 4, n_days)
+    temp_max = temp_avg + rng.uniform(1, 6, n_days)
+    temp_min = temp_avg - rng.uniform(1, 6, n_days)
+    wind_avg = np.abs(rng.normal(3, 1.5, n_days))
+    snowfall = np.where(temp_avg < 0, rng.gamma(1.2, 6, n_days), 0.0) * (rng.random(n_days) < 0.5)
+    precipitation = snowfall * 0.8 + np.where(temp_avg >= 0, rng.gamma(1.0, 3, n_days), 0.0)
+    columns = {
+        'precipitation_total_mm': precipitation,
+        'temp_avg_c': temp_avg,
+        'temp_max_c': temp_max,
+        'temp_min_c': temp_min,
+        'wind_avg_ms': wind_avg,
+        'wind_max_ms': wind_avg + rng.uniform(1, 5, n_days),
+        'sunshine_h': rng.uniform(0, 8, n_days),
+        'snowfall_cm': snowfall,
+        'snow_depth_max_cm': 50 + np.cumsum(snowfall),
+    }
+    return np.round(np.stack([columns[key] for key in WEATHER_KEYS], axis=1), 1)
+
+
+def observation_dates(n_seasons, today):
+    """過去 n_seasons の冬季 (12〜3月) と今シーズンの開始日から昨日までの日付"""
+    season_year = today.year if today.month >= SEASON_START_MONTH else today.year - 1
+    days = []
+    for year in range(season_year - n_seasons, season_year):
+        day = date(year, 12, 1)
+        while day < date(year + 1, 4, 1):
+            days.append(day)
+            day += timedelta(days=1)
+    day = date(season_year, SEASON_START_MONTH, 1)
+    while day < today:
+        days.append(day)
+        day += timedelta(days=1)
+    return days
+
+
+def build_synthetic_inputs(base_dir, resorts, courses, days, seasons, seed=0, today=None):
+    """resorts.json と観測・予報ストアを本番と同じ形式で合成する
+
+    観測は過去 seasons シーズン分の冬季と今シーズン分、予報は今日から days 日分を書き込む。
+    戻り値は合成したレジストリ。
+    """
+    today = today or date.today()
+    rng = np.random.default_rng(seed)
+    n_stations = max(1, resorts // RESORTS_PER_STATION)
+    stations = {
+        f"station_{i}": {
+            'name': f"観測所{i}", 'prec_no': 0, 'block_no': f"{i:04d}",
+            'lat': 35.0 + i * 0.01, 'lon': 137.0 + i * 0.01, 'elev': int(rng.integers(200, 800))
+        }
+        for i in range(n_stations)
+    }
+    resort_defs = {}
+    for i in range(resorts):
+        summit = int(rng.integers(1000, 2500))
+        resort_defs[f"resort_{i}"] = {
+            'name': f"リゾート{i}", 'lat': 35.0 + i * 0.01, 'lon': 137.0 + i * 0.01, 'elev': summit,
+            'station': f"station_{i % n_stations}",
+            # トップコースを先頭に、山頂から下へ等間隔
+            'courses': [summit - 50 - j * 150 for j in range(courses)],
+        }
+    registry_path = os.path.join(base_dir, RESORT_REGISTRY_FILE)
+    with open(registry_path, 'w', encoding='utf-8') as f:
+        json.dump({'stations': stations, 'resorts': resort_defs}, f, ensure_ascii=False, indent=4)
+
+    conn = open_store(os.path.join(base_dir, WEATHER_DB_FILE))
+    obs_days = observation_dates(seasons, today)
+    for station in stations:
+        upsert_observations(conn, station, obs_days, synthetic_weather(rng, len(obs_days)))
+    forecast_days = [today + timedelta(days=d) for d in range(days)]
+    for resort in resort_defs:
+        upsert_forecasts(conn, resort, forecast_days, synthetic_weather(rng, days, temp_offset=1.0))
+    conn.close()
+    return load_resort_registry(registry_path)
+
+
+# --- 計測 ---
+def measure(func, repeat=1, setup=None):
+    """実行時間 (repeat 回の最速値) と Python/NumPy のメモリ確保のピーク (MB) を計測する
+
+    tracemalloc は実行を遅くするため、メモリは時間の計測とは別にもう1回実行して測る。
+    """
+    best_sec = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best_sec = elapsed if best_sec is None else min(best_sec, elapsed)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': round(best_sec, 6), 'peak_mb': round(peak / 2**20, 3)}
+
+
+def run_benchmarks(work_dir, scale, repeat=1, seed=0, model_dir=None):
+    """合成データで各ステージを計測し、ステージ名 → {'seconds', 'peak_mb', 'rows'} を返す
+
+    計測中のメトリクスと構造化ログは work_dir/metrics に書く (本番の metrics/events.jsonl に追記しない)。
+    """
+    metrics_dir = os.path.join(work_dir, 'metrics')
+    os.environ['GELACON_METRICS_DIR'] = metrics.METRICS.metrics_dir = metrics_dir
+
+    from CF_yuzawa_minakami import store_forecasts
+    from calculation import generate_xgboost_features, STATE_CACHE_FILE
+    from feature_cache import load_feature_cache
+    from mock_owm_server import synthetic_forecast
+    from prediction import generate_predictions, load_prediction_cache, course_condition_rows, load_model
+
+    registry = build_synthetic_inputs(work_dir, seed=seed, **scale)
+    model = load_model(model_dir or os.path.dirname(os.path.abspath(__file__)))
+    n_course_days = len(registry.course_keys) * scale['days']
+    results = {}
+
+    # 1. 予報の日別集計とストアへの書き込み (APIのレスポンスは合成)
+    api_responses = {
+        key: synthetic_forecast(resort['lat'], resort['lon'], steps=scale['days'] * 8)
+        for key, resort in registry.resorts.items()
+    }
+    aggregation_db = os.path.join(work_dir, 'aggregation.sqlite')
+
+    def aggregate():
+        conn = open_store(aggregation_db)
+        store_forecasts(conn, registry.resorts, api_responses, datetime.now().replace(microsecond=0))
+        conn.close()
+
+    def reset_aggregation_db():
+        if os.path.exists(aggregation_db):
+            os.remove(aggregation_db)
+
+    results['forecast_aggregation'] = measure(aggregate, repeat, setup=reset_aggregation_db)
+    results['forecast_aggregation']['rows'] = len(registry.resorts) * scale['days'] * 8
+
+    # 2. 特徴量の計算 (初回: 状態なし、差分: 入力の変更なし)
+    def reset_feature_state():
+        for name in (STATE_CACHE_FILE, STATION_STATE_FILE, OBSERVATION_LOG_FILE):
+            path = os.path.join(work_dir, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def features(incremental):
+        return lambda: generate_xgboost_features(
+            write_json=False, incremental=incremental, predict=False, base_dir=work_dir, registry=registry)
+
+    results['features'] = measure(features(False), repeat, setup=reset_feature_state)
+    results['features_incremental'] = measure(features(True), repeat)
+    results['features']['rows'] = results['features_incremental']['rows'] = n_course_days
+
+    # 3. 特徴量キャッシュの読み込み (mmap で開き、全行を1回読む)
+    def load_features():
+        matrix, index = load_feature_cache(work_dir)
+        return float(np.asarray(matrix).sum())
+
+    results['feature_cache_load'] = measure(load_features, repeat)
+    results['feature_cache_load']['rows'] = n_course_days
+
+    # 4. 一括予測
+    results['predictions'] = measure(lambda: generate_predictions(work_dir, model=model), repeat)
+    results['predictions']['rows'] = n_course_days
+
+    # 5. アプリ側の予測結果の読み込みとリゾートごとのコース別の行の取り出し
+    def app_predictions():
+        cache = load_prediction_cache(work_dir)
+        return [
+            course_condition_rows(cache, [f"{key}_{elev}m" for elev in registry.courses(key)], registry.courses(key))
+            for key in registry.resorts
+        ]
+
+    results['course_condition_rows'] = measure(app_predictions, repeat)
+    results['course_condition_rows']['rows'] = n_course_days
+    return results
+
+
+# --- レポートとベースラインの比較 ---
+def build_report(results, scale, repeat):
+    return {
+        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'scale': scale,
+        'repeat': repeat,
+        'environment': {
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'results': results,
+    }
+
+
+def compare_reports(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """ベースラインと比べて劣化したステージを返す ([(ステージ, 指標, 今回, ベースライン, 比率)])
+
+    規模が違うレポートとは比較しない。
+    """
+    if baseline.get('scale') != report['scale']:
+        raise ValueError(f"ベースラインの規模 {baseline.get('scale')} と今回の規模 {report['scale']} が異なります。")
+    regressions = []
+    for stage, result in report['results'].items():
+        base = baseline['results'].get(stage)
+        if base is None:
+            continue
+        for metric, floor in (('seconds', MIN_COMPARABLE_SEC), ('peak_mb', MIN_COMPARABLE_MB)):
+            if max(result[metric], base[metric]) < floor or base[metric] <= 0:
+                continue
+            ratio = result[metric] / base[metric]
+            if ratio > 1 + threshold:
+                regressions.append((stage, metric, result[metric], base[metric], ratio))
+    return regressions
+
+
+def print_report(report, baseline=None):
+    print(f"規模: {report['scale']} (繰り返し {report['repeat']}回)")
+    for stage, result in report['results'].items():
+        line = f"  {stage:24s} {result['seconds']:9.3f}秒 {result['peak_mb']:9.1f}MB {result['rows']:8d}行"
+        base = (baseline or {}).get('results', {}).get(stage)
+        if base and base['seconds'] > 0:
+            line += f"  (ベースライン比 {result['seconds'] / base['seconds']:.2f}倍)"
+        print(line)
+
+
+# --- 実行 ---
+if __name__ == '__main__':
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        base_dir = os.getcwd()
+
+    parser = argparse.ArgumentParser(description='合成データで各ステージの実行時間とメモリを計測する')
+    for key, value in DEFAULT_SCALE.items():
+        parser.add_argument(f"--{key}", type=int, default=value)
+    parser.add_argument('--repeat', type=int, default=3, help='繰り返し回数 (最速値を記録)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=os.path.join(base_dir, BENCHMARK_REPORT_FILE))
+    parser.add_argument('--baseline', default=os.path.join(base_dir, BENCHMARK_BASELINE_FILE))
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+    parser.add_argument('--save-baseline', action='store_true', help='今回の結果をベースラインとして保存する')
+    parser.add_argument('--keep', action='store_true', help='合成データの作業ディレクトリを残す')
+    args = parser.parse_args()
+
+    scale = {key: getattr(args, key) for key in DEFAULT_SCALE}
+    work_dir = tempfile.mkdtemp(prefix='gelacon_bench_')
+    try:
+        report = build_report(run_benchmarks(work_dir, scale, args.repeat, args.seed, base_dir), scale, args.repeat)
+    finally:
+        metrics.flush_metrics()
+        if args.keep:
+            print(f"合成データ: {work_dir}")
+        else:
+            # 作業ディレクトリを消した後に終了時の flush で作り直さないよう、記録も破棄する
+            metrics.METRICS.reset()
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+
+    baseline = None
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    print(f"✅ 計測結果を '{args.output}' に保存しました。")
+
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.baseline)
+        print(f"✅ ベースライン '{args.baseline}' を更新しました。")
+    elif baseline is not None:
+        regressions = compare_reports(report, baseline, args.threshold)
+        for stage, metric, value, base, ratio in regressions:
+            print(f"❌ 劣化: {stage} の {metric} が {base} → {value} ({ratio:.2f}倍、許容 {1 + args.threshold:.2f}倍)")
+        if regressions:
+            sys.exit(1)
+        print(f"✅ ベースラインからの劣化はありません (許容 {1 + args.threshold:.2f}倍)。")
@@ -1,226 +1,480 @@
-import pandas as pd
 import numpy as np
 import json
 from collections import defaultdict
 from datetime import datetime, date, timedelta
 import os
+import sys
+import hashlib
+
+import metrics
+from model_schema import MODEL_FEATURE_ORDER
+from feature_cache import write_feature_cache, FEATURE_MATRIX_FILE
+from station_state import (
+    update_station_state, load_station_state, provisional_station_states, replay_station_state,
+    checkpoint_needs_replay, SEASON_START_MONTH
+)
+from weather_store import open_store, observation_range, latest_forecast, WEATHER_DB_FILE
+from prediction import generate_predictions, prediction_is_current
+from resort_registry import load_resort_registry
+from snapshots import atomic_write, resolve_artifact
+from station_catalog import GRADIENT_RATE, lapse_adjustment
 
 # --- 定数とファイル名 ---
-# 気温補正
-GRADIENT_RATE = 0.6  
-# キャッシュファイル名
-PAST_CACHE_FILE = 'past_data.json'   
-FUTURE_CACHE_FILE = 'CF_data.json' 
+# 気温補正 (GRADIENT_RATE) は station_catalog.py で定義
+# キャッシュファイル名 (入力は WEATHER_DB_FILE の観測・予報ストア)
 OUTPUT_CACHE_FILE = 'XGBoost_Features_Cache.json'
+# 差分再計算用のフィンガープリントと引き継ぎ状態
+STATE_CACHE_FILE = 'XGBoost_Features_State.npz'
+
+# リゾート・コース標高・観測所 (アメダスの標高) の定義は resorts.json (resort_registry.py)
+
+# XGBoostモデルが期待する特徴量の順序は model_schema.py (MODEL_FEATURE_ORDER) で定義
+
+# --- ベクトル化した特徴量エンジン ---
+def course_adjustment(course_elevs, amedas_elev):
+    """アメダス観測所からコース標高までの気温補正値 (℃) を返す"""
+    return lapse_adjustment(course_elevs, amedas_elev)
+
+
+def compute_feature_matrix(temp_min, temp_max, wind_avg, snowfall, course_elevs, amedas_elev,
+                           prev_day_max_adj, cum_heat_base, max_snow_depth):
+    """(コース × 日) の特徴量行列を NumPy のブロードキャストで一括計算する
+
+    日別の入力配列は (..., D)、引き継ぎ状態はスカラーまたは (..., C) にブロードキャスト可能な配列。
+    戻り値は (..., C, D, len(MODEL_FEATURE_ORDER))。
+    """
+    temp_min = np.asarray(temp_min, dtype=float)[..., None, :]
+    temp_max = np.asarray(temp_max, dtype=float)[..., None, :]
+    wind_avg = np.asarray(wind_avg, dtype=float)[..., None, :]
+    snowfall = np.asarray(snowfall, dtype=float)[..., None, :]
+    course_elevs = np.asarray(course_elevs, dtype=float)
+
+    # A. 標高補正 (コースごとに異なる補正を適用)
+    adjustment_value = course_adjustment(course_elevs, amedas_elev)[:, None]
+    adj_min = temp_min - adjustment_value
+    adj_max = temp_max - adjustment_value
+    shape = np.broadcast_shapes(adj_min.shape, adj_max.shape, wind_avg.shape, snowfall.shape)
+    adj_min = np.broadcast_to(adj_min, shape)
+    adj_max = np.broadcast_to(adj_max, shape)
+
+    # B. Night Chill Factor (前日の補正後最高気温を1日ずらして使用)
+    prev_max = np.concatenate(
+        [np.broadcast_to(np.asarray(prev_day_max_adj, dtype=float)[..., None], shape[:-1] + (1,)),
+         adj_max[..., :-1]], axis=-1)
+    night_chill = prev_max - adj_min
+
+    # C. 累積熱履歴 (基点を先頭に置いて累積し、逐次加算と同じ丸めにする)
+    heat_daily = np.maximum(0, adj_max - 0)
+    base = np.broadcast_to(np.asarray(cum_heat_base, dtype=float)[..., None], shape[:-1] + (1,))
+    cum_heat = np.cumsum(np.concatenate([base, heat_daily], axis=-1), axis=-1)[..., 1:]
+
+    # D. 雪面硬化リスク
+    hardening_risk = wind_avg**2 * np.where(adj_min < 0, 1.5, 1.0)
+
+    # 最深積雪は前日までの降雪量を繰り越す
+    depth = np.broadcast_to(np.asarray(max_snow_depth, dtype=float)[..., None], shape[:-1] + (1,))
+    snow_depth = np.cumsum(
+        np.concatenate([depth, np.broadcast_to(snowfall, shape)[..., :-1]], axis=-1), axis=-1)
+
+    # モデルの期待する順序で積み上げる
+    columns = {
+        'MaxSnowDepth': snow_depth,
+        'Snowfall': snowfall,
+        'AvgWindSpeed': wind_avg,
+        'Adj_Temp_Min': adj_min,
+        'Night_Chill_Factor': night_chill,
+        'Cumulative_Heat_History': cum_heat,
+        'Surface_Hardening_Risk': hardening_risk,
+        'Course_Elev': course_elevs[:, None],
+    }
+    return np.stack([np.broadcast_to(columns[feat], shape) for feat in MODEL_FEATURE_ORDER], axis=-1)
+
+
+def station_adjustments(registry=None):
+    """過去データ観測所ごとの補正値 (基準リゾートのトップコースの標高を基準) を返す"""
+    registry = registry or load_resort_registry()
+    adj_vals = {}
+    for past_key in registry.linked_stations():
+        future_key = registry.reference_resort(past_key)
+        amedas_elev = registry.amedas_elev(future_key)
+        course_elev_top = max(registry.courses(future_key)) # トップコースの標高を基準に
+        adj_vals[past_key] = float(lapse_adjustment(course_elev_top, amedas_elev))
+    return adj_vals
+
+
+# --- 差分再計算 (入力のハッシュで変更箇所を特定) ---
+def fingerprint_course_days(forecast_rows, course_elevs, amedas_elev, past_base):
+    """コースごとに日別の連鎖ハッシュ (C × D) を計算する
+
+    forecast_rows は日ごとの入力 ([日付, 最低気温, 最高気温, 平均風速, 降雪量] など) のリスト。
+
+    d日目のハッシュは引き継ぎ状態と0〜d日目の入力すべてに依存するため、
+    前回と先頭から一致している日数分だけ結果を再利用できる。
+    """
+    seed_state = json.dumps([
+        float(past_base['PrevDayMaxTemp']), float(past_base['CumulativeHeatHistoryBase']),
+        float(past_base['MaxSnowDepth']), float(amedas_elev), GRADIENT_RATE, MODEL_FEATURE_ORDER
+    ])
+    row_texts = [json.dumps(row, sort_keys=True, ensure_ascii=False) for row in forecast_rows]
+
+    hashes = []
+    for course_elev in course_elevs:
+        digest = hashlib.sha256(f"{seed_state}|{course_elev}".encode('utf-8')).hexdigest()
+        course_hashes = []
+        for text in row_texts:
+            digest = hashlib.sha256((digest + text).encode('utf-8')).hexdigest()
+            course_hashes.append(digest)
+        hashes.append(course_hashes)
+    return np.asarray(hashes, dtype=str).reshape(len(course_elevs), len(row_texts))
+
+
+def load_feature_state(base_dir):
+    """前回実行時のフィンガープリントと引き継ぎ状態をリゾートごとに読み込む"""
+    state_path = os.path.join(base_dir, STATE_CACHE_FILE)
+    if not os.path.exists(state_path):
+        return {}
+
+    state = defaultdict(dict)
+    with np.load(state_path, allow_pickle=False) as npz:
+        for key in npz.files:
+            resort, field = key.split('__', 1)
+            state[resort][field] = npz[key]
+    return dict(state)
+
+
+def save_feature_state(base_dir, state):
+    """フィンガープリントと引き継ぎ状態 (float64) を保存する"""
+    arrays = {
+        f"{resort}__{field}": values
+        for resort, fields in state.items()
+        for field, values in fields.items()
+    }
+    atomic_write(os.path.join(base_dir, STATE_CACHE_FILE), lambda f: np.savez(f, **arrays))
+
+
+def compute_course_features_incremental(day_arrays, course_elevs, amedas_elevs, base_state, day_hashes, old_rows):
+    """前回から入力・引き継ぎ状態が変わったコースと日だけを再計算する
+
+    複数リゾートのコースをまとめた C 本を一括で扱う。day_arrays の各配列と day_hashes は (C × D)、
+    amedas_elevs と base_state (前日の補正後最高気温, 累積熱履歴, 最深積雪) の各要素は (C,)。
+    old_rows はコースごとの前回の {'day_hashes', 'features', 'carry'} (無ければ None)。
+    戻り値は (特徴量 (C × D × F), 引き継ぎ状態 (C × D × 3), 再計算した行数)。
+    引き継ぎ状態は各日の終了時点の [補正後最高気温, 累積熱履歴, 翌日の最深積雪]。
+    """
+    temp_min, temp_max, wind_avg, snowfall = day_arrays
+    course_elevs = np.asarray(course_elevs)
+    amedas_elevs = np.asarray(amedas_elevs, dtype=float)
+    n_courses, n_days = day_hashes.shape
+    features = np.empty((n_courses, n_days, len(MODEL_FEATURE_ORDER)))
+
+    # 前回の結果を先頭から一致している日数分だけ再利用
+    reuse_days = np.zeros(n_courses, dtype=int)
+    carry_in = np.stack([np.asarray(v, dtype=float) for v in base_state], axis=-1)
+    for ci, old in enumerate(old_rows):
+        if old is None:
+            continue
+        old_hashes = old['day_hashes']
+        limit = min(len(old_hashes), n_days)
+        matched = np.flatnonzero(old_hashes[:limit] != day_hashes[ci, :limit])
+        k = int(matched[0]) if len(matched) else limit
+        if k > 0:
+            features[ci, :k] = old['features'][:k]
+            carry_in[ci] = old['carry'][k - 1]
+        reuse_days[ci] = k
+
+    # 再開位置が同じコースをまとめて一括計算 (コースごとに入力・状態が異なるので C をバッチ次元にする)
+    recomputed_rows = 0
+    for k in np.unique(reuse_days):
+        if k == n_days:
+            continue
+        group = np.flatnonzero(reuse_days == k)
+        features[group, k:] = compute_feature_matrix(
+            temp_min[group, k:], temp_max[group, k:], wind_avg[group, k:], snowfall[group, k:],
+            course_elevs[group, None], amedas_elevs[group, None],
+            carry_in[group, 0, None], carry_in[group, 1, None], carry_in[group, 2, None]
+        )[:, 0]
+        recomputed_rows += len(group) * (n_days - k)
+
+    # F. 翌日のための状態 (逐次計算と同じ値になるように保存)
+    carry = np.stack([
+        temp_max - course_adjustment(course_elevs, amedas_elevs)[:, None],
+        features[..., MODEL_FEATURE_ORDER.index('Cumulative_Heat_History')],
+        features[..., MODEL_FEATURE_ORDER.index('MaxSnowDepth')] + snowfall
+    ], axis=-1)
+    return features, carry, recomputed_rows
+
+
+# --- 観測値の読み込み ---
+def load_new_observations(conn, states, adj_vals, today=None):
+    """チェックポイントの最終観測日より後の観測値を観測所ごとに返す
+
+    チェックポイントが無い観測所は今シーズンの開始日から読み込む。
+    """
+    today = today or date.today()
+    season_start = date(today.year if today.month >= SEASON_START_MONTH else today.year - 1, SEASON_START_MONTH, 1)
+    observations = {}
+    for station in adj_vals:
+        last_date = states.get(station, {}).get('last_date')
+        start = date.fromisoformat(last_date) + timedelta(days=1) if last_date else season_start
+        rows = observation_range(conn, station, start, today, keys=['temp_max_c', 'snow_depth_max_cm'])
+        observations[station] = [
+            (day, temp_max, snow_depth)
+            for day, temp_max, snow_depth in zip(rows['dates'].tolist(), rows['temp_max_c'], rows['snow_depth_max_cm'])
+        ]
+    return observations
+
+
+def refresh_station_states(conn, base_dir, adj_vals, today=None):
+    """チェックポイントを前日まで進めて保存し、当日の速報値を仮に反映した状態を返す
+
+    当日の観測値は確定させないので、後の取得で値が変わっても次の実行で読み直される。
+    """
+    today = today or date.today()
+    states = load_station_state(base_dir)
+    if checkpoint_needs_replay(states, adj_vals, today):
+        print("注意: 標高補正値の変更、または当日分まで確定したチェックポイントのため、ストアから状態を再構築します。")
+        observations = load_new_observations(conn, {}, adj_vals, today)
+        states = replay_station_state(base_dir, observations, adj_vals, today)
+    else:
+        observations = load_new_observations(conn, states, adj_vals, today)
+        states = update_station_state(base_dir, observations, adj_vals, today)
+    return provisional_station_states(states, observations, adj_vals)
+
+
+def current_station_states(conn, base_dir, adj_vals, today=None):
+    """チェックポイントを書き換えずに、未反映の観測値 (当日の速報値を含む) を仮に反映した状態を返す"""
+    states = load_station_state(base_dir)
+    return provisional_station_states(states, load_new_observations(conn, states, adj_vals, today), adj_vals)
+
+
+def initial_history_from_states(station_states, adj_vals):
+    """観測所のシーズン累積状態から予報初日の引き継ぎ状態を作る (過去データが2日未満の観測所は除く)"""
+    initial_history = {}
+    for past_key in adj_vals:
+        state = station_states.get(past_key)
+
+        # 過去データの不足チェック
+        if state is None or state['observed_days'] < 2:
+            print(f"エラー: {past_key} の過去データが不足しています（2日未満）。スキップします。")
+            continue
+
+        initial_history[past_key] = {
+            # 補正後の最高気温をベースとする
+            'PrevDayMaxTemp': state['prev_day_max_adj'],
+            'CumulativeHeatHistoryBase': state['cum_heat'],
+            'MaxSnowDepth': state['max_snow_depth'],
+            'BaseAdjVal': state['adj_val']
+        }
+    return initial_history
+
+
+def load_forecast_groups(conn, registry, initial_history):
+    """最新の取得分の予報をリゾートごとに読み込み、予報の日付が同じリゾートをまとめる
+
+    戻り値は ({日付のタプル: [リゾート, ...]}, {リゾート: 予報の配列})。
+    """
+    resort_groups = defaultdict(list)
+    forecasts = {}
+    for base_resort in registry.resorts:
+        past_key = registry.station_of(base_resort)
+        if past_key not in initial_history:
+            continue
+
+        forecast = latest_forecast(conn, base_resort)
+        if len(forecast['dates']) == 0:
+             print(f"注意: {base_resort} の予報データが見つかりません。スキップします。")
+             continue
+        forecasts[base_resort] = forecast
+        resort_groups[tuple(forecast['dates'].astype(str))].append(base_resort)
+    return resort_groups, forecasts
 
-# アメダス観測所の標高
-AMEDAS_ELEVATIONS = {'Kandatsu': 340, 'Marunuma': 370}  
-# コース標高
-COURSE_TARGETS = {
-    'Kandatsu': [900, 700, 500],
-    'Marunuma': [1950, 1700, 1500, 1300]
-}
-
-# 過去データ観測所と未来データ
-PAST_FUTURE_MAPPING = {
-    'yuzawa': 'Kandatsu',
-    'minakami': 'Marunuma'
-}
-
-# XGBoostモデルが期待する特徴量の順序 
-MODEL_FEATURE_ORDER = [
-    'MaxSnowDepth', 'Snowfall', 'AvgWindSpeed', 'Adj_Temp_Min', 
-    'Night_Chill_Factor', 'Cumulative_Heat_History', 'Surface_Hardening_Risk', 'Course_Elev'
-]
 
 # ---  メインの特徴量計算関数 ---
-def generate_xgboost_features():
+@metrics.timed('feature')
+def generate_xgboost_features(write_json=True, incremental=False, predict=True, base_dir=None, registry=None):
     
     print("定数とファイル名の設定が完了しました。")
     
-    # フルパスの計算とJSONファイルのロード
-    
-    # スクリプトの絶対パスを取得し、ベースディレクトリとする
-    try:
-        base_dir = os.path.dirname(os.path.abspath(__file__))
-    except NameError:
-        base_dir = os.getcwd() 
-
-    past_full_path = os.path.join(base_dir, PAST_CACHE_FILE)
-    future_full_path = os.path.join(base_dir, FUTURE_CACHE_FILE)
-
-    try:
-        # 過去データの読み込み
-        print(f"過去データを探しています: {past_full_path}")
-        with open(past_full_path, 'r', encoding='utf-8') as f:
-            past_cache = json.load(f)
-            
-        # 未来データの読み込み
-        print(f"未来データを探しています: {future_full_path}")
-        with open(future_full_path, 'r', encoding='utf-8') as f:
-            future_cache = json.load(f)
-            
-        print("✅ 過去データと未来データのキャッシュファイルを正常に読み込みました。")
+    # フルパスの計算とストアのオープン
     
-    except FileNotFoundError as e:
+    # 指定が無ければスクリプトの絶対パスを取得し、ベースディレクトリとする
+    # (base_dir / registry はベンチマークで合成データを使うときに指定する)
+    if base_dir is None:
+        try:
+            base_dir = os.path.dirname(os.path.abspath(__file__))
+        except NameError:
+            base_dir = os.getcwd() 
+    registry = registry or load_resort_registry()
+
+    store_path = os.path.join(base_dir, WEATHER_DB_FILE)
+    if not os.path.exists(store_path):
         print("\n" + "="*50)
         print(" 致命的なファイル読み込みエラーが発生しました (FileNotFoundError) ")
-        print(f"アクセスを試みたファイル: {e.filename}")
-        print("ファイル名またはパスを確認してください。")
-        print("="*50)
-        return
-    except json.JSONDecodeError:
-        print("\n" + "="*50)
-        print(" 致命的なJSON解析エラーが発生しました (JSONDecodeError) ")
-        print(f"ファイル {PAST_CACHE_FILE} または {FUTURE_CACHE_FILE} の内容が不正です。")
-        print("JSONファイルの構文を確認してください。")
+        print(f"アクセスを試みたファイル: {store_path}")
+        print("P_yuzawa_minakami_deta.py と CF_yuzawa_minakami.py を先に実行してください。")
         print("="*50)
         return
+    conn = open_store(store_path)
+    print(f"✅ 観測・予報ストア '{store_path}' を開きました。")
 
-    # 過去データで使用されたリゾートキーを抽出
-    past_resort_keys = [k for k in past_cache.keys() if k != 'metadata']
-    
-    # 2. 過去データから初期値（ベースライン）を計算 (Night Chill Factorと熱履歴の基点)
-    initial_history = {}
-    for past_key in past_resort_keys:
-        # 過去データ (N日分) をPandasに変換
-        df_past = pd.DataFrame(past_cache[past_key])
-        
-        # 数値変換 (エラーを考慮し、文字列データを数値に変換)
-        for col in ['temp_max_c', 'temp_min_c', 'snow_depth_max_cm', 'wind_max_ms']:
-            if col in df_past.columns:
-                 df_past[col] = pd.to_numeric(df_past[col], errors='coerce')
-        
-        # 過去データの不足チェック
-        if len(df_past) < 2:
-            print(f"エラー: {past_key} の過去データが不足しています（2日未満）。スキップします。")
-            continue
-            
-        prev_day_max_temp = df_past['temp_max_c'].iloc[-2] # 最新日の前日の最高気温
-        df_latest_day = df_past.iloc[-1] # 最新日のデータ
-        
-        # 補正値の計算 (過去データ取得時の補正値を仮定)
-        future_key = PAST_FUTURE_MAPPING[past_key]
-        amedas_elev = AMEDAS_ELEVATIONS[future_key]
-        course_elev_top = COURSE_TARGETS[future_key][0] # トップコースの標高を基準に
-        elev_diff = course_elev_top - amedas_elev
-        adj_val = (elev_diff / 100) * GRADIENT_RATE 
-        
-        # 累積熱履歴の再計算 (過去データ全体で実行)
-        df_past['Adj_Max'] = df_past['temp_max_c'] - adj_val
-        df_past['Heat_Penalty_Daily'] = np.maximum(0, df_past['Adj_Max'] - 0)
-        df_past['CumHeatHistory'] = df_past['Heat_Penalty_Daily'].cumsum()
-        
-        # 最新日 (Futureの予測開始日の前日) の値を取得
-        cum_heat_base = df_past['CumHeatHistory'].iloc[-1]
-        max_snow_depth = df_latest_day['snow_depth_max_cm'] 
+    # 2. 観測所ごとのシーズン累積状態を更新し、初期値（ベースライン）とする
+    #    (チェックポイント以降の観測日だけをストアから範囲検索し、前日までを確定・当日分は仮に反映する)
+    adj_vals = station_adjustments(registry)
+    station_states = refresh_station_states(conn, base_dir, adj_vals)
 
-        initial_history[past_key] = {
-            # 補正後の最高気温をベースとする
-            'PrevDayMaxTemp': prev_day_max_temp - adj_val, 
-            'CumulativeHeatHistoryBase': cum_heat_base,
-            'MaxSnowDepth': max_snow_depth,
-            'BaseAdjVal': adj_val
-        }
+    initial_history = initial_history_from_states(station_states, adj_vals)
 
-    # 3. 未来予報データ (CF_data.json) を準備
+    # 3. 未来予報データ (ストアの最新取得分) を準備
     all_features_for_model = {}
+    # カラム形式キャッシュ用 (コース順に行を連結)
+    matrix_blocks, course_keys, course_elev_index, course_row_counts, row_dates = [], [], [], [], []
+    # 差分モードでは前回の状態を読み込む
+    old_feature_state = load_feature_state(base_dir) if incremental else {}
+    new_feature_state = {}
+    recomputed_rows = 0
     
-    for base_resort in ['Kandatsu', 'Marunuma']:
-        
-        # 予報データのDataFrameを作成
-        forecast_data = future_cache.get(base_resort) 
-        if not forecast_data:
-             print(f"注意: {base_resort} の予報データが見つかりません。スキップします。")
-             continue
-             
-        forecast_df = pd.DataFrame(forecast_data)
-        
-        #  キー統一後の数値変換 
-        # CF_data.jsonのキーを使用
-        numeric_cols = ['temp_max_c', 'temp_min_c', 'wind_avg_ms', 'snowfall_cm']
-        for col in numeric_cols:
-            forecast_df[col] = pd.to_numeric(forecast_df[col], errors='coerce') 
-
-        # 4. コースごとの特徴量計算ループ
-        for course_elev in COURSE_TARGETS[base_resort]:
-            
+    # 最新の取得分の予報を数値配列で取得し、日付が同じリゾートをまとめる
+    resort_groups, forecasts = load_forecast_groups(conn, registry, initial_history)
+
+    # 4. 日付が同じリゾートの全コース × 全日の特徴量を一括計算
+    resort_results = {}
+    for dates, resorts in resort_groups.items():
+        dates = list(dates)
+        day_blocks, elev_blocks, amedas_blocks, state_blocks, hash_blocks, old_rows = [], [], [], [], [], []
+        for base_resort in resorts:
             # 状態変数の初期化 (過去データから引き継ぐ)
-            past_key = 'yuzawa' if base_resort == 'Kandatsu' else 'minakami'
-            if past_key not in initial_history:
-                continue 
-                
-            past_base = initial_history[past_key]
-            
-            prev_day_max_adj = past_base['PrevDayMaxTemp'] # 補正済みの最高気温
-            cum_heat = past_base['CumulativeHeatHistoryBase']
-            max_snow_depth = past_base['MaxSnowDepth']
-
-            # 補正値の計算 (コースごとに異なる補正を適用)
-            amedas_elev = AMEDAS_ELEVATIONS[base_resort]
-            elev_diff = course_elev - amedas_elev
-            adjustment_value = (elev_diff / 100) * GRADIENT_RATE
-            
-            course_features = []
-            
-            for index, day_data in forecast_df.iterrows():
-                
-                # A. 標高補正 
-                adj_min = day_data['temp_min_c'] - adjustment_value
-                adj_max = day_data['temp_max_c'] - adjustment_value
-                
-                # B. Night Chill Factor (急冷度)
-                night_chill = prev_day_max_adj - adj_min
-                
-                # C. 累積熱履歴の更新
-                heat_daily = np.maximum(0, adj_max - 0)
-                cum_heat = cum_heat + heat_daily 
-                
-                # D. 雪面硬化リスク 
-                hardening_risk = day_data['wind_avg_ms']**2 * (1.5 if adj_min < 0 else 1.0)
-                
-                # E. XGBoostモデル用のレコード作成 
-# E. XGBoostモデル用のレコード作成 (順序厳守)
-                record = {
-                'Date': day_data['date'], 
-                'MaxSnowDepth': max_snow_depth, 
-                'Snowfall': day_data['snowfall_cm'], 
-                'AvgWindSpeed': day_data['wind_avg_ms'], 
-                'Adj_Temp_Min': adj_min, 
-                'Night_Chill_Factor': night_chill, 
-                'Cumulative_Heat_History': cum_heat,
-                'Surface_Hardening_Risk': hardening_risk, 
-                'Course_Elev': course_elev
-                }
-                
-                # モデルの期待する特徴量のみを、期待する順序で格納
-                feature_values = [
-                    float(record[feat]) if isinstance(record[feat], (int, float, np.number)) else record[feat] 
-                    for feat in MODEL_FEATURE_ORDER
+            past_base = initial_history[registry.station_of(base_resort)]
+            course_elevs = registry.courses(base_resort)
+            amedas_elev = registry.amedas_elev(base_resort)
+            day_arrays = tuple(
+                forecasts[base_resort][col] for col in ['temp_min_c', 'temp_max_c', 'wind_avg_ms', 'snowfall_cm']
+            )
+            day_hashes = fingerprint_course_days(
+                [[day] + [float(v) for v in values] for day, values in zip(dates, zip(*day_arrays))],
+                course_elevs, amedas_elev, past_base
+            )
+
+            n_courses = len(course_elevs)
+            day_blocks.append(np.stack([np.broadcast_to(a, (n_courses, len(dates))) for a in day_arrays]))
+            elev_blocks.append(course_elevs)
+            amedas_blocks.append([amedas_elev] * n_courses)
+            state_blocks.append(np.tile(
+                [past_base['PrevDayMaxTemp'], past_base['CumulativeHeatHistoryBase'], past_base['MaxSnowDepth']],
+                (n_courses, 1)
+            ))
+            hash_blocks.append(day_hashes)
+
+            # 前回の結果はコース標高で対応付ける
+            old_state = old_feature_state.get(base_resort)
+            old_elevs = list(old_state['course_elevs']) if old_state else []
+            for course_elev in course_elevs:
+                oi = old_elevs.index(course_elev) if course_elev in old_elevs else None
+                old_rows.append(None if oi is None else {
+                    field: old_state[field][oi] for field in ('day_hashes', 'features', 'carry')
+                })
+
+        base_state = np.concatenate(state_blocks).T
+        feature_matrix, carry, group_rows = compute_course_features_incremental(
+            tuple(np.concatenate(day_blocks, axis=1)), np.concatenate(elev_blocks), np.concatenate(amedas_blocks),
+            tuple(base_state), np.concatenate(hash_blocks), old_rows
+        )
+        recomputed_rows += group_rows
+
+        offset = 0
+        for base_resort, day_hashes in zip(resorts, hash_blocks):
+            rows = slice(offset, offset + len(day_hashes))
+            resort_results[base_resort] = (dates, day_hashes, feature_matrix[rows], carry[rows])
+            offset += len(day_hashes)
+
+    # E. XGBoostモデル用のレコード作成 (レジストリの定義順を厳守)
+    for base_resort in registry.resorts:
+        if base_resort not in resort_results:
+            continue
+        dates, day_hashes, feature_matrix, carry = resort_results[base_resort]
+        course_elevs = registry.courses(base_resort)
+        new_feature_state[base_resort] = {
+            'course_elevs': np.asarray(course_elevs),
+            'dates': np.asarray(dates, dtype=str),
+            'day_hashes': day_hashes,
+            'features': feature_matrix,
+            'carry': carry
+        }
+        for course_elev, course_matrix in zip(course_elevs, feature_matrix):
+            feature_key = f"{base_resort}_{course_elev}m"
+            matrix_blocks.append(course_matrix)
+            course_keys.append(feature_key)
+            course_elev_index.append(course_elev)
+            course_row_counts.append(len(dates))
+            row_dates.extend(dates)
+
+            if write_json:
+                all_features_for_model[feature_key] = [
+                    {'Date': day, 'Course': course_elev, 'Features': feature_values}
+                    for day, feature_values in zip(dates, course_matrix.tolist())
                 ]
-                # 日付情報と特徴量を格納
-                final_record = {'Date': record['Date'], 'Course': course_elev, 'Features': feature_values}
-                course_features.append(final_record)
-                
-                # F. 翌日のために状態を更新
-                max_snow_depth = max_snow_depth + day_data['snowfall_cm']
-                prev_day_max_adj = adj_max # 補正後の最高気温を翌日の基点にする
-
-            all_features_for_model[f"{base_resort}_{course_elev}m"] = course_features
-            
-    # 5. 最終JSONファイルへの出力
-    output_data = {
-        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "features": all_features_for_model
-    }
-    output_filename_full_path = os.path.join(base_dir, OUTPUT_CACHE_FILE)
-    
-    with open(output_filename_full_path, 'w', encoding='utf-8') as f:
-        json.dump(output_data, f, ensure_ascii=False, indent=4)
 
-    print(f"\n✅ 特徴量計算が完了し、XGBoost予測用キャッシュ '{output_filename_full_path}' が生成されました。")
+    conn.close()
+
+    # 差分モードで入力が何も変わっていなければ出力を書き換えない
+    total_rows = sum(course_row_counts)
+    print(f"再計算した行数: {recomputed_rows} / {total_rows}")
+    metrics.inc('rows_total', total_rows, stage='feature')
+    metrics.inc('recomputed_rows_total', recomputed_rows, stage='feature')
+    metrics.inc('courses_total', len(course_keys), stage='feature')
+    unchanged_layout = set(old_feature_state) == set(new_feature_state) and all(
+        np.array_equal(old_feature_state[r]['day_hashes'], new_feature_state[r]['day_hashes'])
+        for r in new_feature_state
+    )
+    if incremental and recomputed_rows == 0 and unchanged_layout:
+        print("✅ 入力に変更がないため、特徴量キャッシュは前回のものをそのまま使用します。")
+        # 特徴量が同じでも、本番モデルが切り替わっていれば予測だけやり直す
+        if predict and not prediction_is_current(base_dir):
+            generate_predictions(base_dir)
+        return
+
+    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    # 5. カラム形式キャッシュ (float32行列 + インデックス) の出力
+    write_feature_cache(
+        base_dir,
+        np.concatenate(matrix_blocks) if matrix_blocks else np.empty((0, len(MODEL_FEATURE_ORDER))),
+        course_keys, course_elev_index, course_row_counts, row_dates,
+        timestamp, MODEL_FEATURE_ORDER
+    )
+    # 状態はキャッシュの公開後に保存する (途中で止まっても次回は再計算される)
+    save_feature_state(base_dir, new_feature_state)
+    print(f"\n✅ カラム形式の特徴量キャッシュ '{resolve_artifact(base_dir, FEATURE_MATRIX_FILE)}' を生成しました。")
+
+    # 6. デバッグ用JSONファイルへの出力
+    if write_json:
+        output_data = {
+            "timestamp": timestamp,
+            "features": all_features_for_model
+        }
+        output_filename_full_path = os.path.join(base_dir, OUTPUT_CACHE_FILE)
+
+        atomic_write(output_filename_full_path, lambda f: json.dump(output_data, f, ensure_ascii=False, indent=4), mode='w')
+
+        print(f"✅ 特徴量計算が完了し、XGBoost予測用キャッシュ '{output_filename_full_path}' が生成されました。")
+
+    # 7. 全リゾート・全コースを1回のバッチで予測し、結果を保存
+    if predict:
+        generate_predictions(base_dir)
 
 
 # --- 実行 ---
 if __name__ == '__main__':
-    generate_xgboost_features()
\ No newline at end of file
+    # --incremental: 入力が変わったコース・日だけを再計算する
+    generate_xgboost_features(incremental='--incremental' in sys.argv[1:])
+    # --profile: コース標高に加えて、ベース〜山頂の標高グリッドでも予測する
+    if '--profile' in sys.argv[1:]:
+        from elevation_profile import generate_elevation_profiles
+        generate_elevation_profiles(os.path.dirname(os.path.abspath(__file__)))
+    # --ensemble: 予報の誤差を摂動したアンサンブルで確率の信頼区間も求める
+    if '--ensemble' in sys.argv[1:]:
+        from forecast_ensemble import generate_forecast_ensemble
+        generate_forecast_ensemble(os.path.dirname(os.path.abspath(__file__)))
+    # --timeline: 3時間ごとの予報から時間帯別のタイムラインも予測する
+    if '--timeline' in sys.argv[1:]:
+        from subdaily_timeline import generate_subdaily_timeline
+        generate_subdaily_timeline(os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,170 @@
+import argparse
+import os
+from datetime import datetime
+
+import numpy as np
+
+import metrics
+from calculation import (
+    compute_feature_matrix, station_adjustments, initial_history_from_states, current_station_states,
+    MODEL_FEATURE_ORDER
+)
+from prediction import load_model
+from resort_registry import load_resort_registry
+from snapshots import publish_artifacts, resolve_artifact
+from weather_store import open_store, latest_forecast, WEATHER_DB_FILE
+
+# --- 定数とファイル名 ---
+# 標高プロファイル (ベース〜山頂の標高グリッド × 予報日) の予測結果
+PROFILE_CACHE_FILE = 'XGBoost_Profile_Cache.npz'
+# 標高グリッドの間隔 (m)
+PROFILE_STEP_M = 10
+# 一度に predict_proba に渡す行数 (細かいグリッドでもメモリを一定に保つ)
+PROFILE_BATCH_ROWS = 100_000
+FORECAST_COLUMNS = ['temp_min_c', 'temp_max_c', 'wind_avg_ms', 'snowfall_cm']
+
+
+# --- 標高グリッド ---
+def elevation_grid(registry, resort, step=PROFILE_STEP_M):
+    """最下部のコースから山頂 (リゾート標高) までの標高グリッド (昇順、コース標高を含む)"""
+    courses = registry.courses(resort)
+    base = min(courses)
+    summit = max(max(courses), registry.resorts[resort]['elev'])
+    return np.union1d(np.append(np.arange(base, summit, step), summit), courses).astype(np.int64)
+
+
+def find_transitions(elevs, classes):
+    """標高を上がる方向で最上位の雪面状態が変わる位置を返す
+
+    classes は (標高 × 日)。戻り値は (日の番号, 変わった後の最初の標高, 下側のクラス, 上側のクラス)。
+    """
+    lower, upper = np.nonzero(classes[1:] != classes[:-1])
+    return upper, elevs[lower + 1], classes[lower, upper], classes[lower + 1, upper]
+
+
+# --- 一括計算 ---
+def predict_in_batches(model, matrix, batch_rows=PROFILE_BATCH_ROWS):
+    if len(matrix) == 0:
+        return np.empty((0, model.n_classes_), dtype=np.float32)
+    return np.concatenate([
+        np.asarray(model.predict_proba(matrix[start:start + batch_rows]), dtype=np.float32)
+        for start in range(0, len(matrix), batch_rows)
+    ])
+
+
+@metrics.timed('inference', mode='profile')
+def generate_elevation_profiles(base_dir, step=PROFILE_STEP_M, model=None):
+    """全リゾートの標高グリッド × 予報日の確率を一括で計算し、状態が変わる標高と一緒に保存する
+
+    引き継ぎ状態は calculation.py と同じ観測所チェックポイントを使うので、
+    コース標高の行はコース別の予測結果と一致する。
+    """
+    store_path = os.path.join(base_dir, WEATHER_DB_FILE)
+    if not os.path.exists(store_path):
+        print(f"エラー: 観測・予報ストア '{store_path}' が見つかりません。")
+        return None
+
+    registry = load_resort_registry()
+    conn = open_store(store_path)
+    adj_vals = station_adjustments(registry)
+    initial_history = initial_history_from_states(current_station_states(conn, base_dir, adj_vals), adj_vals)
+
+    # A. リゾートごとに (標高 × 日 × 特徴量) を1回のブロードキャストで計算
+    resort_keys, grids, resort_dates, blocks = [], [], [], []
+    for resort in registry.resorts:
+        past_base = initial_history.get(registry.station_of(resort))
+        forecast = latest_forecast(conn, resort, keys=FORECAST_COLUMNS)
+        if past_base is None or len(forecast['dates']) == 0:
+            print(f"注意: {resort} の過去データまたは予報データが無いため、プロファイルをスキップします。")
+            continue
+        grid = elevation_grid(registry, resort, step)
+        features = compute_feature_matrix(
+            *(forecast[col] for col in FORECAST_COLUMNS), grid, registry.amedas_elev(resort),
+            past_base['PrevDayMaxTemp'], past_base['CumulativeHeatHistoryBase'], past_base['MaxSnowDepth']
+        )
+        resort_keys.append(resort)
+        grids.append(grid)
+        resort_dates.append(forecast['dates'].astype(str))
+        blocks.append(features.reshape(-1, len(MODEL_FEATURE_ORDER)))
+    conn.close()
+
+    # B. 全リゾート分を1つの行列にまとめてバッチ予測
+    matrix = np.concatenate(blocks).astype(np.float32) if blocks else np.empty((0, len(MODEL_FEATURE_ORDER)), np.float32)
+    if model is None:
+        model = load_model(base_dir)
+    probabilities = predict_in_batches(model, matrix)
+    classes = np.argmax(probabilities, axis=1).astype(np.int8) if len(probabilities) else np.empty(0, np.int8)
+
+    # C. 状態が変わる標高をリゾート・日ごとに抽出
+    transitions = {key: [] for key in ('resorts', 'dates', 'elevs', 'from_classes', 'to_classes')}
+    offsets = np.concatenate([[0], np.cumsum([len(g) * len(d) for g, d in zip(grids, resort_dates)], dtype=np.int64)])
+    for resort, grid, dates, start, stop in zip(resort_keys, grids, resort_dates, offsets[:-1], offsets[1:]):
+        day, elev, lower, upper = find_transitions(grid, classes[start:stop].reshape(len(grid), len(dates)))
+        transitions['resorts'].extend([resort] * len(day))
+        transitions['dates'].extend(dates[day])
+        transitions['elevs'].extend(elev)
+        transitions['from_classes'].extend(lower)
+        transitions['to_classes'].extend(upper)
+
+    arrays = dict(
+        resort_keys=np.asarray(resort_keys, dtype=str),
+        row_offsets=offsets,
+        elevs=np.concatenate(grids) if grids else np.empty(0, np.int64),
+        elev_offsets=np.concatenate([[0], np.cumsum([len(g) for g in grids], dtype=np.int64)]),
+        dates=np.concatenate(resort_dates) if resort_dates else np.empty(0, str),
+        date_offsets=np.concatenate([[0], np.cumsum([len(d) for d in resort_dates], dtype=np.int64)]),
+        probabilities=probabilities,
+        classes=classes,
+        transition_resorts=np.asarray(transitions['resorts'], dtype=str),
+        transition_dates=np.asarray(transitions['dates'], dtype=str),
+        transition_elevs=np.asarray(transitions['elevs'], dtype=np.int64),
+        transition_from=np.asarray(transitions['from_classes'], dtype=np.int8),
+        transition_to=np.asarray(transitions['to_classes'], dtype=np.int8),
+        step=np.asarray(step),
+        timestamp=np.asarray(datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+    )
+    publish_artifacts(base_dir, {PROFILE_CACHE_FILE: lambda f: np.savez(f, **arrays)})
+    print(f"✅ {len(resort_keys)}リゾート / {len(matrix)}行の標高プロファイル '{PROFILE_CACHE_FILE}' を生成しました "
+          f"({step}m 間隔)。")
+    return probabilities
+
+
+# --- 読み込み ---
+def load_profile_cache(base_dir):
+    """標高プロファイルを読み込み、リゾートごとの (標高 × 日) 配列に分ける"""
+    with np.load(resolve_artifact(base_dir, PROFILE_CACHE_FILE), allow_pickle=False) as npz:
+        cache = {key: npz[key] for key in npz.files}
+
+    profiles = {}
+    for i, resort in enumerate(cache['resort_keys'].tolist()):
+        elevs = cache['elevs'][cache['elev_offsets'][i]:cache['elev_offsets'][i + 1]]
+        dates = cache['dates'][cache['date_offsets'][i]:cache['date_offsets'][i + 1]]
+        rows = slice(cache['row_offsets'][i], cache['row_offsets'][i + 1])
+        is_resort = cache['transition_resorts'] == resort
+        profiles[resort] = {
+            'elevs': elevs,
+            'dates': dates,
+            'probabilities': cache['probabilities'][rows].reshape(len(elevs), len(dates), -1),
+            'classes': cache['classes'][rows].reshape(len(elevs), len(dates)),
+            'transitions': {
+                'dates': cache['transition_dates'][is_resort],
+                'elevs': cache['transition_elevs'][is_resort],
+                'from_classes': cache['transition_from'][is_resort],
+                'to_classes': cache['transition_to'][is_resort],
+            },
+        }
+    return {'profiles': profiles, 'step': int(cache['step']), 'timestamp': str(cache['timestamp'])}
+
+
+# --- 実行 ---
+if __name__ == '__main__':
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        base_dir = os.getcwd()
+
+    parser = argparse.ArgumentParser(description='ベース〜山頂の標高グリッドで雪面状態を予測する')
+    parser.add_argument('--step', type=int, default=PROFILE_STEP_M, help='標高グリッドの間隔 (m)')
+    args = parser.parse_args()
+
+    generate_elevation_profiles(base_dir, args.step)
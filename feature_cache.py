@@ -0,0 +1,90 @@
+import numpy as np
+import json
+import os
+
+from snapshots import publish_artifacts, read_manifest, resolve_artifact
+
+# --- 定数とファイル名 ---
+# 特徴量行列 (float32, MODEL_FEATURE_ORDER順) 。mmapでそのまま開ける .npy 形式
+FEATURE_MATRIX_FILE = 'XGBoost_Features_Cache.npy'
+# コース・日付のインデックス配列
+FEATURE_INDEX_FILE = 'XGBoost_Features_Index.npz'
+
+
+# --- 書き出し ---
+def write_feature_cache(base_dir, feature_matrix, course_keys, course_elevs, course_row_counts, dates,
+                        timestamp, feature_order):
+    """(行 × 特徴量) の行列とコース/日付インデックスをカラム形式で保存する
+
+    feature_matrix の行はコース順に連続して並んでいる前提で、
+    course_offsets[i]:course_offsets[i+1] が i 番目のコースの行になる。
+    行列とインデックスは同じバージョンのスナップショットとして一度に公開する。
+    """
+    feature_matrix = np.ascontiguousarray(feature_matrix, dtype=np.float32)
+    course_elevs = np.asarray(course_elevs, dtype=np.int64)
+    course_offsets = np.concatenate([[0], np.cumsum(course_row_counts, dtype=np.int64)])
+
+    index = dict(
+        course_keys=np.asarray(course_keys, dtype=str),
+        course_elevs=course_elevs,
+        course_offsets=course_offsets,
+        dates=np.asarray(dates, dtype=str),
+        timestamp=np.asarray(timestamp),
+        feature_order=np.asarray(feature_order, dtype=str)
+    )
+    publish_artifacts(base_dir, {
+        FEATURE_MATRIX_FILE: lambda f: np.save(f, feature_matrix),
+        FEATURE_INDEX_FILE: lambda f: np.savez(f, **index),
+    })
+
+
+# --- 読み込み ---
+def load_feature_cache(base_dir, mmap=True):
+    """特徴量行列をmmapで開き、インデックスと一緒に返す
+
+    戻り値の matrix はコピーせず model.predict_proba にそのまま渡せる。
+    行列とインデックスは同じマニフェストから解決する (別々のバージョンを組み合わせないため)。
+    """
+    manifest = read_manifest(base_dir)
+    matrix = np.load(resolve_artifact(base_dir, FEATURE_MATRIX_FILE, manifest), mmap_mode='r' if mmap else None)
+    with np.load(resolve_artifact(base_dir, FEATURE_INDEX_FILE, manifest), allow_pickle=False) as npz:
+        index = {key: npz[key] for key in npz.files}
+    index['timestamp'] = str(index['timestamp'])
+    index['course_slices'] = build_course_slices(index)
+    return matrix, index
+
+
+def build_course_slices(index):
+    """コースキーから行範囲 (slice) への対応表を作る"""
+    return {
+        str(key): slice(int(start), int(stop))
+        for key, start, stop in zip(index['course_keys'], index['course_offsets'][:-1], index['course_offsets'][1:])
+    }
+
+
+# --- デバッグ用 JSON エクスポート ---
+def export_feature_cache_json(matrix, index, output_path):
+    """カラム形式のキャッシュを従来の XGBoost_Features_Cache.json 形式で書き出す"""
+    features = {}
+    for key, elev in zip(index['course_keys'], index['course_elevs']):
+        rows = index['course_slices'][str(key)]
+        features[str(key)] = [
+            {'Date': str(day), 'Course': int(elev), 'Features': values}
+            for day, values in zip(index['dates'][rows], matrix[rows].astype(float).tolist())
+        ]
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump({"timestamp": index['timestamp'], "features": features}, f, ensure_ascii=False, indent=4)
+
+
+# --- 実行 (カラム形式キャッシュからJSONを書き出す) ---
+if __name__ == '__main__':
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        base_dir = os.getcwd()
+
+    matrix, index = load_feature_cache(base_dir)
+    output_path = os.path.join(base_dir, 'XGBoost_Features_Cache.debug.json')
+    export_feature_cache_json(matrix, index, output_path)
+    print(f"✅ カラム形式キャッシュをJSONに書き出しました: {output_path}")
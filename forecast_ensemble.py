@@ -0,0 +1,242 @@
+import argparse
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+
+import metrics
+from calculation import (
+    compute_feature_matrix, station_adjustments, initial_history_from_states, current_station_states,
+    load_forecast_groups,
+    MODEL_FEATURE_ORDER
+)
+from prediction import load_model
+from resort_registry import load_resort_registry
+from snapshots import publish_artifacts, resolve_artifact
+from weather_store import open_store, WEATHER_DB_FILE
+
+# --- 定数とファイル名 ---
+# 予報の誤差を摂動したアンサンブルの予測結果 (平均確率と信頼区間)
+ENSEMBLE_CACHE_FILE = 'XGBoost_Ensemble_Cache.npz'
+ENSEMBLE_MEMBERS = 1000
+ENSEMBLE_SEED = 0
+# 一度に特徴量を作って予測する行数 (メンバー数によらずメモリ使用量をこの程度に抑える)
+ENSEMBLE_BATCH_ROWS = 200_000
+# 信頼区間の分位点
+BAND_QUANTILES = (0.05, 0.95)
+# 分位点を求める確率のヒストグラムの分割数 (全メンバーの確率を保持しないため)
+BAND_BINS = 100
+# 予報要素ごとの誤差分布: (種類, 初日の標準偏差, 予報日が1日先になるごとの増分)
+# additive は正規分布の加算 (℃)、multiplicative は平均を保つ対数正規分布の乗算
+FORECAST_ERRORS = {
+    'temp_min_c': ('additive', 1.0, 0.4),
+    'temp_max_c': ('additive', 1.0, 0.4),
+    'wind_avg_ms': ('multiplicative', 0.15, 0.05),
+    'snowfall_cm': ('multiplicative', 0.4, 0.1),
+}
+ENSEMBLE_COLUMNS = ['temp_min_c', 'temp_max_c', 'wind_avg_ms', 'snowfall_cm']
+
+
+# --- 予報の摂動 ---
+def perturb_forecasts(day_arrays, course_resorts, n_members, rng, errors=FORECAST_ERRORS):
+    """予報 (要素 × コース × 日) にリードタイムとともに広がる誤差を加えたメンバーを作る
+
+    誤差はリゾートごとに1つ引き、同じリゾートのコースには同じ誤差を使う (予報は同じ地点の値のため)。
+    戻り値は (要素 × メンバー × コース × 日)。
+    """
+    n_days = day_arrays.shape[-1]
+    resorts, course_index = np.unique(course_resorts, return_inverse=True)
+    lead = np.arange(n_days)
+    perturbed = np.empty((len(ENSEMBLE_COLUMNS), n_members) + day_arrays.shape[1:])
+    for i, col in enumerate(ENSEMBLE_COLUMNS):
+        kind, sd0, growth = errors[col]
+        sd = sd0 + growth * lead
+        noise = (rng.standard_normal((n_members, len(resorts), n_days)) * sd)[:, course_index]
+        if kind == 'additive':
+            perturbed[i] = day_arrays[i] + noise
+        else:
+            perturbed[i] = day_arrays[i] * np.exp(noise - sd**2 / 2)
+
+    # 最低気温が最高気温を上回らないように並べ直し、風速・降雪量は0以上にする
+    perturbed[0], perturbed[1] = np.minimum(perturbed[0], perturbed[1]), np.maximum(perturbed[0], perturbed[1])
+    np.maximum(perturbed[2:], 0, out=perturbed[2:])
+    return perturbed
+
+
+# --- 確率の集計 (メンバー数によらない大きさの配列に積算する) ---
+class EnsembleAccumulator:
+    """(コース × 日 × クラス) ごとの確率の合計・最上位クラスの票数・確率のヒストグラムを積算する"""
+
+    def __init__(self, shape, bins=BAND_BINS):
+        self.bins = bins
+        self.n_members = 0
+        self.prob_sum = np.zeros(shape)
+        self.votes = np.zeros(shape, dtype=np.int64)
+        self.hist = np.zeros(shape + (bins,), dtype=np.int64)
+        self._offsets = np.arange(int(np.prod(shape))).reshape(shape) * bins
+
+    def add(self, probabilities):
+        """メンバー分の確率 (メンバー × コース × 日 × クラス) を加える"""
+        self.n_members += len(probabilities)
+        self.prob_sum += probabilities.sum(axis=0)
+        top = np.argmax(probabilities, axis=-1)
+        self.votes += (top[..., None] == np.arange(probabilities.shape[-1])).sum(axis=0)
+        bins = np.minimum((probabilities * self.bins).astype(np.int64), self.bins - 1)
+        self.hist += np.bincount(
+            (self._offsets + bins).ravel(), minlength=self.hist.size
+        ).reshape(self.hist.shape)
+
+    def quantile(self, q):
+        """ヒストグラムから確率の分位点を求める (ビンの中央値)"""
+        cumulative = np.cumsum(self.hist, axis=-1)
+        index = np.argmax(cumulative >= max(q * self.n_members, 1), axis=-1)
+        return (index + 0.5) / self.bins
+
+    def summary(self):
+        return {
+            'mean': self.prob_sum / self.n_members,
+            'lower': self.quantile(BAND_QUANTILES[0]),
+            'upper': self.quantile(BAND_QUANTILES[1]),
+            'vote_share': self.votes / self.n_members,
+        }
+
+
+# --- アンサンブル予測 ---
+def score_ensemble(model, day_arrays, course_resorts, course_elevs, amedas_elevs, base_state,
+                   n_members=ENSEMBLE_MEMBERS, seed=ENSEMBLE_SEED, batch_rows=ENSEMBLE_BATCH_ROWS):
+    """予報が同じ日付のコース群 (C × D) について、n_members 通りのシナリオを一定行数ずつ予測して集計する"""
+    rng = np.random.default_rng(seed)
+    n_courses, n_days = day_arrays.shape[1:]
+    accumulator = EnsembleAccumulator((n_courses, n_days, model.n_classes_))
+    members_per_batch = max(1, batch_rows // (n_courses * n_days))
+    course_elevs = np.asarray(course_elevs)[:, None]
+    amedas_elevs = np.asarray(amedas_elevs, dtype=float)[:, None]
+    states = [np.asarray(v, dtype=float)[:, None] for v in base_state]
+
+    for start in range(0, n_members, members_per_batch):
+        m = min(members_per_batch, n_members - start)
+        temp_min, temp_max, wind_avg, snowfall = perturb_forecasts(day_arrays, course_resorts, m, rng)
+        # (メンバー × コース) をバッチ次元にして特徴量を一括計算
+        features = compute_feature_matrix(
+            temp_min, temp_max, wind_avg, snowfall, course_elevs, amedas_elevs, *states
+        )[:, :, 0]
+        probabilities = model.predict_proba(
+            features.reshape(-1, len(MODEL_FEATURE_ORDER)).astype(np.float32)
+        )
+        accumulator.add(np.asarray(probabilities).reshape(m, n_courses, n_days, -1))
+    return accumulator.summary()
+
+
+@metrics.timed('inference', mode='ensemble')
+def generate_forecast_ensemble(base_dir, n_members=ENSEMBLE_MEMBERS, seed=ENSEMBLE_SEED, model=None):
+    """全リゾート・全コースのアンサンブル予測を行い、予測結果キャッシュと同じ行順で保存する"""
+    store_path = os.path.join(base_dir, WEATHER_DB_FILE)
+    if not os.path.exists(store_path):
+        print(f"エラー: 観測・予報ストア '{store_path}' が見つかりません。")
+        return None
+
+    registry = load_resort_registry()
+    conn = open_store(store_path)
+    adj_vals = station_adjustments(registry)
+    initial_history = initial_history_from_states(current_station_states(conn, base_dir, adj_vals), adj_vals)
+    resort_groups, forecasts = load_forecast_groups(conn, registry, initial_history)
+    conn.close()
+    if model is None:
+        model = load_model(base_dir)
+
+    # A. 予報の日付が同じリゾートの全コースをまとめて処理
+    start_time = time.perf_counter()
+    resort_results = {}
+    for dates, resorts in resort_groups.items():
+        day_blocks, resort_blocks, elev_blocks, amedas_blocks, state_blocks = [], [], [], [], []
+        for resort in resorts:
+            past_base = initial_history[registry.station_of(resort)]
+            courses = registry.courses(resort)
+            n_courses = len(courses)
+            day_blocks.append(np.stack([
+                np.broadcast_to(forecasts[resort][col], (n_courses, len(dates))) for col in ENSEMBLE_COLUMNS
+            ]))
+            resort_blocks.append([resort] * n_courses)
+            elev_blocks.append(courses)
+            amedas_blocks.append([registry.amedas_elev(resort)] * n_courses)
+            state_blocks.append(np.tile(
+                [past_base['PrevDayMaxTemp'], past_base['CumulativeHeatHistoryBase'], past_base['MaxSnowDepth']],
+                (n_courses, 1)
+            ))
+
+        summary = score_ensemble(
+            model, np.concatenate(day_blocks, axis=1), np.concatenate(resort_blocks),
+            np.concatenate(elev_blocks), np.concatenate(amedas_blocks), np.concatenate(state_blocks).T,
+            n_members, seed
+        )
+        offset = 0
+        for resort, courses in zip(resorts, elev_blocks):
+            rows = slice(offset, offset + len(courses))
+            resort_results[resort] = (list(dates), {key: values[rows] for key, values in summary.items()})
+            offset += len(courses)
+
+    # B. レジストリの定義順 (コース → 日) に並べて保存
+    course_keys, course_elevs, row_counts, row_dates = [], [], [], []
+    blocks = {key: [] for key in ('mean', 'lower', 'upper', 'vote_share')}
+    for resort in registry.resorts:
+        if resort not in resort_results:
+            continue
+        dates, summary = resort_results[resort]
+        for ci, course_elev in enumerate(registry.courses(resort)):
+            course_keys.append(f"{resort}_{course_elev}m")
+            course_elevs.append(course_elev)
+            row_counts.append(len(dates))
+            row_dates.extend(dates)
+            for key in blocks:
+                blocks[key].append(summary[key][ci])
+
+    n_classes = model.n_classes_
+    arrays = dict(
+        course_keys=np.asarray(course_keys, dtype=str),
+        course_elevs=np.asarray(course_elevs, dtype=np.int64),
+        course_offsets=np.concatenate([[0], np.cumsum(row_counts, dtype=np.int64)]),
+        dates=np.asarray(row_dates, dtype=str),
+        **{
+            key: (np.concatenate(values) if values else np.empty((0, n_classes))).astype(np.float32)
+            for key, values in blocks.items()
+        },
+        n_members=np.asarray(n_members),
+        band_quantiles=np.asarray(BAND_QUANTILES),
+        forecast_errors=np.asarray(json.dumps(FORECAST_ERRORS)),
+        timestamp=np.asarray(datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+    )
+    publish_artifacts(base_dir, {ENSEMBLE_CACHE_FILE: lambda f: np.savez(f, **arrays)})
+    n_rows = sum(row_counts) * n_members
+    print(f"✅ {len(course_keys)}コース × {n_members}メンバー ({n_rows}行) のアンサンブル予測 "
+          f"'{ENSEMBLE_CACHE_FILE}' を生成しました ({time.perf_counter() - start_time:.1f}秒)。")
+    return resort_results
+
+
+# --- 読み込み ---
+def load_ensemble_cache(base_dir):
+    """アンサンブル予測を読み込む (行の並びは予測結果キャッシュと同じ)"""
+    from feature_cache import build_course_slices
+
+    with np.load(resolve_artifact(base_dir, ENSEMBLE_CACHE_FILE), allow_pickle=False) as npz:
+        cache = {key: npz[key] for key in npz.files}
+    cache['timestamp'] = str(cache['timestamp'])
+    cache['n_members'] = int(cache['n_members'])
+    cache['course_slices'] = build_course_slices(cache)
+    return cache
+
+
+# --- 実行 ---
+if __name__ == '__main__':
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        base_dir = os.getcwd()
+
+    parser = argparse.ArgumentParser(description='予報の誤差を摂動したアンサンブルで雪面状態の確率と信頼区間を求める')
+    parser.add_argument('--members', type=int, default=ENSEMBLE_MEMBERS)
+    parser.add_argument('--seed', type=int, default=ENSEMBLE_SEED)
+    args = parser.parse_args()
+
+    generate_forecast_ensemble(base_dir, args.members, args.seed)
@@ -0,0 +1,100 @@
+import os
+import random
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import metrics
+
+# --- 通信設定 ---
+# ホストごとの最大リクエスト数 (回/秒)。記載のないホスト (ローカルのモックなど) は制限なし
+# OpenWeatherMap は無料プランの上限 (60回/分) に合わせ、有料プランでは OWM_RATE_LIMIT で引き上げる
+HOST_RATE_LIMITS = {
+    'api.openweathermap.org': float(os.environ.get('OWM_RATE_LIMIT', '1.0')),
+    'www.data.jma.go.jp': 2.0
+}
+MAX_RETRIES = 3
+BACKOFF_BASE_SEC = 0.5
+BACKOFF_MAX_SEC = 10.0
+# 再試行するHTTPステータス (レート制限とサーバーエラー)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+# --- ホスト単位のレート制限 ---
+class HostRateLimiter:
+    """ホストごとにリクエストの間隔を空ける (スレッドセーフ)
+
+    呼び出しごとに次の送信枠を予約し、その時刻まで待つ。
+    """
+
+    def __init__(self, rates=None):
+        self.rates = dict(HOST_RATE_LIMITS if rates is None else rates)
+        self._next_slot = {}
+        self._lock = threading.Lock()
+
+    def wait(self, url):
+        host = urllib.parse.urlsplit(url).hostname
+        rate = self.rates.get(host)
+        if not rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + 1.0 / rate
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# --- コネクションプール付きセッション ---
+def create_session(pool_size=16):
+    """同一ホストへの接続を使い回すセッションを作る"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def backoff_delay(attempt, retry_after=None):
+    """指数バックオフ (ジッター付き)。Retry-After ヘッダーがあればそれを優先する"""
+    if retry_after is not None:
+        try:
+            return min(float(retry_after), BACKOFF_MAX_SEC)
+        except ValueError:
+            pass
+    return min(BACKOFF_BASE_SEC * (2 ** attempt), BACKOFF_MAX_SEC) * (0.5 + random.random() / 2)
+
+
+def get_with_retry(session, url, params=None, timeout=10, rate_limiter=None, max_retries=MAX_RETRIES, headers=None):
+    """GETリクエストを再試行付きで送る
+
+    接続エラー・タイムアウト・429/5xx はバックオフして再試行し、
+    それ以外の4xxはすぐに例外を送出する。
+    """
+    host = urllib.parse.urlsplit(url).hostname
+    for attempt in range(max_retries + 1):
+        if rate_limiter is not None:
+            rate_limiter.wait(url)
+        start = time.perf_counter()
+        try:
+            response = session.get(url, params=params, timeout=timeout, headers=headers)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            metrics.inc('http_requests_total', host=host, status=e.__class__.__name__)
+            if attempt == max_retries:
+                raise
+            metrics.inc('http_retries_total', host=host)
+            time.sleep(backoff_delay(attempt))
+            continue
+        metrics.observe('http_request_seconds', time.perf_counter() - start, host=host)
+        metrics.inc('http_requests_total', host=host, status=response.status_code)
+
+        if response.status_code in RETRY_STATUS and attempt < max_retries:
+            metrics.inc('http_retries_total', host=host)
+            time.sleep(backoff_delay(attempt, response.headers.get('Retry-After')))
+            continue
+
+        response.raise_for_status()
+        return response
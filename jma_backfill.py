@@ -0,0 +1,228 @@
+import argparse
+import datetime
+import json
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import requests
+
+from http_client import create_session, get_with_retry, HostRateLimiter
+from jma_parser import parse_daily_pages
+from response_cache import jma_month_ttl
+from P_yuzawa_minakami_deta import OBSERVATORIES, DATA_KEYS, JMA_BASE_URL
+
+# --- 定数とファイル名 ---
+# 全観測所・全期間の確定済みの日別観測値をまとめたデータベース (学習用)
+# 予測に使う観測・予報ストア (weather_store.sqlite) とは分けている:
+# - ストアはパイプラインが確認のたびに観測値全体をハッシュするので、数十年分を入れると毎回の確認が重くなる
+# - アーカイブは確定済みの月だけを (観測所, 日付) ごとに1行で持ち、取得時刻の履歴や取得元を持たない
+# どちらも同じ日別値ページを parse_daily_table で読み取った同じ列・品質フラグなので、重なる日の値は一致する
+# (確定後の月は気象庁側で変わらない)。ストアは直近の取得分、アーカイブは確定値を正とする。
+ARCHIVE_DB_FILE = 'jma_archive.sqlite'
+# 取得対象の冬季の月 (12〜3月) と開始年
+WINTER_MONTHS = (12, 1, 2, 3)
+BACKFILL_START_YEAR = 1990
+DEFAULT_WORKERS = 8
+# 取得したページをまとめてプロセスプールで解析する単位 (ページ数)
+PARSE_BATCH_PAGES = 64
+# ワーカー1つあたりの同時に投入しておく取得の数 (取得済みで未処理のページがメモリに溜まりすぎないため)
+IN_FLIGHT_PER_WORKER = 4
+# 日付以外の観測値の列 (DATA_KEYS と同じ並び)
+VALUE_KEYS = DATA_KEYS[1:]
+
+
+# --- データベース ---
+def open_archive(db_path):
+    """アーカイブを開き、無ければテーブルを作成する"""
+    conn = sqlite3.connect(db_path)
+    value_columns = ', '.join(f"{key} REAL, {key}_flag INTEGER" for key in VALUE_KEYS)
+    conn.executescript(f"""
+        CREATE TABLE IF NOT EXISTS stations (
+            station TEXT PRIMARY KEY, name TEXT, prec_no INTEGER, block_no TEXT
+        );
+        CREATE TABLE IF NOT EXISTS daily_observations (
+            station TEXT NOT NULL, date TEXT NOT NULL, {value_columns},
+            PRIMARY KEY (station, date)
+        );
+        CREATE TABLE IF NOT EXISTS backfill_units (
+            station TEXT NOT NULL, year INTEGER NOT NULL, month INTEGER NOT NULL,
+            n_rows INTEGER, completed_at TEXT,
+            PRIMARY KEY (station, year, month)
+        );
+    """)
+    return conn
+
+
+def completed_units(conn):
+    return set(conn.execute("SELECT station, year, month FROM backfill_units"))
+
+
+def save_unit(conn, station, year, month, table):
+    """1ヶ月分の観測値と完了記録を同じトランザクションで書き込む (途中で止まっても不整合にならない)
+
+    1行も読み取れなかった月 (メンテナンス中のページや空の表) は完了として記録せず False を返す。
+    """
+    rows = [
+        (station, datetime.date(year, month, int(day)).isoformat(),
+         *[v for pair in zip(values.tolist(), flags.tolist()) for v in pair])
+        for day, values, flags in zip(table['day'], table['values'], table['flags'])
+    ]
+    if not rows:
+        return False
+    placeholders = ', '.join(['?'] * (2 + 2 * len(VALUE_KEYS)))
+    with conn:
+        conn.executemany(f"INSERT OR REPLACE INTO daily_observations VALUES ({placeholders})", rows)
+        conn.execute(
+            "INSERT OR REPLACE INTO backfill_units VALUES (?, ?, ?, ?, ?)",
+            (station, year, month, len(rows), datetime.datetime.now().isoformat())
+        )
+    return True
+
+
+# --- 取得対象 ---
+def winter_units(stations, start_year, today=None):
+    """(観測所, 年, 月) の一覧。確定済みの冬季の月だけを対象にする"""
+    today = today or datetime.date.today()
+    units = []
+    for station in stations:
+        for year in range(start_year, today.year + 1):
+            for month in WINTER_MONTHS:
+                if datetime.date(year, month, 1) > today or jma_month_ttl(year, month, today) is not None:
+                    continue
+                units.append((station, year, month))
+    return units
+
+
+def fetch_unit(session, rate_limiter, base_url, observatory, year, month):
+    params = {
+        'prec_no': observatory['prec_no'],
+        'block_no': observatory['block_no'],
+        'year': year,
+        'month': month,
+        'day': 1,
+        'view': 'p1'
+    }
+    response = get_with_retry(session, base_url, params=params, timeout=20, rate_limiter=rate_limiter)
+    response.encoding = 'EUC-JP'
+    return response.text
+
+
+# --- バックフィル本体 ---
+def run_backfill(observatories, db_path, start_year=BACKFILL_START_YEAR, workers=DEFAULT_WORKERS,
+                 base_url=None, rate_limits=None, today=None, parse_workers=None):
+    """未完了の (観測所, 年, 月) をワーカープールで取得してアーカイブに書き込む
+
+    取得はスレッドで並列に行い、取得したページは PARSE_BATCH_PAGES 件ずつプロセスプールで解析する
+    (解析は CPU 処理なので、取得スレッドの中で行うと GIL で直列になる)。取得は同時に
+    workers * IN_FLIGHT_PER_WORKER 件までしか投入せず、1件終わるごとに補充するので、
+    メモリに載るページは対象の件数によらずこの件数と解析待ちの分だけになる。
+    完了済みの単位はデータベースに記録されるので、中断後に再実行すると続きから再開する。
+    戻り値は (今回完了した数, 失敗した数)。
+    """
+    conn = open_archive(db_path)
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO stations VALUES (?, ?, ?, ?)",
+            [(key, obs.get('name'), obs['prec_no'], str(obs['block_no'])) for key, obs in observatories.items()]
+        )
+
+    done = completed_units(conn)
+    pending = [unit for unit in winter_units(observatories, start_year, today) if unit not in done]
+    print(f"対象 {len(pending) + len(done)}件 / 完了済み {len(done)}件 / 残り {len(pending)}件")
+
+    session = create_session(pool_size=workers)
+    rate_limiter = HostRateLimiter(rate_limits)
+    completed, failed = 0, 0
+    fetched = []  # [((観測所, 年, 月), ページ), ...] 解析待ち
+
+    def parse_and_save():
+        nonlocal completed, failed
+        tables = parse_daily_pages([page for _, page in fetched], executor=parser_pool)
+        # 書き込みはメインスレッドだけで行う
+        for (station, year, month), table in zip((unit for unit, _ in fetched), tables):
+            if not save_unit(conn, station, year, month, table):
+                failed += 1
+                print(f"エラー: {station} {year}年{month}月のページに観測値がありません (次回再実行時に再取得)")
+                continue
+            completed += 1
+            if completed % 50 == 0:
+                print(f"-> {completed}/{len(pending)}件 完了")
+        fetched.clear()
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    parser_pool = ProcessPoolExecutor(max_workers=parse_workers)
+    try:
+        units = iter(pending)
+        in_flight = {}
+
+        def refill():
+            for station, year, month in units:
+                future = executor.submit(
+                    fetch_unit, session, rate_limiter, base_url or JMA_BASE_URL, observatories[station], year, month)
+                in_flight[future] = (station, year, month)
+                if len(in_flight) >= workers * IN_FLIGHT_PER_WORKER:
+                    return
+
+        refill()
+        while in_flight:
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                # 処理したら手放す (Future がページを保持し続けないように)
+                station, year, month = in_flight.pop(future)
+                try:
+                    fetched.append(((station, year, month), future.result()))
+                except requests.exceptions.RequestException as e:
+                    failed += 1
+                    print(f"エラー: {station} {year}年{month}月の取得に失敗しました (次回再実行時に再取得): {e}")
+                    continue
+                if len(fetched) >= PARSE_BATCH_PAGES:
+                    parse_and_save()
+            refill()
+        if fetched:
+            parse_and_save()
+    finally:
+        # 中断時は未着手の取得を取り消す (完了分はコミット済み。解析待ちのページは次回再取得する)
+        executor.shutdown(wait=True, cancel_futures=True)
+        parser_pool.shutdown(wait=True, cancel_futures=True)
+        session.close()
+        conn.close()
+
+    print(f"✅ バックフィル完了: 今回 {completed}件 / 失敗 {failed}件 → '{db_path}'")
+    return completed, failed
+
+
+def load_observatories(station_file=None, station_keys=None):
+    """観測所の一覧 (OBSERVATORIES と同じ形式のJSONファイルで追加・置き換え可能)"""
+    observatories = dict(OBSERVATORIES)
+    if station_file:
+        with open(station_file, 'r', encoding='utf-8') as f:
+            observatories = json.load(f)
+    if station_keys:
+        observatories = {key: observatories[key] for key in station_keys}
+    return observatories
+
+
+# --- 実行 ---
+if __name__ == '__main__':
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        base_dir = os.getcwd()
+
+    parser = argparse.ArgumentParser(description='気象庁の冬季日別観測値を一括取得する (中断しても再開可能)')
+    parser.add_argument('--stations', nargs='*', help='取得する観測所キー (省略時は全観測所)')
+    parser.add_argument('--station-file', help='観測所の一覧 (OBSERVATORIES と同じ形式のJSON)')
+    parser.add_argument('--start-year', type=int, default=BACKFILL_START_YEAR)
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS)
+    parser.add_argument('--parse-workers', type=int, help='ページを解析するプロセス数 (既定はCPU数)')
+    parser.add_argument('--db', default=os.path.join(base_dir, ARCHIVE_DB_FILE))
+    parser.add_argument('--base-url', help='daily_a1.php のURL (モックサーバーを使う場合)')
+    args = parser.parse_args()
+
+    run_backfill(
+        load_observatories(args.station_file, args.stations), args.db,
+        start_year=args.start_year, workers=args.workers, base_url=args.base_url, parse_workers=args.parse_workers,
+        # ローカルのモックサーバーにはレート制限をかけない
+        rate_limits={} if args.base_url else None
+    )
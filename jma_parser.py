@@ -0,0 +1,91 @@
+import html
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# --- 定数 ---
+# daily_a1 の表 (tablefix1) から取り出す列
+# [1:降水計, 4:気温平均, 5:最高, 6:最低, 9:風速平均, 10:最大風速, 15:日照, 16:降雪計, 17:最深積雪]
+DAILY_COLUMNS = [1, 4, 5, 6, 9, 10, 15, 16, 17]
+
+# 品質記号のフラグ (ビットの組み合わせ)
+FLAG_QUASI = 1          # ")" 準正常値
+FLAG_INSUFFICIENT = 2   # "]" 資料不足値
+FLAG_DOUBTFUL = 4       # "#" 疑問値
+FLAG_MISSING = 8        # "×" "///" 空欄 など値なし
+FLAG_NO_PHENOMENON = 16 # "--" 該当現象なし
+
+_TABLE_RE = re.compile(r'<table[^>]*\bid=["\']?tablefix1["\']?[^>]*>(.*?)</table>', re.S | re.I)
+_ROW_RE = re.compile(r'<tr\b[^>]*>(.*?)(?=<tr\b|\Z)', re.S | re.I)
+_CELL_RE = re.compile(r'<t[dh]\b[^>]*>(.*?)</t[dh]>', re.S | re.I)
+_TAG_RE = re.compile(r'<[^>]+>')
+_NUMBER_RE = re.compile(r'-?\d+(?:\.\d+)?')
+
+
+def _cell_text(cell_html):
+    """セルのHTMLからタグを除いたテキスト (BeautifulSoup の .text.strip() 相当)"""
+    return html.unescape(_TAG_RE.sub('', cell_html)).strip()
+
+
+def parse_cell(text):
+    """セルの文字列を (数値, 品質フラグ) に変換する"""
+    flags = 0
+    if ')' in text:
+        flags |= FLAG_QUASI
+    if ']' in text:
+        flags |= FLAG_INSUFFICIENT
+    if '#' in text:
+        flags |= FLAG_DOUBTFUL
+    if text == '--':
+        return np.nan, flags | FLAG_NO_PHENOMENON
+
+    number = _NUMBER_RE.search(text)
+    if number is None:
+        return np.nan, flags | FLAG_MISSING
+    return float(number.group()), flags
+
+
+# --- 日別表の抽出 ---
+def parse_daily_table(page_html, columns=DAILY_COLUMNS):
+    """daily_a1 ページの tablefix1 から必要な列だけを取り出す
+
+    木構造は作らず、正規表現 (C実装) で行とセルを順に走査する。戻り値は
+    'day' (int配列), 'values' (float配列 行 × 列), 'flags' (uint8配列 行 × 列),
+    'raw' (元の文字列のリスト) の辞書。
+    """
+    table = _TABLE_RE.search(page_html)
+    days, raw_rows = [], []
+    if table is not None:
+        for row in _ROW_RE.finditer(table.group(1)):
+            cells = _CELL_RE.findall(row.group(1))
+            if not cells:
+                continue
+            first = _cell_text(cells[0])
+            if not first.isdigit() or len(cells) <= max(columns):
+                continue
+            days.append(int(first))
+            raw_rows.append([_cell_text(cells[i]) for i in columns])
+
+    values = np.full((len(raw_rows), len(columns)), np.nan)
+    flags = np.zeros((len(raw_rows), len(columns)), dtype=np.uint8)
+    for r, raw in enumerate(raw_rows):
+        for c, text in enumerate(raw):
+            values[r, c], flags[r, c] = parse_cell(text)
+
+    return {'day': np.asarray(days, dtype=np.int16), 'values': values, 'flags': flags, 'raw': raw_rows}
+
+
+def parse_daily_pages(pages, max_workers=None, executor=None):
+    """複数ページをプロセスプールで並列に解析する (ページ数が少なければ逐次)
+
+    executor を渡すとそのプールを使い回す (バックフィルのように何度も呼ぶ場合にプロセスを作り直さない)。
+    """
+    pages = list(pages)
+    if len(pages) < 4 or (executor is None and max_workers == 1):
+        return [parse_daily_table(page) for page in pages]
+    chunksize = max(1, len(pages) // 32)
+    if executor is not None:
+        return list(executor.map(parse_daily_table, pages, chunksize=chunksize))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(parse_daily_table, pages, chunksize=chunksize))
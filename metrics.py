@@ -0,0 +1,233 @@
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+
+# --- 定数とファイル名 ---
+# メトリクスの出力先 (Prometheus の textfile 形式 '<ジョブ名>.prom' と構造化ログ)
+METRICS_DIR = os.environ.get('GELACON_METRICS_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metrics'))
+METRICS_LOG_FILE = 'events.jsonl'
+METRIC_PREFIX = 'gelacon_'
+# 処理時間のヒストグラムの区切り (秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+# 常駐プロセス (アプリ) で .prom を書き直す最短の間隔 (秒)
+FLUSH_INTERVAL_SEC = 10.0
+# 構造化ログをメモリに溜める行数の上限 (超えたら flush を待たずに書き出す)
+LOG_BUFFER_LINES = 1000
+# 構造化ログのサイズの上限と残す世代数 ('events.jsonl.1' 〜 '.<世代数>' に順に送る)
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 3
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (v.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+# --- 計測区間 ---
+class Span:
+    """with 文または start/end で区間の処理時間を計測する
+
+    終了時に '<接頭辞>span_seconds{span=...}' のヒストグラムに記録し、構造化ログに1行書く。
+    例外で終了した区間は status="error" として '<接頭辞>span_errors_total' も数える。
+    """
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end('ok' if exc_type is None else 'error')
+        return False
+
+    def end(self, status='ok'):
+        if self.start is None:
+            return
+        seconds = time.perf_counter() - self.start
+        self.start = None
+        labels = dict(self.labels, span=self.name)
+        self.registry.observe('span_seconds', seconds, **labels)
+        if status != 'ok':
+            self.registry.inc('span_errors_total', **labels)
+        self.registry.log('span', span=self.name, seconds=round(seconds, 6), status=status, **self.labels)
+
+
+# --- レジストリ ---
+class MetricsRegistry:
+    """プロセス内のカウンターとヒストグラム (スレッドセーフ)
+
+    記録はメモリ上の加算だけで、ファイルへの書き出しは flush (と終了時) に行う。
+    構造化ログも行をメモリに溜め、flush か LOG_BUFFER_LINES 行に達したときにまとめて追記する。
+    """
+
+    def __init__(self, metrics_dir=METRICS_DIR, job=None, buckets=LATENCY_BUCKETS):
+        self.metrics_dir = metrics_dir
+        self.job = job or os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0] or 'python'
+        self.buckets = tuple(buckets)
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        self._log_lines = []
+
+    def inc(self, name, value=1, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, _label_key(labels))
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                hist['buckets'][index] += 1
+            hist['sum'] += value
+            hist['count'] += 1
+
+    def span(self, name, **labels):
+        return Span(self, name, labels)
+
+    def start_span(self, name, **labels):
+        """with 文で囲めない区間用 (end() で終了する)"""
+        return self.span(name, **labels).__enter__()
+
+    def timed(self, name, **labels):
+        """関数全体を1つの区間として計測するデコレーター"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name, **labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def log(self, event, **fields):
+        """構造化ログ (JSON Lines) に1行加える (書き出しは flush か、溜まった行数が上限に達したとき)"""
+        record = {'ts': round(time.time(), 3), 'job': self.job, 'pid': os.getpid(), 'event': event, **fields}
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        with self._lock:
+            self._log_lines.append(line)
+            full = len(self._log_lines) >= LOG_BUFFER_LINES
+        if full:
+            self.flush_log()
+
+    def flush_log(self):
+        """溜めた構造化ログを1回の write で追記する (複数プロセスからの追記でも行は混ざらない)
+
+        追記後のサイズが LOG_MAX_BYTES を超える場合は、先に古いログを世代送りする。
+        """
+        with self._lock:
+            lines, self._log_lines = self._log_lines, []
+        if not lines:
+            return
+        data = ''.join(lines).encode('utf-8')
+        path = os.path.join(self.metrics_dir, METRICS_LOG_FILE)
+        try:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            try:
+                size = os.path.getsize(path)
+            except FileNotFoundError:
+                size = 0
+            if size and size + len(data) > LOG_MAX_BYTES:
+                rotate_log(path)
+            with open(path, 'ab', buffering=0) as f:
+                f.write(data)
+        except OSError:
+            pass
+
+    def reset(self):
+        """記録を破棄する (書き出し先を消す前に呼ぶと、終了時の flush で何も書かない)"""
+        with self._lock:
+            self.counters, self.histograms, self._log_lines = {}, {}, []
+
+    def render_prometheus(self):
+        """Prometheus のテキスト形式にする (ヒストグラムの bucket は累積値)"""
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, dict(hist, buckets=list(hist['buckets']))) for key, hist in self.histograms.items())
+
+        lines = []
+        last_name = None
+        for (name, key), value in counters:
+            metric = METRIC_PREFIX + name
+            if name != last_name:
+                lines.append(f"# TYPE {metric} counter")
+                last_name = name
+            lines.append(f"{metric}{_format_labels(key)} {value}")
+        last_name = None
+        for (name, key), hist in histograms:
+            metric = METRIC_PREFIX + name
+            if name != last_name:
+                lines.append(f"# TYPE {metric} histogram")
+                last_name = name
+            cumulative = 0
+            for bound, count in zip(self.buckets, hist['buckets']):
+                cumulative += count
+                lines.append(f"{metric}_bucket{_format_labels(key, [('le', repr(float(bound)))])} {cumulative}")
+            lines.append(f"{metric}_bucket{_format_labels(key, [('le', '+Inf')])} {hist['count']}")
+            lines.append(f"{metric}_sum{_format_labels(key)} {hist['sum']}")
+            lines.append(f"{metric}_count{_format_labels(key)} {hist['count']}")
+        return '\n'.join(lines) + '\n'
+
+    def flush(self, min_interval=0.0):
+        """溜めた構造化ログを追記し、'<ジョブ名>.prom' を一時ファイルから置き換えて書き出す
+
+        min_interval 秒以内の再書き出しは省く。
+        """
+        now = time.monotonic()
+        if min_interval and now - self._last_flush < min_interval:
+            return
+        self.flush_log()
+        if not self.counters and not self.histograms:
+            return
+        self._last_flush = now
+        try:
+            os.makedirs(self.metrics_dir, exist_ok=True)
+            path = os.path.join(self.metrics_dir, f"{self.job}.prom")
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(self.render_prometheus())
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+
+def rotate_log(path, backup_count=LOG_BACKUP_COUNT):
+    """path → path.1 → ... → path.<backup_count> と世代送りし、最も古いものを削除する"""
+    for i in range(backup_count, 0, -1):
+        source = path if i == 1 else f"{path}.{i - 1}"
+        if os.path.exists(source):
+            os.replace(source, f"{path}.{i}")
+    if backup_count == 0 and os.path.exists(path):
+        os.remove(path)
+
+
+# --- プロセス共通のレジストリ ---
+METRICS = MetricsRegistry()
+span = METRICS.span
+start_span = METRICS.start_span
+timed = METRICS.timed
+inc = METRICS.inc
+observe = METRICS.observe
+flush_metrics = METRICS.flush
+atexit.register(METRICS.flush)
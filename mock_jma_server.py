@@ -0,0 +1,131 @@
+import argparse
+import calendar
+import random
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# --- 定数 ---
+DAILY_PATH = '/stats/etrn/view/daily_a1.php'
+# daily_a1 の表の列数 (日付列を含む)
+N_COLUMNS = 21
+
+
+# --- 合成ページ (気象庁 daily_a1 と同じ表レイアウト) ---
+def synthetic_daily_page(prec_no, block_no, year, month):
+    """観測所・年月ごとに決まった乱数で daily_a1 ページを作る
+
+    品質記号 ")" "]" "#"、欠測 "×" "///"、該当現象なし "--" も一定の割合で混ぜる。
+    """
+    rng = random.Random(f"{prec_no}-{block_no}-{year}-{month}")
+    winter = month in (12, 1, 2, 3)
+    base_temp = rng.uniform(-4, 2) if winter else rng.uniform(8, 22)
+    snow_depth = rng.uniform(0, 80) if winter else 0.0
+
+    rows = []
+    for day in range(1, calendar.monthrange(year, month)[1] + 1):
+        t_avg = base_temp + rng.gauss(0, 3)
+        t_max = t_avg + abs(rng.gauss(4, 1.5))
+        t_min = t_avg - abs(rng.gauss(4, 1.5))
+        snowfall = max(0.0, rng.gauss(5, 10)) if winter and t_avg < 1 else 0.0
+        snow_depth = max(0.0, snow_depth + snowfall * 0.6 - max(t_max, 0) * 1.5)
+        values = [''] * N_COLUMNS
+        values[0] = f'<div class="a_print"><a href="../view/hourly_a1.php?day={day}">{day}</a></div>'
+        values[1] = f'{max(0.0, rng.gauss(3, 6)):.1f}'
+        values[4], values[5], values[6] = f'{t_avg:.1f}', f'{t_max:.1f}', f'{t_min:.1f}'
+        values[9] = f'{abs(rng.gauss(2.5, 1.2)):.1f}'
+        values[10] = f'{abs(rng.gauss(6, 2)):.1f}'
+        values[15] = f'{rng.uniform(0, 9):.1f}'
+        values[16] = f'{snowfall:.0f}' if snowfall >= 1 else '--'
+        values[17] = f'{snow_depth:.0f}' if snow_depth >= 1 else '--'
+        for i in (2, 3, 7, 8, 11, 12, 13, 14, 18, 19, 20):
+            values[i] = f'{rng.uniform(0, 50):.1f}'
+
+        # 品質記号・欠測を混ぜる
+        for i in range(1, N_COLUMNS):
+            roll = rng.random()
+            if roll < 0.02:
+                values[i] += ' )'
+            elif roll < 0.03:
+                values[i] += ']'
+            elif roll < 0.035:
+                values[i] += '#'
+            elif roll < 0.04:
+                values[i] = '×'
+            elif roll < 0.045:
+                values[i] = '///'
+
+        cells = ''.join(f'<td class="data_0_0">{v}</td>' for v in values)
+        rows.append(f'<tr class="mtx" style="text-align:right;">{cells}</tr>\n')
+
+    header = (
+        '<tr><th scope="col" rowspan="3">日</th><th scope="colgroup" colspan="3">降水量(mm)</th>'
+        '<th scope="colgroup" colspan="3">気温(℃)</th></tr>\n'
+        '<tr class="mtx"><th scope="col" rowspan="2">合計</th><th scope="col" colspan="2">最大</th></tr>\n'
+        '<tr class="mtx"><th scope="col">1時間</th><th scope="col">10分間</th></tr>\n'
+    )
+    return (
+        '<html><head><meta http-equiv="Content-Type" content="text/html; charset=EUC-JP"></head><body>'
+        f'<table id="tablefix1" class="data2_s">\n{header}{"".join(rows)}</table></body></html>'
+    )
+
+
+# --- モックサーバー ---
+class MockJMAHandler(BaseHTTPRequestHandler):
+    """daily_a1.php のクエリに合成ページを EUC-JP で返す"""
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != DAILY_PATH:
+            self.send_error(404)
+            return
+
+        config = self.server.mock_config
+        config['requests'] += 1
+        if config['latency'] > 0:
+            time.sleep(config['latency'])
+        if config['failure_rate'] > 0 and random.random() < config['failure_rate']:
+            self.send_error(503)
+            return
+
+        params = {k: v[0] for k, v in urllib.parse.parse_qs(url.query).items()}
+        body = synthetic_daily_page(
+            params.get('prec_no'), params.get('block_no'), int(params['year']), int(params['month'])
+        ).encode('euc-jp')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=EUC-JP')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(port=0, latency=0.0, failure_rate=0.0):
+    """別スレッドでモックサーバーを起動し、(サーバー, daily_a1.php のURL) を返す"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockJMAHandler)
+    server.daemon_threads = True
+    server.mock_config = {'latency': latency, 'failure_rate': failure_rate, 'requests': 0}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}{DAILY_PATH}"
+
+
+# --- 実行 ---
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='気象庁 daily_a1 ページのローカルモックサーバー')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--latency', type=float, default=0.0, help='レスポンスごとの遅延 (秒)')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='503を返す確率')
+    args = parser.parse_args()
+
+    server, url = start_mock_server(args.port, args.latency, args.failure_rate)
+    print(f"モックサーバーを起動しました: {url}")
+    print(f"JMA_BASE_URL={url} python P_yuzawa_minakami_deta.py または")
+    print(f"python jma_backfill.py --base-url {url} で利用できます。")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
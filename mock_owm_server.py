@@ -0,0 +1,159 @@
+import argparse
+import datetime
+import json
+import math
+import os
+import random
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# --- 定数 ---
+# 記録済みの /forecast レスポンス (ファイル名: "{lat}_{lon}.json")
+RECORDED_DIR = 'mock_owm_responses'
+FORECAST_PATH = '/data/2.5/forecast'
+
+
+def response_filename(lat, lon):
+    return f"{float(lat):.3f}_{float(lon):.3f}.json"
+
+
+# --- 合成レスポンス (記録が無い地点用) ---
+def synthetic_forecast(lat, lon, start=None, steps=40):
+    """OpenWeatherMap /forecast と同じ構造の3時間予報を地点ごとに決まった乱数で作る"""
+    rng = random.Random(f"{float(lat):.3f},{float(lon):.3f}")
+    start = start or datetime.datetime.now().replace(minute=0, second=0, microsecond=0)
+    base_temp = rng.uniform(-8, 4)
+
+    items = []
+    for i in range(steps):
+        dt = start + datetime.timedelta(hours=3 * i)
+        # 日周変化 (14時頃に最高、明け方に最低)
+        temp = base_temp + 4 * math.sin((dt.hour - 8) / 24 * 2 * math.pi) + rng.gauss(0, 1)
+        item = {
+            'dt': int(dt.timestamp()),
+            'main': {'temp': round(temp, 2), 'temp_max': round(temp + 0.3, 2), 'temp_min': round(temp - 0.3, 2)},
+            'wind': {'speed': round(abs(rng.gauss(3, 2)), 2)},
+            'dt_txt': dt.strftime('%Y-%m-%d %H:%M:%S')
+        }
+        if temp < 1 and rng.random() < 0.3:
+            item['snow'] = {'3h': round(rng.uniform(0.1, 8), 2)}
+        elif temp >= 1 and rng.random() < 0.3:
+            item['rain'] = {'3h': round(rng.uniform(0.1, 5), 2)}
+        items.append(item)
+    return {'cod': '200', 'cnt': len(items), 'list': items, 'city': {'coord': {'lat': lat, 'lon': lon}}}
+
+
+# --- モックサーバー ---
+class MockOWMHandler(BaseHTTPRequestHandler):
+    """記録済みまたは合成の /forecast レスポンスを返す"""
+
+    def do_GET(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != FORECAST_PATH:
+            self.send_error(404)
+            return
+
+        config = self.server.mock_config
+        if config['latency'] > 0:
+            time.sleep(config['latency'])
+        # 再試行の動作確認用にわざと失敗させる
+        if config['failure_rate'] > 0 and random.random() < config['failure_rate']:
+            self.send_error(503)
+            return
+
+        params = urllib.parse.parse_qs(url.query)
+        lat, lon = params.get('lat', ['0'])[0], params.get('lon', ['0'])[0]
+        recorded = os.path.join(config['recorded_dir'], response_filename(lat, lon))
+        if os.path.exists(recorded):
+            with open(recorded, 'rb') as f:
+                body = f.read()
+        else:
+            body = json.dumps(synthetic_forecast(float(lat), float(lon))).encode('utf-8')
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(port=0, latency=0.0, failure_rate=0.0, recorded_dir=RECORDED_DIR):
+    """別スレッドでモックサーバーを起動し、(サーバー, /forecast のURL) を返す"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockOWMHandler)
+    server.daemon_threads = True
+    server.mock_config = {'latency': latency, 'failure_rate': failure_rate, 'recorded_dir': recorded_dir}
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}{FORECAST_PATH}"
+
+
+# --- 記録 (実APIのレスポンスを保存) ---
+def record_forecasts(resort_settings, api_key, recorded_dir=RECORDED_DIR):
+    from CF_yuzawa_minakami import fetch_all_forecasts
+
+    os.makedirs(recorded_dir, exist_ok=True)
+    for key, data in fetch_all_forecasts(resort_settings, api_key).items():
+        if data is None:
+            continue
+        settings = resort_settings[key]
+        with open(os.path.join(recorded_dir, response_filename(settings['lat'], settings['lon'])), 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False)
+        print(f"記録しました: {key}")
+
+
+# --- ベンチマーク (本番と同じ同時接続数でのリゾート数ごとの取得時間) ---
+def benchmark(resort_counts, latency, failure_rate, max_workers=None):
+    """リゾート数ごとの取得時間を計測する
+
+    同時接続数は既定で本番と同じ MAX_CONCURRENT_REQUESTS。取得時間はおおよそ
+    ceil(リゾート数 / 同時接続数) × 遅延 になるので、その下限も併せて表示する。
+    モックはローカルホストなのでホスト単位のレート制限はかからない。
+    """
+    from CF_yuzawa_minakami import fetch_all_forecasts, MAX_CONCURRENT_REQUESTS
+
+    max_workers = max_workers or MAX_CONCURRENT_REQUESTS
+    server, url = start_mock_server(latency=latency, failure_rate=failure_rate)
+    try:
+        for n in resort_counts:
+            resorts = {
+                f"resort_{i}": {'lat': 36.0 + i * 0.001, 'lon': 138.0 + i * 0.001}
+                for i in range(n)
+            }
+            start = time.perf_counter()
+            results = fetch_all_forecasts(resorts, 'mock', max_workers=max_workers, base_url=url)
+            elapsed = time.perf_counter() - start
+            ok = sum(1 for r in results.values() if r)
+            lower_bound = -(-n // max_workers) * latency
+            print(f"{n:4d}リゾート: {elapsed:.2f}秒 (下限 {lower_bound:.2f}秒, 同時接続 {max_workers}, 成功 {ok}/{n})")
+    finally:
+        server.shutdown()
+
+
+# --- 実行 ---
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='OpenWeatherMap /forecast のローカルモックサーバー')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help='レスポンスごとの遅延 (秒)')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='503を返す確率')
+    parser.add_argument('--record', action='store_true', help='実APIのレスポンスを記録する')
+    parser.add_argument('--bench', type=int, nargs='*', help='指定したリゾート数で取得時間を計測する')
+    parser.add_argument('--workers', type=int, help='計測時の同時接続数 (既定は本番と同じ MAX_CONCURRENT_REQUESTS)')
+    args = parser.parse_args()
+
+    if args.record:
+        from CF_yuzawa_minakami import RESORT_SETTINGS, API_KEY
+        record_forecasts(RESORT_SETTINGS, API_KEY)
+    elif args.bench is not None:
+        benchmark(args.bench or [2, 20, 200], args.latency or 0.2, args.failure_rate, args.workers)
+    else:
+        server, url = start_mock_server(args.port, args.latency, args.failure_rate)
+        print(f"モックサーバーを起動しました: {url}")
+        print(f"OWM_BASE_URL={url} python CF_yuzawa_minakami.py で利用できます。")
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            server.shutdown()
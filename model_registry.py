@@ -0,0 +1,237 @@
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+
+import numpy as np
+
+from model_schema import MODEL_FEATURE_ORDER, CONDITIONS
+from tree_model import TreeEnsemble, flatten_booster, PARITY_TOLERANCE
+
+# --- 定数とファイル名 ---
+# models/<バージョン>/ にモデル (XGBoost ネイティブ形式) とマニフェストを置く
+REGISTRY_DIR = 'models'
+REGISTRY_FILE = 'registry.json'  # 本番 (production) と候補 (candidate) のバージョン
+MANIFEST_FILE = 'manifest.json'
+NATIVE_MODEL_FILE = 'model.ubj'
+# ネイティブ形式から展開したツリー配列 (推論時は xgboost なしで読み込める)
+TREE_ARRAYS_FILE = 'trees.npz'
+STAGES = ('production', 'candidate')
+
+
+# --- マニフェスト ---
+def validate_manifest(manifest):
+    """マニフェストの特徴量順・クラス定義が現在のコードと一致するか確認する"""
+    if list(manifest['feature_order']) != MODEL_FEATURE_ORDER:
+        raise ValueError(
+            f"モデル {manifest['version']} の特徴量順 {manifest['feature_order']} が "
+            f"MODEL_FEATURE_ORDER と一致しません。"
+        )
+    class_map = {int(k): v for k, v in manifest['class_map'].items()}
+    if class_map != CONDITIONS:
+        raise ValueError(f"モデル {manifest['version']} のクラス定義 {class_map} が CONDITIONS と一致しません。")
+
+
+def read_registry(registry_dir):
+    """本番・候補のバージョンを返す (レジストリが無ければどちらも None)"""
+    try:
+        with open(os.path.join(registry_dir, REGISTRY_FILE), 'r', encoding='utf-8') as f:
+            registry = json.load(f)
+    except FileNotFoundError:
+        registry = {}
+    return {stage: registry.get(stage) for stage in STAGES}
+
+
+def set_stage(registry_dir, stage, version):
+    """本番・候補のバージョンを切り替える (version=None で候補を外す)
+
+    レジストリファイルは一時ファイルから置き換えるので、読み込み中のプロセスが
+    書きかけの状態を見ることはない。次回の予測から新しいモデルが使われる。
+    """
+    if stage not in STAGES:
+        raise ValueError(f"stage は {STAGES} のいずれかです: {stage}")
+    if version is not None:
+        load_manifest(registry_dir, version)  # 存在と整合性の確認
+
+    registry = read_registry(registry_dir)
+    registry[stage] = version
+    path = os.path.join(registry_dir, REGISTRY_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(registry, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+    return registry
+
+
+def load_manifest(registry_dir, version):
+    with open(os.path.join(registry_dir, version, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    validate_manifest(manifest)
+    return manifest
+
+
+def list_versions(registry_dir):
+    if not os.path.isdir(registry_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(registry_dir)
+        if os.path.exists(os.path.join(registry_dir, name, MANIFEST_FILE))
+    )
+
+
+# --- 登録 ---
+def booster_proba(booster, X):
+    """ブースターの予測確率 (multi:softmax はクラス番号を返すので、マージンから確率を求める)"""
+    margin = booster.inplace_predict(np.asarray(X, dtype=np.float32), predict_type='margin')
+    proba = np.exp(margin - margin.max(axis=1, keepdims=True))
+    return proba / proba.sum(axis=1, keepdims=True)
+
+
+def register_model(registry_dir, model_path, metadata=None, version=None):
+    """ネイティブ形式のモデルをバージョン付きで登録する
+
+    ツリー配列も書き出し、XGBoost と予測確率が一致することを確認してから登録する。
+    """
+    import xgboost as xgb
+
+    booster = xgb.Booster()
+    booster.load_model(model_path)
+    arrays = flatten_booster(booster)
+    feature_order = [str(name) for name in arrays['feature_names']] or MODEL_FEATURE_ORDER
+
+    version = version or datetime.now().strftime('%Y%m%d-%H%M%S')
+    manifest = {
+        'version': version,
+        'format': 'xgboost-ubj',
+        'model_file': NATIVE_MODEL_FILE,
+        'tree_arrays_file': TREE_ARRAYS_FILE,
+        'feature_order': feature_order,
+        'class_map': {str(k): v for k, v in CONDITIONS.items()},
+        'n_trees': int(len(arrays['tree_roots'])),
+        'registered_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'training': metadata or {},
+    }
+    validate_manifest(manifest)
+
+    # 乱数データ (欠損値を含む) で展開したツリー配列と XGBoost の一致を確認
+    rng = np.random.default_rng(0)
+    X_check = rng.uniform(-30, 2000, size=(2000, len(MODEL_FEATURE_ORDER))).astype(np.float32)
+    X_check[rng.random(X_check.shape) < 0.02] = np.nan
+    max_diff = float(np.abs(booster_proba(booster, X_check) - TreeEnsemble(arrays).predict_proba(X_check)).max())
+    if max_diff > PARITY_TOLERANCE:
+        raise ValueError(f"ツリー配列の予測がXGBoostと一致しません (最大差 {max_diff:.2e})")
+
+    version_dir = os.path.join(registry_dir, version)
+    if os.path.exists(version_dir):
+        raise FileExistsError(f"バージョン {version} は登録済みです。")
+    os.makedirs(version_dir)
+    shutil.copyfile(model_path, os.path.join(version_dir, NATIVE_MODEL_FILE))
+    np.savez(os.path.join(version_dir, TREE_ARRAYS_FILE), **arrays)
+    with open(os.path.join(version_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=4)
+    print(f"✅ モデル {version} を登録しました (ツリー {manifest['n_trees']}本)。")
+    return manifest
+
+
+def import_pickle_model(registry_dir, pkl_path, version=None):
+    """従来の joblib 形式 (gelacon_predictor_modela.pkl) を1回だけ読み込み、ネイティブ形式で登録する
+
+    以降の予測はレジストリから読み込むので、pkl (joblib) を読む必要はなくなる。
+    """
+    import joblib
+
+    model = joblib.load(pkl_path)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        model_path = os.path.join(tmp_dir, NATIVE_MODEL_FILE)
+        model.get_booster().save_model(model_path)
+        metadata = {'source': os.path.basename(pkl_path), 'imported_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+        return register_model(registry_dir, model_path, metadata, version=version)
+
+
+# --- 読み込み ---
+def load_registered_model(registry_dir, version):
+    """登録済みモデルをマニフェストの確認後に読み込む (ツリー配列があれば xgboost なし)"""
+    manifest = load_manifest(registry_dir, version)
+    version_dir = os.path.join(registry_dir, version)
+    tree_path = os.path.join(version_dir, manifest.get('tree_arrays_file') or TREE_ARRAYS_FILE)
+    if os.path.exists(tree_path):
+        with np.load(tree_path, allow_pickle=False) as npz:
+            model = TreeEnsemble({key: npz[key] for key in npz.files})
+    else:
+        model = NativeModel(os.path.join(version_dir, manifest['model_file']))
+    model.version = version
+    return model
+
+
+class NativeModel:
+    """XGBoost ネイティブ形式のブースターを predict_proba で呼べるようにする"""
+
+    def __init__(self, model_path):
+        import xgboost as xgb
+
+        self.booster = xgb.Booster()
+        self.booster.load_model(model_path)
+        self.n_classes_ = len(CONDITIONS)
+
+    def predict_proba(self, X):
+        return booster_proba(self.booster, X)
+
+
+def load_stage_models(registry_dir):
+    """本番・候補のモデルを読み込む (未設定の段階は None)"""
+    registry = read_registry(registry_dir)
+    return {
+        stage: load_registered_model(registry_dir, version) if version else None
+        for stage, version in registry.items()
+    }
+
+
+# --- 実行 ---
+if __name__ == '__main__':
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        base_dir = os.getcwd()
+    registry_dir = os.path.join(base_dir, REGISTRY_DIR)
+
+    parser = argparse.ArgumentParser(description='予測モデルのレジストリ')
+    sub = parser.add_subparsers(dest='command', required=True)
+    p_register = sub.add_parser('register', help='ネイティブ形式 (.ubj) のモデルを登録する')
+    p_register.add_argument('model_path')
+    p_register.add_argument('--metrics', help='train_model.py のメトリクスJSON (学習時の情報として保存)')
+    p_register.add_argument('--stage', choices=STAGES, help='登録と同時に本番・候補に設定する')
+    p_import = sub.add_parser('import-pkl', help='従来の pkl モデルをネイティブ形式に変換して登録する')
+    p_import.add_argument('pkl_path', nargs='?', default=os.path.join(base_dir, 'gelacon_predictor_modela.pkl'))
+    p_import.add_argument('--version', help='登録するバージョン (既定は現在時刻)')
+    p_import.add_argument('--stage', choices=STAGES, default='production', help='登録と同時に設定する段階')
+    p_stage = sub.add_parser('promote', help='登録済みのバージョンを本番・候補に設定する')
+    p_stage.add_argument('version')
+    p_stage.add_argument('--stage', choices=STAGES, default='production')
+    p_clear = sub.add_parser('clear-candidate', help='候補モデルを外す')
+    sub.add_parser('list', help='登録済みのバージョンを表示する')
+    args = parser.parse_args()
+
+    if args.command == 'register':
+        metadata = None
+        if args.metrics:
+            with open(args.metrics, 'r', encoding='utf-8') as f:
+                metadata = json.load(f)
+            metadata.pop('trials', None)
+        manifest = register_model(registry_dir, args.model_path, metadata,
+                                  version=metadata.get('version') if metadata else None)
+        if args.stage:
+            set_stage(registry_dir, args.stage, manifest['version'])
+    elif args.command == 'import-pkl':
+        manifest = import_pickle_model(registry_dir, args.pkl_path, args.version)
+        set_stage(registry_dir, args.stage, manifest['version'])
+    elif args.command == 'promote':
+        set_stage(registry_dir, args.stage, args.version)
+    elif args.command == 'clear-candidate':
+        set_stage(registry_dir, 'candidate', None)
+
+    registry = read_registry(registry_dir)
+    for version in list_versions(registry_dir):
+        stages = [stage for stage in STAGES if registry[stage] == version]
+        print(f"{version} {'(' + ', '.join(stages) + ')' if stages else ''}")
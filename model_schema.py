@@ -0,0 +1,12 @@
+# --- モデルの入出力の定義 ---
+# 特徴量計算 (calculation.py)・学習 (train_model.py)・モデルレジストリ (model_registry.py) で共有する。
+# 依存モジュールを持たないので、どこから読み込んでも循環しない。
+
+# XGBoostモデルが期待する特徴量の順序 
+MODEL_FEATURE_ORDER = [
+    'MaxSnowDepth', 'Snowfall', 'AvgWindSpeed', 'Adj_Temp_Min', 
+    'Night_Chill_Factor', 'Cumulative_Heat_History', 'Surface_Hardening_Risk', 'Course_Elev'
+]
+
+# 雪面状態のクラス番号と名前 (モデルの出力順)
+CONDITIONS = {0: 'パウダー', 1: '神バーン', 2: 'アイスバーン', 3: 'シャバ雪/ゴロゴロ雪'}
@@ -0,0 +1,290 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+
+import metrics
+from feature_cache import FEATURE_MATRIX_FILE, FEATURE_INDEX_FILE
+from model_registry import REGISTRY_DIR, REGISTRY_FILE
+from prediction import MODEL_FILE, PREDICTION_CACHE_FILE
+from resort_registry import RESORT_REGISTRY_FILE
+from snapshots import atomic_write, read_manifest, resolve_artifact
+from station_state import STATION_STATE_FILE
+from tree_model import TREE_MODEL_FILE
+from weather_store import open_store, table_digest, WEATHER_DB_FILE
+
+# --- 定数とファイル名 ---
+# ステージごとの最終実行時刻・入出力のハッシュ
+PIPELINE_STATE_FILE = 'pipeline_state.json'
+# ストア内のテーブルを入出力として指定するときの接頭辞 (例: 'store:observations')
+STORE_PREFIX = 'store:'
+# 入力を持たない取得ステージの更新間隔 (秒)
+SCRAPE_INTERVAL_SEC = 3 * 60 * 60
+FORECAST_INTERVAL_SEC = 60 * 60
+# デーモンとして動かすときに更新の要否を確認する間隔 (秒)
+SCHEDULER_POLL_SEC = 60
+# 予測に使うモデル (レジストリ・ツリー配列・pkl のどれかが変われば再予測)
+MODEL_INPUTS = [os.path.join(REGISTRY_DIR, REGISTRY_FILE), TREE_MODEL_FILE, MODEL_FILE]
+# 既定では実行しない追加のステージ (--stages で指定)
+OPTIONAL_STAGES = ('profile', 'ensemble', 'timeline')
+
+
+# --- ステージ ---
+class Stage:
+    """パイプラインの1段 (入出力はファイル名または 'store:<テーブル名>')
+
+    inputs を持たない取得ステージは interval 秒ごとに、それ以外は入力の内容が変わったときに実行する。
+    依存関係は inputs と他のステージの outputs の対応から決まる。
+    """
+
+    def __init__(self, name, run, inputs=(), outputs=(), interval=None):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.interval = interval
+
+
+def build_stages(base_dir, names=None):
+    """取得 → 特徴量 → 予測 (と追加のステージ) を定義順に返す"""
+    # 各ステージの処理は実行時に読み込む (取得だけ・予測だけの実行で不要な依存を読まないため)
+    # 取得モジュールの TODAY は読み込み時に固定されるので、常駐中も日付が進むよう毎回渡す
+    # (取得に失敗した場合は例外が送出され、ステージは失敗として記録される)
+    def scrape():
+        from P_yuzawa_minakami_deta import generate_past_cache_file
+        generate_past_cache_file(today=date.today(), db_path=os.path.join(base_dir, WEATHER_DB_FILE))
+
+    def forecast():
+        from CF_yuzawa_minakami import generate_full_cache_file
+        generate_full_cache_file(db_path=os.path.join(base_dir, WEATHER_DB_FILE), today=date.today())
+
+    def features():
+        from calculation import generate_xgboost_features
+        generate_xgboost_features(write_json=False, incremental=True, predict=False, base_dir=base_dir)
+
+    def predictions():
+        from prediction import generate_predictions
+        generate_predictions(base_dir)
+
+    def profile():
+        from elevation_profile import generate_elevation_profiles
+        generate_elevation_profiles(base_dir)
+
+    def ensemble():
+        from forecast_ensemble import generate_forecast_ensemble
+        generate_forecast_ensemble(base_dir)
+
+    def timeline():
+        from subdaily_timeline import generate_subdaily_timeline
+        generate_subdaily_timeline(base_dir)
+
+    from elevation_profile import PROFILE_CACHE_FILE
+    from forecast_ensemble import ENSEMBLE_CACHE_FILE
+    from subdaily_timeline import TIMELINE_CACHE_FILE
+
+    # 追加のステージは観測所の状態に加えて、current_station_states で暫定の観測値もストアから読む
+    carried_inputs = ['store:observations', STATION_STATE_FILE, RESORT_REGISTRY_FILE] + MODEL_INPUTS
+    stages = [
+        Stage('scrape', scrape, outputs=['store:observations'], interval=SCRAPE_INTERVAL_SEC),
+        Stage('forecast', forecast, outputs=['store:forecasts', 'store:forecast_steps'], interval=FORECAST_INTERVAL_SEC),
+        Stage('features', features,
+              inputs=['store:observations', 'store:forecasts', RESORT_REGISTRY_FILE],
+              outputs=[FEATURE_MATRIX_FILE, FEATURE_INDEX_FILE, STATION_STATE_FILE]),
+        Stage('predictions', predictions,
+              inputs=[FEATURE_MATRIX_FILE, FEATURE_INDEX_FILE] + MODEL_INPUTS, outputs=[PREDICTION_CACHE_FILE]),
+        Stage('profile', profile, inputs=['store:forecasts'] + carried_inputs, outputs=[PROFILE_CACHE_FILE]),
+        Stage('ensemble', ensemble, inputs=['store:forecasts'] + carried_inputs, outputs=[ENSEMBLE_CACHE_FILE]),
+        Stage('timeline', timeline, inputs=['store:forecast_steps'] + carried_inputs, outputs=[TIMELINE_CACHE_FILE]),
+    ]
+    names = set(names) if names is not None else {s.name for s in stages if s.name not in OPTIONAL_STAGES}
+    unknown = names - {s.name for s in stages}
+    if unknown:
+        raise ValueError(f"不明なステージです: {sorted(unknown)}")
+    return [s for s in stages if s.name in names]
+
+
+def stage_waves(stages):
+    """依存関係で並べたステージの段 (同じ段のステージは互いに独立なので並列に実行できる)"""
+    producers = {artifact: s.name for s in stages for artifact in s.outputs}
+    depends = {
+        s.name: {producers[a] for a in s.inputs if a in producers and producers[a] != s.name} for s in stages
+    }
+    waves, done = [], set()
+    while len(done) < len(stages):
+        wave = [s for s in stages if s.name not in done and depends[s.name] <= done]
+        if not wave:
+            raise ValueError(f"ステージの依存関係が循環しています: {sorted(set(depends) - done)}")
+        waves.append(wave)
+        done.update(s.name for s in wave)
+    return waves, depends
+
+
+# --- 入出力のハッシュ ---
+def file_digest(path, chunk_size=1 << 20):
+    """ファイル内容の SHA-256 (無ければ None)"""
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    except FileNotFoundError:
+        return None
+    return digest.hexdigest()
+
+
+def artifact_digests(base_dir, artifacts):
+    """入出力ごとのハッシュ (ストアのテーブルは読み込み側が使う値だけをハッシュする)
+
+    スナップショットとして公開される成果物は現在のバージョンのファイルをハッシュする。
+    """
+    digests = {}
+    manifest = read_manifest(base_dir)
+    tables = [a for a in artifacts if a.startswith(STORE_PREFIX)]
+    store_path = os.path.join(base_dir, WEATHER_DB_FILE)
+    if tables and os.path.exists(store_path):
+        conn = open_store(store_path)
+        for artifact in tables:
+            digests[artifact] = table_digest(conn, artifact[len(STORE_PREFIX):])
+        conn.close()
+    for artifact in artifacts:
+        if artifact not in digests:
+            digests[artifact] = None if artifact.startswith(STORE_PREFIX) else file_digest(resolve_artifact(base_dir, artifact, manifest))
+    return digests
+
+
+# --- 実行記録 ---
+def load_pipeline_state(base_dir):
+    try:
+        with open(os.path.join(base_dir, PIPELINE_STATE_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_pipeline_state(base_dir, state):
+    """一時ファイルから置き換えて、書きかけの記録が読まれないようにする"""
+    atomic_write(
+        os.path.join(base_dir, PIPELINE_STATE_FILE),
+        lambda f: json.dump(state, f, ensure_ascii=False, indent=4), mode='w'
+    )
+
+
+def stale_reason(stage, record, digests, now):
+    """ステージを実行する理由を返す (最新なら None)"""
+    if record is None:
+        return '未実行'
+    if 'finished_at_ts' not in record:
+        return '実行記録に終了時刻がない'
+    if stage.interval is not None and now - record['finished_at_ts'] >= stage.interval:
+        return f"前回から{stage.interval}秒以上経過"
+    changed = [a for a in stage.inputs if digests[a] != record.get('inputs', {}).get(a)]
+    if changed:
+        return f"入力が変更: {', '.join(changed)}"
+    modified = [a for a in stage.outputs if digests[a] is None or digests[a] != record.get('outputs', {}).get(a)]
+    if modified:
+        return f"出力が無いか前回の実行後に変更: {', '.join(modified)}"
+    return None
+
+
+# --- 実行 ---
+def run_pipeline(base_dir, stages, force=(), dry_run=False, max_workers=None):
+    """古くなったステージだけを依存関係の順に実行する (独立なステージは並列)
+
+    上流のステージが失敗した場合、下流のステージは実行しない (古い出力と新しい出力を混ぜないため)。
+    戻り値はステージ名 → 'ran' / 'skipped' / 'failed' / 'blocked' (dry_run では実行理由)。
+    """
+    waves, depends = stage_waves(stages)
+    state = load_pipeline_state(base_dir)
+    results = {}
+
+    def execute(stage, input_digests):
+        start_time = time.perf_counter()
+        try:
+            with metrics.span('stage', stage=stage.name):
+                stage.run()
+        except Exception as e:
+            print(f"エラー: ステージ '{stage.name}' が失敗しました ({e.__class__.__name__}: {e})")
+            return stage, None
+        return stage, {
+            'inputs': input_digests,
+            'outputs': artifact_digests(base_dir, stage.outputs),
+            'finished_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            'finished_at_ts': time.time(),
+            'duration_sec': round(time.perf_counter() - start_time, 3),
+        }
+
+    for wave in waves:
+        now = time.time()
+        runnable = []
+        for stage in wave:
+            if any(results.get(dep) in ('failed', 'blocked') for dep in depends[stage.name]):
+                results[stage.name] = 'blocked'
+                continue
+            digests = artifact_digests(base_dir, stage.inputs + stage.outputs)
+            reason = '強制実行' if stage.name in force else stale_reason(stage, state.get(stage.name), digests, now)
+            if reason is None:
+                results[stage.name] = 'skipped'
+                continue
+            print(f"▶ {stage.name}: {reason}")
+            if dry_run:
+                results[stage.name] = reason
+                continue
+            runnable.append((stage, {a: digests[a] for a in stage.inputs}))
+
+        if not runnable:
+            continue
+        with ThreadPoolExecutor(max_workers=max_workers or len(runnable)) as executor:
+            for stage, record in executor.map(lambda args: execute(*args), runnable):
+                if record is None:
+                    results[stage.name] = 'failed'
+                else:
+                    results[stage.name] = 'ran'
+                    state[stage.name] = record
+        save_pipeline_state(base_dir, state)
+
+    print(' / '.join(f"{name}: {result}" for name, result in results.items()))
+    if not dry_run:
+        for name, result in results.items():
+            metrics.inc('pipeline_stage_results_total', stage=name, result=result)
+        metrics.flush_metrics()
+    return results
+
+
+def run_scheduler(base_dir, stages, poll_sec=SCHEDULER_POLL_SEC):
+    """常駐して poll_sec ごとにパイプラインを確認する
+
+    取得ステージは更新間隔が過ぎたときだけ、下流は入力が変わったときだけ実行される。
+    ステージの外で起きたエラー (ストアのロックや壊れた実行記録など) も記録して確認を続ける。
+    """
+    while True:
+        try:
+            run_pipeline(base_dir, stages)
+        except Exception as e:
+            metrics.inc('scheduler_errors_total')
+            print(f"エラー: パイプラインの確認に失敗しました ({e.__class__.__name__}: {e})。{poll_sec}秒後に再試行します。")
+        time.sleep(poll_sec)
+
+
+# --- 実行 ---
+if __name__ == '__main__':
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        base_dir = os.getcwd()
+
+    parser = argparse.ArgumentParser(description='取得 → 特徴量 → 予測を、入力が変わったステージだけ実行する')
+    parser.add_argument('--stages', nargs='+', help=f"実行するステージ (既定は {', '.join(OPTIONAL_STAGES)} 以外すべて)")
+    parser.add_argument('--force', nargs='+', default=[], help='入力に関係なく実行するステージ')
+    parser.add_argument('--dry-run', action='store_true', help='実行するステージと理由だけを表示する')
+    parser.add_argument('--daemon', action='store_true', help='常駐して定期的に更新する')
+    parser.add_argument('--poll', type=int, default=SCHEDULER_POLL_SEC, help='常駐時の確認間隔 (秒)')
+    args = parser.parse_args()
+
+    stages = build_stages(base_dir, args.stages)
+    if args.daemon:
+        run_scheduler(base_dir, stages, args.poll)
+    else:
+        run_pipeline(base_dir, stages, force=set(args.force), dry_run=args.dry_run)
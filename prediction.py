@@ -0,0 +1,169 @@
+import numpy as np
+import json
+import os
+from datetime import datetime
+
+import metrics
+from snapshots import publish_artifacts, resolve_artifact
+from feature_cache import load_feature_cache, build_course_slices
+from model_registry import read_registry, load_registered_model, REGISTRY_DIR
+from tree_model import load_tree_model, TREE_MODEL_FILE
+
+# --- 定数とファイル名 ---
+MODEL_FILE = 'gelacon_predictor_modela.pkl'
+# 全リゾート・全コースの予測結果 (確率とクラス)
+PREDICTION_CACHE_FILE = 'XGBoost_Predictions_Cache.npz'
+# 特徴量インデックスのうち予測結果にも引き継ぐ配列
+INDEX_KEYS = ['course_keys', 'course_elevs', 'course_offsets', 'dates']
+# 候補モデルを本番と同じ入力で予測したときの不一致率の記録
+SHADOW_LOG_FILE = 'shadow_predictions.jsonl'
+
+
+# --- 予測結果の書き出し・読み込み ---
+def write_prediction_cache(base_dir, probabilities, index, model_version=None):
+    """確率 (行 × クラス) と argmax クラスを特徴量と同じ行順で保存する
+
+    model_version は予測に使ったレジストリのバージョン (レジストリ外のモデルは空文字)。
+    """
+    probabilities = np.asarray(probabilities, dtype=np.float32)
+    arrays = dict(
+        probabilities=probabilities,
+        classes=np.argmax(probabilities, axis=1).astype(np.int8) if len(probabilities) else np.empty(0, np.int8),
+        feature_timestamp=np.asarray(index['timestamp']),
+        timestamp=np.asarray(datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+        model_version=np.asarray(model_version or ''),
+        **{key: index[key] for key in INDEX_KEYS}
+    )
+    publish_artifacts(base_dir, {PREDICTION_CACHE_FILE: lambda f: np.savez(f, **arrays)})
+
+
+def load_prediction_cache(base_dir):
+    """予測結果を読み込む (UI側はこれだけを使い、モデルは読み込まない)"""
+    with np.load(resolve_artifact(base_dir, PREDICTION_CACHE_FILE), allow_pickle=False) as npz:
+        cache = {key: npz[key] for key in npz.files}
+    cache['timestamp'] = str(cache['timestamp'])
+    cache['feature_timestamp'] = str(cache['feature_timestamp'])
+    cache['model_version'] = str(cache['model_version']) if 'model_version' in cache else ''
+    cache['course_slices'] = build_course_slices(cache)
+    return cache
+
+
+# --- リゾート内の全コースの日ごとの予測 (アプリの表示用) ---
+def course_condition_rows(cache, course_keys, course_elevs):
+    """予測結果キャッシュから指定コースの行をまとめて取り出す (行ごとのループなし)
+
+    戻り値は 'course_elevs' / 'dates' / 'probabilities' / 'classes' の配列 (コース順・日付順) と、
+    キャッシュに無かったコースキーの 'missing'。classes は一括予測時に求めた argmax。
+    """
+    found = [(key, elev) for key, elev in zip(course_keys, course_elevs) if key in cache['course_slices']]
+    slices = [cache['course_slices'][key] for key, _ in found]
+    rows = np.concatenate([np.arange(s.start, s.stop) for s in slices]) if slices else np.empty(0, np.int64)
+    return {
+        'course_elevs': np.repeat(np.asarray([elev for _, elev in found], dtype=np.int64), [s.stop - s.start for s in slices]),
+        'dates': cache['dates'][rows],
+        'probabilities': cache['probabilities'][rows],
+        'classes': cache['classes'][rows],
+        'missing': [key for key in course_keys if key not in cache['course_slices']],
+    }
+
+
+# --- 一括予測 ---
+def load_xgboost_model(base_dir):
+    """XGBoostモデルをロードする (xgboost はここで初めて読み込まれる)"""
+    import joblib
+    return joblib.load(os.path.join(base_dir, MODEL_FILE))
+
+
+def load_model(base_dir):
+    """予測モデルをロードする
+
+    モデルレジストリ (model_registry.py) に本番モデルがあればそれを使い、無ければ
+    ツリー配列モデル (tree_model.py で書き出し)、最後に従来の pkl を読み込む。
+    """
+    registry_dir = os.path.join(base_dir, REGISTRY_DIR)
+    production = read_registry(registry_dir)['production']
+    if production:
+        return load_registered_model(registry_dir, production)
+    if os.path.exists(os.path.join(base_dir, TREE_MODEL_FILE)):
+        return load_tree_model(base_dir)
+    return load_xgboost_model(base_dir)
+
+
+def prediction_is_current(base_dir):
+    """予測結果があり、レジストリの現在の本番モデルで予測したものか"""
+    path = resolve_artifact(base_dir, PREDICTION_CACHE_FILE)
+    if not os.path.exists(path):
+        return False
+    with np.load(path, allow_pickle=False) as npz:
+        cached_version = str(npz['model_version']) if 'model_version' in npz.files else ''
+    production = read_registry(os.path.join(base_dir, REGISTRY_DIR))['production']
+    return cached_version == (production or '')
+
+
+def load_candidate_model(base_dir):
+    """シャドー評価用の候補モデル (未設定なら None)"""
+    registry_dir = os.path.join(base_dir, REGISTRY_DIR)
+    candidate = read_registry(registry_dir)['candidate']
+    return load_registered_model(registry_dir, candidate) if candidate else None
+
+
+def log_shadow_disagreement(base_dir, probabilities, candidate_probabilities, production, candidate):
+    """本番と候補の予測クラスの不一致率を記録する (本番のクラスごとの内訳つき)"""
+    classes = np.argmax(probabilities, axis=1)
+    disagree = classes != np.argmax(candidate_probabilities, axis=1)
+    n_classes = probabilities.shape[1]
+    per_class = np.bincount(classes[disagree], minlength=n_classes) / np.maximum(np.bincount(classes, minlength=n_classes), 1)
+    record = {
+        'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        'production': production,
+        'candidate': candidate,
+        'n_rows': int(len(classes)),
+        'disagreement_rate': float(disagree.mean()) if len(classes) else 0.0,
+        'disagreement_by_class': per_class.round(6).tolist(),
+        'max_probability_diff': float(np.abs(probabilities - candidate_probabilities).max()) if len(classes) else 0.0,
+    }
+    with open(os.path.join(base_dir, SHADOW_LOG_FILE), 'a', encoding='utf-8') as f:
+        f.write(json.dumps(record, ensure_ascii=False) + '\n')
+    print(f"シャドー評価: 候補 {candidate} と本番の不一致率 {record['disagreement_rate']:.1%}")
+    return record
+
+
+@metrics.timed('inference')
+def generate_predictions(base_dir, model=None, candidate=None):
+    """特徴量キャッシュ全体を1回の predict_proba で予測し、結果を保存する
+
+    候補モデルがあれば同じ行列を予測し、不一致率をシャドーログに記録する (結果には使わない)。
+    """
+    matrix, index = load_feature_cache(base_dir)
+    if model is None:
+        model = load_model(base_dir)
+    if candidate is None:
+        candidate = load_candidate_model(base_dir)
+
+    # 出力は [サンプル数, クラス数(4)] の確率配列
+    if len(matrix):
+        probabilities = model.predict_proba(matrix)
+    else:
+        probabilities = np.empty((0, model.n_classes_))
+    write_prediction_cache(base_dir, probabilities, index, getattr(model, 'version', None))
+
+    if candidate is not None and len(matrix):
+        log_shadow_disagreement(
+            base_dir, probabilities, candidate.predict_proba(matrix),
+            getattr(model, 'version', None), getattr(candidate, 'version', None)
+        )
+
+    metrics.inc('rows_total', len(matrix), stage='inference')
+    metrics.inc('courses_total', len(index['course_keys']), stage='inference')
+    print(f"✅ {len(index['course_keys'])}コース / {len(matrix)}行の予測結果 '{PREDICTION_CACHE_FILE}' を生成しました。")
+    return probabilities
+
+
+# --- 実行 ---
+if __name__ == '__main__':
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        base_dir = os.getcwd()
+
+    generate_predictions(base_dir)
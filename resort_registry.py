@@ -0,0 +1,102 @@
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from station_catalog import lapse_adjustment, load_station_catalog, STATION_CATALOG_FILE
+
+# --- 定数とファイル名 ---
+# 観測所・リゾート・コース標高の定義 (リゾートの追加はこのファイルだけを編集する)
+RESORT_REGISTRY_FILE = 'resorts.json'
+
+
+# --- レジストリ ---
+class ResortRegistry:
+    """resorts.json の定義を読み込み、リゾート名・観測所・コースで引けるように索引したもの
+
+    stations: {観測所キー: {'name', 'prec_no', 'block_no', 'lat', 'lon', 'elev' (アメダス観測所の標高)}}
+    resorts: {リゾートキー: {'name', 'lat', 'lon', 'elev', 'station', 'courses'}}
+    'station' を省略したリゾートは観測所カタログの最寄り観測所 (標高差を含めた距離) に割り当て、
+    その観測所を stations に加える。予報の標高補正値 'forecast_adj_val' は省略すると
+    リゾート標高と観測所標高から GRADIENT_RATE で計算する。
+    コースは全リゾート分を1本の配列 (course_keys / course_elevs / ...) にも展開しておく。
+    """
+
+    def __init__(self, data, catalog_path=None):
+        self.stations = dict(data['stations'])
+        self.resorts = {key: dict(resort) for key, resort in data['resorts'].items()}
+
+        # 観測所が未指定のリゾートをまとめて最寄り観測所に割り当てる
+        unassigned = [key for key, resort in self.resorts.items() if not resort.get('station')]
+        if unassigned:
+            catalog = load_station_catalog(self.stations, catalog_path)
+            nearest = catalog.nearest(
+                [self.resorts[key]['lat'] for key in unassigned],
+                [self.resorts[key]['lon'] for key in unassigned],
+                [self.resorts[key]['elev'] for key in unassigned],
+            )
+            for key, station in zip(unassigned, nearest.tolist()):
+                self.resorts[key]['station'] = station
+                self.stations.setdefault(station, catalog.stations[station])
+
+        for key, resort in self.resorts.items():
+            if resort['station'] not in self.stations:
+                raise ValueError(f"リゾート {key} の観測所 {resort['station']} が stations にありません。")
+            if not resort['courses']:
+                raise ValueError(f"リゾート {key} のコース標高が空です。")
+            resort.setdefault('forecast_adj_val', float(
+                lapse_adjustment(resort['elev'], self.stations[resort['station']]['elev'])))
+
+        self.resort_by_name = {resort['name']: key for key, resort in self.resorts.items()}
+        # 観測所 → その観測所を過去データに使うリゾート (定義順)
+        self.station_resorts = {station: [] for station in self.stations}
+        for key, resort in self.resorts.items():
+            self.station_resorts[resort['station']].append(key)
+
+        # 全リゾートのコースを連結した表
+        self.course_resorts = np.asarray(
+            [key for key, resort in self.resorts.items() for _ in resort['courses']], dtype=str)
+        self.course_elevs = np.asarray(
+            [elev for resort in self.resorts.values() for elev in resort['courses']], dtype=np.int64)
+        self.course_keys = np.asarray(
+            [f"{key}_{elev}m" for key, elev in zip(self.course_resorts, self.course_elevs)], dtype=str)
+        offsets = np.cumsum([0] + [len(resort['courses']) for resort in self.resorts.values()])
+        self.course_slices = {
+            key: slice(int(start), int(end)) for key, start, end in zip(self.resorts, offsets[:-1], offsets[1:])
+        }
+
+    def courses(self, resort):
+        """リゾートのコース標高 (定義順)"""
+        return list(self.resorts[resort]['courses'])
+
+    def station_of(self, resort):
+        return self.resorts[resort]['station']
+
+    def amedas_elev(self, resort):
+        """リゾートの過去データ観測所 (アメダス) の標高"""
+        return self.stations[self.station_of(resort)]['elev']
+
+    def reference_resort(self, station):
+        """観測所の累積状態の補正基準にするリゾート (観測所を共有する場合は定義順で最初)"""
+        resorts = self.station_resorts.get(station)
+        return resorts[0] if resorts else None
+
+    def linked_stations(self):
+        """リゾートに紐づいている観測所 (定義順)"""
+        return [station for station, resorts in self.station_resorts.items() if resorts]
+
+
+@lru_cache(maxsize=None)
+def _load_registry(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    # 観測所カタログは resorts.json と同じディレクトリに置く
+    return ResortRegistry(data, os.path.join(os.path.dirname(path), STATION_CATALOG_FILE))
+
+
+def load_resort_registry(path=None):
+    """レジストリを読み込む (プロセス内で1回だけ読み込んで共有する)"""
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), RESORT_REGISTRY_FILE)
+    return _load_registry(os.path.abspath(path))
@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+
+from snapshots import artifact_version
+
+
+# --- ファイル変更検知付きのリソース ---
+class FileResource:
+    """ファイルから読み込む共有リソース (モデルやキャッシュ)
+
+    プロセス内で1回だけ読み込み、ファイルの mtime/サイズが変わったときだけ再読み込みする。
+    再読み込みに失敗した場合は前回の値を返し続け、失敗内容を error に残す。
+    """
+
+    def __init__(self, paths, loader):
+        self.paths = list(paths)
+        self.loader = loader
+        self.error = None
+        # (値, バージョン) を1つの属性で持ち、値とバージョンの組が他のセッションの再読み込みで食い違わないようにする
+        self._current = (None, None)
+        self._failed_version = None
+        self._lock = threading.Lock()
+
+    def version(self):
+        """監視対象ファイルの (mtime_ns, サイズ) の組"""
+        return tuple((st.st_mtime_ns, st.st_size) for st in (os.stat(path) for path in self.paths))
+
+    @property
+    def loaded_version(self):
+        """最後に読み込んだ値のバージョン"""
+        return self._current[1]
+
+    def get(self):
+        return self.snapshot()[0]
+
+    def snapshot(self):
+        """値とそのバージョンの組を返す (描画結果のキャッシュにはこのバージョンをキーとして値と一緒に渡す)"""
+        current = self._current
+        try:
+            version = self.version()
+        except FileNotFoundError:
+            # ファイルが一時的に無い場合は前回の値を使い続ける
+            if current[1] is None:
+                raise
+            return current
+
+        if version == current[1] or version == self._failed_version:
+            if current[1] is None:
+                raise self.error
+            return current
+
+        with self._lock:
+            # 他のセッションが先に再読み込みを済ませていれば何もしない
+            if version != self._current[1]:
+                try:
+                    value = self.loader()
+                except Exception as e:
+                    self.error = e
+                    self._failed_version = version
+                    if self._current[1] is None:
+                        raise
+                    return self._current
+                # 読み込みに成功したときだけ差し替える
+                self._current, self.error = (value, version), None
+            return self._current
+
+
+class SnapshotResource(FileResource):
+    """公開済みのスナップショット (snapshots.py) から読み込む共有リソース
+
+    マニフェスト上のバージョンが変わったときだけ再読み込みする。
+    マニフェストの確認は stat 1回で、書き込み中のファイルを読むことはない。
+    """
+
+    def __init__(self, base_dir, names, loader):
+        super().__init__([os.path.join(base_dir, name) for name in names], loader)
+        self.base_dir = base_dir
+        self.names = list(names)
+
+    def version(self):
+        """監視対象の成果物の現在のバージョンの組"""
+        return tuple(artifact_version(self.base_dir, name) for name in self.names)
+
+
+def load_json(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
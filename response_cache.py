@@ -0,0 +1,219 @@
+import calendar
+import datetime
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import metrics
+from http_client import get_with_retry
+
+# --- 定数 ---
+CACHE_DIR = 'http_cache'
+# キャッシュ全体の上限サイズ (超えたら最後に使われたのが古いものから削除)
+MAX_CACHE_BYTES = 200 * 1024 * 1024
+# 上限を超えたときはこの割合まで削除する (上限付近で書き込みのたびに削除が走らないように)
+EVICT_TARGET_RATIO = 0.9
+# OpenWeatherMap 予報のTTL (秒)
+OWM_CACHE_TTL_SEC = 10 * 60
+# 当月など確定していない気象庁ページのTTL (秒)
+JMA_CURRENT_MONTH_TTL_SEC = 60 * 60
+# 月末からこの日数が過ぎた気象庁の月ページは確定値として無期限にキャッシュする
+JMA_FINALIZED_AFTER_DAYS = 10
+# キャッシュキーと保存するURLから除くパラメータ (APIキーなど)
+SECRET_PARAMS = {'appid'}
+
+
+# --- ソースごとのTTL ---
+def jma_month_ttl(year, month, today=None):
+    """気象庁の月ページのTTL。確定済みの過去月は None (無期限)"""
+    today = today or datetime.date.today()
+    month_end = datetime.date(year, month, calendar.monthrange(year, month)[1])
+    if (today - month_end).days > JMA_FINALIZED_AFTER_DAYS:
+        return None
+    return JMA_CURRENT_MONTH_TTL_SEC
+
+
+# --- ディスクキャッシュ ---
+class ResponseCache:
+    """URLとパラメータをキーにしたレスポンスのディスクキャッシュ
+
+    1件につき本文 (.body) とメタデータ (.json) を保存する。本文ファイルの mtime を
+    最終利用時刻として扱い、上限サイズを超えたら古いものから削除する。
+    キーごとのサイズと最終利用時刻はメモリ上の索引に持ち、ディレクトリの走査は
+    初回と上限を超えたとき (他のプロセスの書き込みを取り込むため) だけ行う。
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index = None  # キー → [最終利用時刻, 本文のサイズ]
+        self._total = 0
+
+    @staticmethod
+    def key_for(url, params=None):
+        query = sorted((k, str(v)) for k, v in (params or {}).items())
+        return hashlib.sha256(f"{url}?{urllib.parse.urlencode(query)}".encode('utf-8')).hexdigest()
+
+    def _paths(self, key):
+        return os.path.join(self.cache_dir, key + '.body'), os.path.join(self.cache_dir, key + '.json')
+
+    def _tmp_path(self, path):
+        # 同じキャッシュを使う別プロセス・別スレッドと一時ファイル名が重ならないようにする
+        return f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+    def _scan(self):
+        """ディレクトリを走査して索引と合計サイズを作り直す (ロックを持った状態で呼ぶ)"""
+        index = {}
+        try:
+            names = os.listdir(self.cache_dir)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            if not name.endswith('.body'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            index[name[:-len('.body')]] = [stat.st_mtime, stat.st_size]
+        self._index = index
+        self._total = sum(size for _, size in index.values())
+
+    def get(self, key):
+        body_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        # LRU用に最終利用時刻を更新
+        os.utime(body_path)
+        with self._lock:
+            if self._index is not None and key in self._index:
+                self._index[key][0] = time.time()
+        return meta, body
+
+    def put(self, key, meta, body):
+        body_path, meta_path = self._paths(key)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for path, data, mode in [(body_path, body, 'wb'), (meta_path, json.dumps(meta), 'w')]:
+            tmp_path = self._tmp_path(path)
+            with open(tmp_path, mode) as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._index is None:
+                self._scan()
+            else:
+                _, old_size = self._index.get(key, (None, 0))
+                self._index[key] = [time.time(), len(body)]
+                self._total += len(body) - old_size
+            over_limit = self._total > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def touch_meta(self, key, meta):
+        _, meta_path = self._paths(key)
+        tmp_path = self._tmp_path(meta_path)
+        with open(tmp_path, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def evict(self):
+        """上限サイズを超えていれば、上限の EVICT_TARGET_RATIO 倍まで最終利用が古い順に削除する"""
+        with self._lock:
+            # 他のプロセスが書き込んだ分も含めるため、削除前に索引を作り直す
+            self._scan()
+            if self._total <= self.max_bytes:
+                return
+            target = self.max_bytes * EVICT_TARGET_RATIO
+            for key, (_, size) in sorted(self._index.items(), key=lambda item: item[1][0]):
+                if self._total <= target:
+                    break
+                for path in self._paths(key):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                del self._index[key]
+                self._total -= size
+
+
+def _to_response(url, meta, body, from_cache):
+    response = requests.Response()
+    response._content = body
+    response.status_code = meta.get('status', 200)
+    response.headers = CaseInsensitiveDict(meta.get('headers', {}))
+    response.url = url
+    response.encoding = meta.get('encoding')
+    response.from_cache = from_cache
+    return response
+
+
+# --- キャッシュ付きGET ---
+def cached_get(session, url, params=None, ttl=None, cache=None, timeout=10, rate_limiter=None):
+    """ディスクキャッシュを使ってGETする
+
+    ttl は秒数 (None は無期限)。期限切れでも ETag / Last-Modified があれば
+    条件付きリクエストで再検証し、304 ならキャッシュを延長して使う。
+    """
+    host = urllib.parse.urlsplit(url).hostname
+    if cache is None:
+        metrics.inc('http_cache_total', host=host, result='bypass')
+        return get_with_retry(session, url, params=params, timeout=timeout, rate_limiter=rate_limiter)
+
+    key = ResponseCache.key_for(url, params)
+    cached = cache.get(key)
+    now = time.time()
+    if cached is not None:
+        meta, body = cached
+        if meta['expires_at'] is None or now < meta['expires_at']:
+            metrics.inc('http_cache_total', host=host, result='hit')
+            return _to_response(url, meta, body, True)
+
+    # 期限切れのエントリは条件付きリクエストで再検証
+    headers = {}
+    if cached is not None:
+        if cached[0].get('etag'):
+            headers['If-None-Match'] = cached[0]['etag']
+        if cached[0].get('last_modified'):
+            headers['If-Modified-Since'] = cached[0]['last_modified']
+
+    response = get_with_retry(
+        session, url, params=params, timeout=timeout, rate_limiter=rate_limiter, headers=headers or None
+    )
+    expires_at = None if ttl is None else now + ttl
+
+    if response.status_code == 304 and cached is not None:
+        meta, body = cached
+        meta['expires_at'] = expires_at
+        cache.touch_meta(key, meta)
+        metrics.inc('http_cache_total', host=host, result='revalidated')
+        return _to_response(url, meta, body, True)
+
+    public_params = {k: v for k, v in (params or {}).items() if k not in SECRET_PARAMS}
+    meta = {
+        'url': url,
+        'params': {k: str(v) for k, v in public_params.items()},
+        'status': response.status_code,
+        'fetched_at': now,
+        'expires_at': expires_at,
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+        'encoding': response.encoding,
+        'headers': {k: v for k, v in response.headers.items() if k.lower() in ('content-type', 'etag', 'last-modified')}
+    }
+    cache.put(key, meta, response.content)
+    metrics.inc('http_cache_total', host=host, result='miss')
+    response.from_cache = False
+    return response
@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import shutil
+import threading
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows ではプロセス間のロックを省略する (プロセス内のロックのみ)
+    fcntl = None
+
+# --- 定数とファイル名 ---
+# 成果物のスナップショット ('snapshots/<ファイル名>/<バージョン>/<ファイル名>') と現在のバージョンの一覧
+SNAPSHOT_DIR = 'snapshots'
+SNAPSHOT_MANIFEST_FILE = 'current.json'
+SNAPSHOT_LOCK_FILE = '.lock'
+# 成果物ごとに残すスナップショットの数 (ロールバック用。現在のバージョンは常に残す)
+SNAPSHOT_RETENTION = 5
+
+_manifest_lock = threading.Lock()
+# マニフェストの (パス, inode, mtime_ns, サイズ) → 内容 (読み込み側が毎回 JSON を読み直さないため)
+_manifest_cache = {}
+
+
+# --- 原子的な書き込み ---
+def _fsync_dir(path):
+    if os.name != 'posix':
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(path, write, mode='wb'):
+    """一時ファイルに write(f) で書き、fsync してから置き換える (読み込み側は書きかけの内容を見ない)"""
+    directory = os.path.dirname(path) or '.'
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, mode, **({} if 'b' in mode else {'encoding': 'utf-8'})) as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    _fsync_dir(directory)
+
+
+# --- マニフェスト ---
+def _manifest_path(base_dir):
+    return os.path.join(base_dir, SNAPSHOT_DIR, SNAPSHOT_MANIFEST_FILE)
+
+
+def read_manifest(base_dir):
+    """現在のバージョンの一覧 ({'sequence', 'artifacts': {ファイル名: {...}}})
+
+    ファイルが変わっていなければ前回読み込んだ内容を返すので、毎回呼んでも stat 1回で済む。
+    """
+    path = _manifest_path(base_dir)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return {'sequence': 0, 'artifacts': {}}
+    key = (os.path.abspath(path), st.st_ino, st.st_mtime_ns, st.st_size)
+    manifest = _manifest_cache.get(key)
+    if manifest is None:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        _manifest_cache.clear()
+        _manifest_cache[key] = manifest
+    return manifest
+
+
+class _ManifestLock:
+    """マニフェストの読み書きをプロセス内外で直列化する"""
+
+    def __init__(self, base_dir):
+        self.path = os.path.join(base_dir, SNAPSHOT_DIR, SNAPSHOT_LOCK_FILE)
+        self.file = None
+
+    def __enter__(self):
+        _manifest_lock.acquire()
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.file = open(self.path, 'a')
+            fcntl.flock(self.file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.file is not None:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+        _manifest_lock.release()
+        return False
+
+
+def _write_manifest(base_dir, manifest):
+    atomic_write(_manifest_path(base_dir), lambda f: json.dump(manifest, f, ensure_ascii=False, indent=4), mode='w')
+
+
+# --- 公開 ---
+def new_version():
+    """時刻順に並ぶバージョン名 (同時に公開する別プロセスと重ならないよう PID を付ける)"""
+    return f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}"
+
+
+def publish_artifacts(base_dir, writers, retention=SNAPSHOT_RETENTION):
+    """成果物を新しいバージョンのスナップショットとして書き、マニフェストを1回で切り替える
+
+    writers は {ファイル名: write(f)}。同時に渡した成果物 (特徴量行列とインデックスなど) は
+    同じバージョンとして一度に切り替わるので、読み込み側が新旧を混ぜて読むことはない。
+    公開済みのスナップショットは書き換えず、古いものは retention 個を残して削除する。
+    """
+    version = new_version()
+    published_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    entries = {}
+    for name, write in writers.items():
+        version_dir = os.path.join(base_dir, SNAPSHOT_DIR, name, version)
+        os.makedirs(version_dir, exist_ok=True)
+        path = os.path.join(version_dir, name)
+        atomic_write(path, write)
+        entries[name] = {
+            'version': version,
+            'path': os.path.relpath(path, base_dir),
+            'bytes': os.path.getsize(path),
+            'published_at': published_at,
+        }
+
+    with _ManifestLock(base_dir):
+        manifest = read_manifest(base_dir)
+        manifest = {'sequence': manifest['sequence'] + 1, 'artifacts': dict(manifest['artifacts'], **entries)}
+        _write_manifest(base_dir, manifest)
+        for name in entries:
+            prune_snapshots(base_dir, name, manifest, retention)
+    return version
+
+
+def list_versions(base_dir, name):
+    """残っているスナップショットのバージョン (古い順)"""
+    artifact_dir = os.path.join(base_dir, SNAPSHOT_DIR, name)
+    if not os.path.isdir(artifact_dir):
+        return []
+    return sorted(
+        version for version in os.listdir(artifact_dir)
+        if os.path.exists(os.path.join(artifact_dir, version, name))
+    )
+
+
+def prune_snapshots(base_dir, name, manifest, retention=SNAPSHOT_RETENTION):
+    """新しい retention 個と現在のバージョン以外のスナップショットを削除する"""
+    current = manifest['artifacts'].get(name, {}).get('version')
+    versions = list_versions(base_dir, name)
+    for version in versions[:max(0, len(versions) - retention)]:
+        if version != current:
+            shutil.rmtree(os.path.join(base_dir, SNAPSHOT_DIR, name, version), ignore_errors=True)
+
+
+def rollback_artifact(base_dir, name, version=None):
+    """現在のバージョンを残っているスナップショット (既定は1つ前) に戻す
+
+    現在のバージョンが同じ成果物 (同時に公開した特徴量行列とインデックスなど) はまとめて戻し、
+    マニフェストを1回で切り替える。どれか1つでも戻すバージョンが残っていなければ何も戻さない。
+    戻した成果物のファイル名の一覧とバージョンを返す。
+    """
+    with _ManifestLock(base_dir):
+        manifest = read_manifest(base_dir)
+        current = manifest['artifacts'].get(name, {}).get('version')
+        versions = list_versions(base_dir, name)
+        if version is None:
+            older = [v for v in versions if current is None or v < current]
+            if not older:
+                raise ValueError(f"{name} に戻せるスナップショットがありません。")
+            version = older[-1]
+        if version not in versions:
+            raise ValueError(f"{name} のスナップショット {version} はありません。")
+        names = sorted(
+            {name} | {n for n, entry in manifest['artifacts'].items() if current is not None and entry['version'] == current}
+        )
+        missing = [n for n in names if version not in list_versions(base_dir, n)]
+        if missing:
+            raise ValueError(f"同時に公開された {missing} にスナップショット {version} が無いため戻せません。")
+        rolled_back_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        entries = {}
+        for n in names:
+            path = os.path.join(SNAPSHOT_DIR, n, version, n)
+            entries[n] = {
+                'version': version,
+                'path': path,
+                'bytes': os.path.getsize(os.path.join(base_dir, path)),
+                'published_at': rolled_back_at,
+            }
+        manifest = {'sequence': manifest['sequence'] + 1, 'artifacts': dict(manifest['artifacts'], **entries)}
+        _write_manifest(base_dir, manifest)
+    return names, version
+
+
+# --- 読み込み ---
+def resolve_artifact(base_dir, name, manifest=None):
+    """成果物の現在のスナップショットのパス (未公開なら従来の base_dir/name)"""
+    manifest = manifest or read_manifest(base_dir)
+    entry = manifest['artifacts'].get(name)
+    return os.path.join(base_dir, entry['path']) if entry else os.path.join(base_dir, name)
+
+
+def artifact_version(base_dir, name):
+    """成果物の現在のバージョン (未公開なら従来のファイルの (mtime_ns, サイズ)。どちらも無ければ FileNotFoundError)"""
+    entry = read_manifest(base_dir)['artifacts'].get(name)
+    if entry:
+        return entry['version']
+    st = os.stat(os.path.join(base_dir, name))
+    return (st.st_mtime_ns, st.st_size)
+
+
+# --- 実行 ---
+if __name__ == '__main__':
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        base_dir = os.getcwd()
+
+    parser = argparse.ArgumentParser(description='成果物のスナップショットの一覧とロールバック')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help='成果物ごとの現在のバージョンと残っているスナップショットを表示する')
+    rollback_parser = subparsers.add_parser('rollback', help='成果物を以前のスナップショットに戻す')
+    rollback_parser.add_argument('name', help='成果物のファイル名 (例: XGBoost_Predictions_Cache.npz)')
+    rollback_parser.add_argument('version', nargs='?', help='戻すバージョン (既定は1つ前)')
+    args = parser.parse_args()
+
+    if args.command == 'list':
+        manifest = read_manifest(base_dir)
+        for name, entry in sorted(manifest['artifacts'].items()):
+            print(f"{name}: {entry['version']} ({entry['published_at']})")
+            for version in list_versions(base_dir, name):
+                print(f"  {'*' if version == entry['version'] else ' '} {version}")
+    else:
+        names, version = rollback_artifact(base_dir, args.name, args.version)
+        print(f"✅ {', '.join(names)} を {version} に戻しました。")
@@ -0,0 +1,120 @@
+import argparse
+import csv
+import os
+
+import numpy as np
+
+# --- 定数とファイル名 ---
+# 気温減率 (℃/100m)。コース・リゾートの標高補正はすべてこの値から計算する
+GRADIENT_RATE = 0.6
+# 観測所カタログ (全アメダス観測所など)。resorts.json の stations に追加して索引する
+# 列: key, name, prec_no, block_no, lat, lon, elev
+STATION_CATALOG_FILE = 'station_catalog.csv'
+EARTH_RADIUS_KM = 6371.0
+# 標高差 1m を何 km の水平距離とみなすか (100m の標高差 ≒ 1km)
+ELEVATION_SCALE_KM_PER_M = 0.01
+# 近傍観測所の数 (確認用の表示)
+DEFAULT_NEIGHBORS = 3
+
+
+def lapse_adjustment(target_elev, station_elev):
+    """観測所の標高から目標標高までの気温補正値 (℃、目標の方が高ければ正) を返す"""
+    return (np.asarray(target_elev, dtype=float) - station_elev) / 100 * GRADIENT_RATE
+
+
+def _to_xyz(lat, lon, elev):
+    """緯度経度を地球表面の3次元座標 (km) にし、尺度を揃えた標高を4次元目に加える"""
+    lat = np.radians(np.asarray(lat, dtype=float))
+    lon = np.radians(np.asarray(lon, dtype=float))
+    return np.stack([
+        EARTH_RADIUS_KM * np.cos(lat) * np.cos(lon),
+        EARTH_RADIUS_KM * np.cos(lat) * np.sin(lon),
+        EARTH_RADIUS_KM * np.sin(lat),
+        np.asarray(elev, dtype=float) * ELEVATION_SCALE_KM_PER_M,
+    ], axis=-1)
+
+
+# --- 観測所カタログ ---
+def read_catalog_csv(path):
+    """カタログCSVを {観測所キー: 定義} で返す (resorts.json の stations と同じ形式)"""
+    stations = {}
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            stations[row['key']] = {
+                'name': row['name'],
+                'prec_no': int(row['prec_no']),
+                'block_no': row['block_no'],
+                'lat': float(row['lat']),
+                'lon': float(row['lon']),
+                'elev': float(row['elev']),
+            }
+    return stations
+
+
+class StationCatalog:
+    """観測所の緯度・経度・標高を KD-tree に索引し、近傍観測所をまとめて検索する"""
+
+    def __init__(self, stations):
+        from scipy.spatial import cKDTree
+
+        if not stations:
+            raise ValueError("観測所カタログが空です。")
+        self.stations = stations
+        self.keys = np.asarray(list(stations), dtype=str)
+        self.lat = np.asarray([s['lat'] for s in stations.values()], dtype=float)
+        self.lon = np.asarray([s['lon'] for s in stations.values()], dtype=float)
+        self.elev = np.asarray([s['elev'] for s in stations.values()], dtype=float)
+        self.tree = cKDTree(_to_xyz(self.lat, self.lon, self.elev))
+
+    def query(self, lat, lon, elev, k=DEFAULT_NEIGHBORS):
+        """地点 (N,) ごとの近傍 k 観測所を返す
+
+        戻り値は (観測所の行番号 (N, k), 標高差を含めた距離 km (N, k))。近い順に並ぶ。
+        """
+        k = min(k, len(self.keys))
+        distances, indices = self.tree.query(_to_xyz(lat, lon, elev), k=k, workers=-1)
+        return np.asarray(indices).reshape(-1, k), np.asarray(distances).reshape(-1, k)
+
+    def nearest(self, lat, lon, elev):
+        """地点ごとの最寄り観測所のキー"""
+        indices, _ = self.query(lat, lon, elev, k=1)
+        return self.keys[indices[:, 0]]
+
+
+def load_station_catalog(stations, catalog_path=None):
+    """resorts.json の stations にカタログCSV (あれば) を加えた StationCatalog を作る
+
+    同じキーは resorts.json の定義を優先する。
+    """
+    merged = {}
+    if catalog_path and os.path.exists(catalog_path):
+        merged.update(read_catalog_csv(catalog_path))
+    merged.update(stations)
+    return StationCatalog(merged)
+
+
+# --- 実行 (近傍観測所の確認) ---
+if __name__ == '__main__':
+    from resort_registry import load_resort_registry
+
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        base_dir = os.getcwd()
+
+    parser = argparse.ArgumentParser(description='リゾートごとの割り当て観測所と近傍観測所を表示する')
+    parser.add_argument('--catalog', default=os.path.join(base_dir, STATION_CATALOG_FILE))
+    parser.add_argument('-k', type=int, default=DEFAULT_NEIGHBORS)
+    args = parser.parse_args()
+
+    registry = load_resort_registry()
+    catalog = load_station_catalog(registry.stations, args.catalog)
+    resorts = list(registry.resorts)
+    indices, distances = catalog.query(
+        [registry.resorts[r]['lat'] for r in resorts], [registry.resorts[r]['lon'] for r in resorts],
+        [registry.resorts[r]['elev'] for r in resorts], args.k
+    )
+    print(f"観測所 {len(catalog.keys)}件 / リゾート {len(resorts)}件")
+    for resort, row_indices, row_distances in zip(resorts, indices, distances):
+        parts = [f"{catalog.keys[i]} ({distance:.1f}km)" for i, distance in zip(row_indices, row_distances)]
+        print(f"{resort} → {registry.resorts[resort]['station']}: " + ', '.join(parts))
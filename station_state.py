@@ -0,0 +1,181 @@
+import copy
+import json
+import math
+import os
+from datetime import date
+
+from snapshots import atomic_write
+
+# --- 定数とファイル名 ---
+# 観測所ごとのシーズン累積状態 (チェックポイント)
+STATION_STATE_FILE = 'station_state.json'
+# 状態に反映済みの観測日 (リプレイ用の生データログ)
+OBSERVATION_LOG_FILE = 'station_observations.jsonl'
+# シーズンの開始月 (10月以降を新シーズンとして累積熱履歴をリセット)
+SEASON_START_MONTH = 10
+
+
+# --- 日付の補完 ---
+def resolve_observation_date(date_str, run_date):
+    """'11月13日' のような年なし日付を、取得日を基準に date に変換する
+
+    取得月より後の月は前年のデータとみなす (1月実行時の12月分など)。
+    """
+    month, day = date_str.replace('日', '').split('月')
+    month, day = int(month), int(day)
+    year = run_date.year - 1 if month > run_date.month else run_date.year
+    return date(year, month, day)
+
+
+def season_of(obs_date):
+    """観測日が属するシーズン (開始年) を返す"""
+    return obs_date.year if obs_date.month >= SEASON_START_MONTH else obs_date.year - 1
+
+
+# --- 状態の更新 (1観測日あたり O(1)) ---
+def new_station_state(adj_val):
+    """空のチェックポイントを作成する"""
+    return {
+        'adj_val': adj_val,
+        'season': None,
+        'last_date': None,
+        'observed_days': 0,
+        'prev_day_max_adj': float('nan'), # 最新日の前日の補正後最高気温
+        'latest_max_adj': float('nan'),   # 最新日の補正後最高気温
+        'cum_heat': 0.0,                  # シーズン累積熱履歴
+        'max_snow_depth': float('nan')    # 最新日の最深積雪
+    }
+
+
+def apply_observation(state, obs_date, temp_max, snow_depth):
+    """1日分の観測値をチェックポイントに反映する (反映済みの日は無視)"""
+    if state['last_date'] is not None and obs_date.isoformat() <= state['last_date']:
+        return False
+
+    # シーズンが変わったら累積値をリセット
+    season = season_of(obs_date)
+    if state['season'] != season:
+        state.update(new_station_state(state['adj_val']))
+        state['season'] = season
+
+    adj_max = temp_max - state['adj_val']
+    if not math.isnan(adj_max):
+        state['cum_heat'] = state['cum_heat'] + max(0, adj_max - 0)
+
+    state['prev_day_max_adj'] = state['latest_max_adj']
+    state['latest_max_adj'] = adj_max
+    state['max_snow_depth'] = snow_depth
+    state['last_date'] = obs_date.isoformat()
+    state['observed_days'] += 1
+    return True
+
+
+# --- チェックポイントの読み書き ---
+def load_station_state(base_dir):
+    path = os.path.join(base_dir, STATION_STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_station_state(base_dir, states):
+    atomic_write(os.path.join(base_dir, STATION_STATE_FILE), lambda f: json.dump(states, f, ensure_ascii=False, indent=4), mode='w')
+
+
+def _log_record(station, obs_date, temp_max, snow_depth):
+    return json.dumps({
+        'station': station, 'date': obs_date.isoformat(),
+        'temp_max_c': temp_max, 'snow_depth_max_cm': snow_depth
+    }) + '\n'
+
+
+def append_observation_log(base_dir, station, applied):
+    """状態に反映した観測日をログに追記する (どの値で確定したかの記録)"""
+    if not applied:
+        return
+    with open(os.path.join(base_dir, OBSERVATION_LOG_FILE), 'a', encoding='utf-8') as f:
+        for row in applied:
+            f.write(_log_record(station, *row))
+
+
+def checkpoint_needs_replay(states, adj_vals, today):
+    """補正値が変わった観測所、または当日以降まで進んだ観測所 (以前の版で速報値を確定させたもの) があるか"""
+    return any(
+        key in states and (states[key]['adj_val'] != adj_val or (states[key]['last_date'] or '') >= today.isoformat())
+        for key, adj_val in adj_vals.items()
+    )
+
+
+def update_station_state(base_dir, observations, adj_vals, today=None):
+    """前日までの新しい観測日だけをチェックポイントに反映して保存する
+
+    observations は {観測所キー: [(日付, 最高気温, 最深積雪), ...]} (日付順)。
+    当日の行は取得のたびに値が変わる速報値なので確定させない (provisional_station_states で仮に反映する)。
+    """
+    today = today or date.today()
+    states = load_station_state(base_dir)
+
+    for station, adj_val in adj_vals.items():
+        if station not in observations:
+            continue
+        state = states.setdefault(station, new_station_state(adj_val))
+
+        applied = [row for row in observations[station] if row[0] < today and apply_observation(state, *row)]
+        append_observation_log(base_dir, station, applied)
+
+    save_station_state(base_dir, states)
+    return states
+
+
+def provisional_station_states(states, observations, adj_vals):
+    """チェックポイントの写しに未反映の観測値 (当日の速報値を含む) を反映して返す (保存はしない)"""
+    provisional = copy.deepcopy(states)
+    for station, adj_val in adj_vals.items():
+        rows = observations.get(station, [])
+        if not rows:
+            continue
+        state = provisional.setdefault(station, new_station_state(adj_val))
+        for row in rows:
+            apply_observation(state, *row)
+    return provisional
+
+
+# --- リプレイ (ストアの観測値からチェックポイントを再構築) ---
+def replay_station_state(base_dir, observations, adj_vals, today=None):
+    """今シーズンの観測値から前日までの状態を作り直し、観測ログも書き直す
+
+    observations は update_station_state と同じ形式 (今シーズンの開始日から)。
+    """
+    today = today or date.today()
+    states = {}
+    with open(os.path.join(base_dir, OBSERVATION_LOG_FILE), 'w', encoding='utf-8') as f:
+        for station, adj_val in adj_vals.items():
+            state = new_station_state(adj_val)
+            for row in observations.get(station, []):
+                if row[0] < today and apply_observation(state, *row):
+                    f.write(_log_record(station, *row))
+            states[station] = state
+
+    save_station_state(base_dir, states)
+    return states
+
+
+# --- 実行 (リプレイツール) ---
+# 使い方: python station_state.py (観測・予報ストアの観測値から再構築する)
+if __name__ == '__main__':
+    from calculation import station_adjustments, load_new_observations
+    from weather_store import open_store, WEATHER_DB_FILE
+
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        base_dir = os.getcwd()
+
+    adj_vals = station_adjustments()
+    conn = open_store(os.path.join(base_dir, WEATHER_DB_FILE))
+    states = replay_station_state(base_dir, load_new_observations(conn, {}, adj_vals), adj_vals)
+    conn.close()
+    for station, state in states.items():
+        print(f"{station}: {state['last_date']} まで {state['observed_days']}日分 / 累積熱履歴 {state['cum_heat']:.1f}")
+    print(f"✅ チェックポイント '{STATION_STATE_FILE}' を再構築しました。")
@@ -1,36 +1,31 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
-import joblib 
-import json
 import os
 import plotly.express as px 
 import sys 
 
-# --- 0. ファイルと定数の設定 ---
-MODEL_FILE = 'gelacon_predictor_modela.pkl,'
-PAST_CACHE_FILE = 'past_data.json'
-FUTURE_CACHE_FILE = 'CF_data.json' 
-FEATURE_CACHE_FILE = 'XGBoost_Features_Cache.json'
+from prediction import load_prediction_cache, course_condition_rows, PREDICTION_CACHE_FILE
+from elevation_profile import load_profile_cache, PROFILE_CACHE_FILE
+from forecast_ensemble import load_ensemble_cache, ENSEMBLE_CACHE_FILE
+from subdaily_timeline import load_timeline_cache, TIMELINE_CACHE_FILE
+from resources import SnapshotResource
+import metrics
+from model_registry import CONDITIONS
+from resort_registry import load_resort_registry
 
-# 補正値とコース定義
-COURSE_TARGETS = {
-	'Kandatsu': [900, 700, 500],
-	'Marunuma': [1950, 1700, 1500, 1300]
-}
-AMEDAS_ELEVATIONS = {'Kandatsu': 340, 'Marunuma': 370} 
-CONDITIONS = {0: 'パウダー', 1: '神バーン', 2: 'アイスバーン', 3: 'シャバ雪/ゴロゴロ雪'}
+# --- 0. ファイルと定数の設定 ---
+# リゾートとコース標高の定義 (resorts.json)
+RESORTS = load_resort_registry()
 CONDITION_EMOJIS = {'パウダー': '✨', '神バーン': '💎', 'アイスバーン': '⚠️', 'シャバ雪/ゴロゴロ雪': '💧'} 
-MODEL_FEATURE_ORDER = [
-	'MaxSnowDepth', 'Snowfall', 'AvgWindSpeed', 'Adj_Temp_Min', 
-	'Night_Chill_Factor', 'Cumulative_Heat_History', 'Surface_Hardening_Risk', 'Course_Elev'
-]
+CONDITION_COLORS = {'パウダー': 'lightblue', '神バーン': 'green', 'アイスバーン': 'red', 'シャバ雪/ゴロゴロ雪': 'orange'}
+# クラス番号 → 名称・絵文字付きの名称 (行ごとの apply の代わりに配列の添字でまとめて引く)
+CONDITION_NAMES = np.array([CONDITIONS[i] for i in range(len(CONDITIONS))], dtype=object)
+CONDITION_LABELS = np.array([f"{CONDITION_EMOJIS[name]} {name}" for name in CONDITION_NAMES], dtype=object)
 
 # 変数の初期化 
 model_loaded = False 
-feature_cache_data = None
-past_cache_data = None
-future_cache_data = None
+prediction_cache = None
 
 # --- コメント定義関数 ---
 def get_snow_condition_comment(condition):
@@ -53,63 +48,196 @@ try:
 except NameError:
 	base_dir = os.getcwd() 
 
-try:
-	# 予測モデルをロード
-	model = joblib.load(os.path.join(base_dir, MODEL_FILE))
-	
-	# 過去データと未来データをJSONからロード (存在しない場合はエラーにしない)
-	try:
-		with open(os.path.join(base_dir, PAST_CACHE_FILE), 'r', encoding='utf-8') as f:
-			past_cache_data = json.load(f)
-		with open(os.path.join(base_dir, FUTURE_CACHE_FILE), 'r', encoding='utf-8') as f:
-			future_cache_data = json.load(f)
-	except FileNotFoundError as e:
-		st.warning(f"注意: 依存ファイル ({e.filename}) が見つかりません。予測コアロジックには影響しませんが、サイドバーのデバッグ情報等は不完全になります。")
+# プロセス全体で共有するリソース (セッション間で1回だけ読み込み、新しいスナップショットの公開時のみ再読み込み)
+@st.cache_resource
+def get_shared_resources():
+	return {
+		'predictions': SnapshotResource(
+			base_dir, [PREDICTION_CACHE_FILE],
+			lambda: load_prediction_cache(base_dir)
+		),
+		# 任意: 標高プロファイル (calculation.py --profile で生成)
+		'profiles': SnapshotResource(
+			base_dir, [PROFILE_CACHE_FILE],
+			lambda: load_profile_cache(base_dir)
+		),
+		# 任意: 予報の誤差を摂動したアンサンブル (forecast_ensemble.py で生成)
+		'ensembles': SnapshotResource(
+			base_dir, [ENSEMBLE_CACHE_FILE],
+			lambda: load_ensemble_cache(base_dir)
+		),
+		# 任意: 3時間ごとの時間帯別タイムライン (subdaily_timeline.py で生成)
+		'timelines': SnapshotResource(
+			base_dir, [TIMELINE_CACHE_FILE],
+			lambda: load_timeline_cache(base_dir)
+		)
+	}
+
+shared_resources = get_shared_resources()
 
-	# 必須: 特徴量キャッシュをロード 
-	with open(os.path.join(base_dir, FEATURE_CACHE_FILE), 'r', encoding='utf-8') as f:
-		feature_cache_data = json.load(f)
+try:
+	# 必須: 予測結果キャッシュをロード (モデルの予測は calculation.py 実行時に一括で済ませている)
+	prediction_cache, prediction_version = shared_resources['predictions'].snapshot()
+	if shared_resources['predictions'].error is not None:
+		st.warning(f"注意: 予測結果キャッシュの再読み込みに失敗したため、前回の予測結果を表示しています。詳細: {shared_resources['predictions'].error}")
 		
 	model_loaded = True
 
 except FileNotFoundError as e:
-	st.error(f"エラー: 必要なファイルが見つかりません。特に '{MODEL_FILE}' または '{FEATURE_CACHE_FILE}' を確認してください。パス: {e.filename}")
+	st.error(f"エラー: 必要なファイルが見つかりません。特に '{PREDICTION_CACHE_FILE}' を確認してください (calculation.py を実行すると生成されます)。パス: {e.filename}")
 except Exception as e:
 	st.error(f"エラー: モデルまたはキャッシュファイル ({e.__class__.__name__}) の読み込みに失敗しました。詳細: {e}")
 	
-# --- 2. 予測実行関数 (特徴量キャッシュを使用) ---
-def run_model_prediction(feature_data_list, course_elev):
+# --- 描画結果のキャッシュ ---
+# 各関数には読み込み済みのスナップショットを "_" 付きの引数 (ハッシュしない) で、そのバージョンと一緒に渡す。
+# 関数内でリソースを読み直すと、他のセッションの再読み込みで新しい内容が古いバージョンのキーに入ることがある。
+
+# --- 標高プロファイルのグラフ (スナップショットのバージョン・リゾート・日付ごとに1回だけ作成) ---
+@st.cache_data(max_entries=64)
+def build_profile_figure(_profile_cache, profile_version, resort_key, selected_date):
+	profile = _profile_cache['profiles'][resort_key]
+	day = list(profile['dates']).index(selected_date)
+	elevs = profile['elevs']
+	probs = profile['probabilities'][:, day, :]
 	
-	if not feature_data_list:
-		return []
+	profile_df = pd.DataFrame({
+		'Elevation': np.tile(elevs, len(CONDITIONS)),
+		'Condition': np.repeat(list(CONDITIONS.values()), len(elevs)),
+		'Probability': (probs.T.reshape(-1) * 100).round(1)
+	})
+	fig = px.area(
+		profile_df, x='Probability', y='Elevation', color='Condition', orientation='h',
+		title=f"{selected_date} の標高別バーン確率",
+		color_discrete_map=CONDITION_COLORS
+	)
 	
-	predictions = []
+	# 最上位の雪面状態が変わる標高に線を引く
+	transitions = profile['transitions']
+	for elev, lower, upper in zip(
+		transitions['elevs'][transitions['dates'] == selected_date],
+		transitions['from_classes'][transitions['dates'] == selected_date],
+		transitions['to_classes'][transitions['dates'] == selected_date]
+	):
+		fig.add_hline(
+			y=int(elev), line_dash='dash', line_color='black',
+			annotation_text=f"{int(elev)}m: {CONDITIONS[int(lower)]} → {CONDITIONS[int(upper)]}"
+		)
+	fig.update_layout(xaxis_title='確率 (%)', yaxis_title='標高 (m)', height=600)
+	return fig
+
+# --- 時間帯別タイムラインのグラフ (スナップショットのバージョン・コース・日付ごとに1回だけ作成) ---
+@st.cache_data(max_entries=64)
+def build_timeline_figure(_timeline_cache, timeline_version, feature_key, selected_date):
+	timeline = _timeline_cache
+	rows = timeline['course_slices'][feature_key]
+	times = timeline['times'][rows]
+	on_day = np.char.startswith(times, selected_date)
+	slot_labels = [t[11:16] for t in times[on_day]]
+	probs = timeline['probabilities'][rows][on_day]
 	
-	# 特徴量リストをNumpy配列に変換 (XGBoostモデルへの入力)
-	features_array = np.array([item['Features'] for item in feature_data_list])
+	timeline_df = pd.DataFrame({
+		'Time': np.tile(slot_labels, len(CONDITIONS)),
+		'Condition': np.repeat(list(CONDITIONS.values()), len(slot_labels)),
+		'Probability': (probs.T.reshape(-1) * 100).round(1)
+	})
+	fig = px.bar(
+		timeline_df, x='Time', y='Probability', color='Condition',
+		title=f"{selected_date} の時間帯別バーン確率",
+		color_discrete_map=CONDITION_COLORS
+	)
+	fig.update_layout(xaxis_title='時刻', yaxis_title='確率 (%)', barmode='stack')
+	return fig
 
-	try:
-		# モデルによる予測を実行 (確率を出力) 
-		# 出力は [サンプル数, クラス数(4)] の確率配列
-		probabilities = model.predict_proba(features_array)
-	except Exception as e:
-		st.error(f"モデル予測エラー: {e}")
-		return []
+# --- コンディションマップ (スナップショットのバージョン・リゾートごとに1回だけ作成し、セッション間で共有) ---
+@st.cache_data(max_entries=64)
+def build_condition_table(_prediction_cache, prediction_version, base_key):
+	"""リゾート内の全コースの (標高 × 日付) の表とセルのスタイルを作る
 
-	for item, probs in zip(feature_data_list, probabilities):
-		
-		# 最も確率の高い条件を決定
-		predicted_class = np.argmax(probs)
-		top_condition = CONDITIONS.get(predicted_class, '不明')
-		
-		predictions.append({
-			'Date': item['Date'],
-			'Condition': top_condition,
-			'Probabilities': probs.tolist(), 
-			'Course_Elev': course_elev
-		})
-			
-	return predictions
+	最上位の状態は一括予測時の argmax (classes) から配列の添字で引くので、行ごとの処理はない。
+	"""
+	target_elevations = RESORTS.courses(base_key)
+	rows = course_condition_rows(
+		_prediction_cache,
+		[f"{base_key}_{elev}m" for elev in target_elevations], target_elevations
+	)
+	elev_labels = np.char.add(rows['course_elevs'].astype(str), 'm')
+	table = {
+		'dates': pd.unique(rows['dates']),
+		'elevs': pd.unique(elev_labels),
+		'missing': rows['missing'],
+		'pivot': None,
+		'styles': None
+	}
+	if not len(rows['dates']):
+		return table
+	
+	# 標高(index)と日付(columns)の表 (target_elevations は降順)
+	pivot = pd.DataFrame({
+		'Course_Elev': elev_labels,
+		'Date': rows['dates'],
+		'Formatted_Condition': CONDITION_LABELS[rows['classes']]
+	}).pivot(index='Course_Elev', columns='Date', values='Formatted_Condition').reindex(
+		[f"{elev}m" for elev in target_elevations]
+	)
+	
+	# 標高が高いほど濃い青 (Hue=240, Saturation=70%, Lightness=70% - 正規化した標高 × 30%)
+	elevs = np.asarray(target_elevations, dtype=float)
+	elev_range = elevs.max() - elevs.min()
+	normalized_elev = (elevs - elevs.min()) / elev_range if elev_range > 0 else np.full(len(elevs), 0.5)
+	row_styles = [
+		f"background-color: hsl(240, 70%, {float(lightness)}%); color: white; text-align: center; font-size: 0.75em;"
+		for lightness in 70 - normalized_elev * 30
+	]
+	table['pivot'] = pivot
+	table['styles'] = pd.DataFrame(
+		np.repeat(np.asarray(row_styles, dtype=object)[:, None], pivot.shape[1], axis=1),
+		index=pivot.index, columns=pivot.columns
+	)
+	return table
+
+# --- 選択した日付・標高の確率の円グラフとアドバイス (バージョン・リゾート・日付・標高ごとに1回だけ作成) ---
+@st.cache_data(max_entries=256)
+def build_course_detail(_prediction_cache, prediction_version, base_key, selected_date, selected_elev):
+	cache = _prediction_cache
+	rows = cache['course_slices'][f"{base_key}_{selected_elev}"]
+	row = rows.start + list(cache['dates'][rows]).index(selected_date)
+	
+	prob_data = pd.DataFrame({
+		'Condition': CONDITION_NAMES,
+		'Probability': (cache['probabilities'][row] * 100).round(1)
+	}).sort_values(by='Probability', ascending=False)
+	prob_fig = px.pie(
+		prob_data, 
+		values='Probability', 
+		names='Condition', 
+		title=f"{selected_elev} / {selected_date} のバーン確率",
+		color='Condition',
+		color_discrete_map=CONDITION_COLORS
+	)
+	prob_fig.update_traces(textinfo='percent+label')
+	return {'top_condition': CONDITION_NAMES[int(cache['classes'][row])], 'figure': prob_fig}
+
+# --- アンサンブルの信頼区間のグラフ (バージョン・コース・日付ごとに1回だけ作成) ---
+@st.cache_data(max_entries=256)
+def build_ensemble_figure(_ensemble_cache, ensemble_version, feature_key, selected_date, selected_elev):
+	ensemble_cache = _ensemble_cache
+	rows = ensemble_cache['course_slices'][feature_key]
+	row = rows.start + list(ensemble_cache['dates'][rows]).index(selected_date)
+	band_data = pd.DataFrame({
+		'Condition': list(CONDITIONS.values()),
+		'Probability': ensemble_cache['mean'][row] * 100,
+		'Lower': ensemble_cache['lower'][row] * 100,
+		'Upper': ensemble_cache['upper'][row] * 100,
+	})
+	band_fig = px.bar(
+		band_data, x='Condition', y='Probability', color='Condition',
+		color_discrete_map=CONDITION_COLORS,
+		error_y=band_data['Upper'] - band_data['Probability'],
+		error_y_minus=band_data['Probability'] - band_data['Lower'],
+		title=f"{selected_elev} / {selected_date} の予報誤差を考慮した確率 ({ensemble_cache['n_members']}通り)"
+	)
+	band_fig.update_layout(showlegend=False, yaxis_title='確率 (%)', yaxis_range=[0, 100])
+	return band_fig
 
 # --- 3. Streamlit UI (メインルーチン) ---
 
@@ -130,108 +258,41 @@ st.markdown(
 st.markdown(" AIによる5日間先のバーン予測")
 
 
-if model_loaded and feature_cache_data:
+# 画面の描画時間 (再実行ごと) を計測する
+render_span = metrics.start_span('render')
+
+if model_loaded and prediction_cache is not None:
 	
 	# リゾートの選択 (サイドバー)
 	st.sidebar.header("🏔️ リゾート選択")
-	resort_options = ['神立スノーリゾート', '丸沼高原スキー場']
+	resort_options = [resort['name'] for resort in RESORTS.resorts.values()]
 	selected_resort = st.sidebar.selectbox("予測リゾートを選択", resort_options)
 	st.sidebar.markdown("---")
 
 	# A. 選択リゾートの設定をフィルタリング
-	base_key = 'Kandatsu' if selected_resort == '神立スノーリゾート' else 'Marunuma'
-	
-	# 予測結果を格納するリストとDataFrame
-	all_predictions_df = []
+	base_key = RESORTS.resort_by_name[selected_resort]
 	
 	st.header(f"予測対象: {selected_resort}")
 	st.markdown("---")
 	
-	# ターゲット標高リストを取得
-	target_elevations = COURSE_TARGETS[base_key]
-	
-	# B. コースごとの予測実行ループ
-	for course_elev in target_elevations:
-		
-		# 特徴量キャッシュから該当するデータセットを取得するためのキーを作成
-		feature_key = f"{base_key}_{course_elev}m"
-		
-		# 該当する特徴量データリストを取得
-		feature_data_list = feature_cache_data['features'].get(feature_key, [])
-		
-		if not feature_data_list:
-			st.warning(f"注意: {feature_key} の特徴量データがキャッシュに見つかりません。スキップします。")
-			continue # データがない場合はスキップ
-		
-		# 1. 予測の実行 (日別データを計算)
-		predictions = run_model_prediction(feature_data_list, course_elev)
-		
-		# 予測結果をDataFrameに変換して統合
-		df_course = pd.DataFrame(predictions)
-		df_course['Course_Elev'] = df_course['Course_Elev'].astype(str) + 'm'
-		all_predictions_df.append(df_course)
+	# B. 全コースの表 (同じ予測結果のバージョンとリゾートなら他のセッションで作成済みのものを使う)
+	condition_table = build_condition_table(prediction_cache, prediction_version, base_key)
+	for feature_key in condition_table['missing']:
+		st.warning(f"注意: {feature_key} の予測データがキャッシュに見つかりません。スキップします。")
 
 	# 予測データが存在する場合のみUIを表示
-	if all_predictions_df:
-		df_combined = pd.concat(all_predictions_df)
+	if condition_table['pivot'] is not None:
 		
 		# --- UI表示のメイン部分 ---
 		
 		# 1. 標高ごとのコンディションサマリ（左上）
 		st.subheader("1. 🗺️ コンディションマップ")
 		
-		# 各日付で最も確率の高いコンディションを取得
-		df_combined['Top_Condition'] = df_combined.apply(lambda row: CONDITIONS[np.argmax(row['Probabilities'])], axis=1)
-		
-		# 修正: 絵文字と日本語名を結合した新しいカラムを作成
-		def format_condition(row):
-			emoji = CONDITION_EMOJIS[row['Top_Condition']]
-			# 略称を使用せず、完全な名称を使用
-			name = row['Top_Condition'] 
-			return f"{emoji} {name}"
-			
-		df_combined['Formatted_Condition'] = df_combined.apply(format_condition, axis=1)
-		
-		# Plotly Heatmap (imshow) の代わりにPandas Stylerを使用
-		# 標高(index)と日付(columns)でピボットテーブルを作成
-		pivot_table_formatted = df_combined.pivot_table(
-			index='Course_Elev', 
-			columns='Date', 
-			values='Formatted_Condition', # 結合した文字列を使用
-			aggfunc='first'
-		# 修正後のポイント: target_elevations をそのまま使用 (降順であるため)
-		).reindex([str(e) + 'm' for e in target_elevations])
-		
-		# 標高の数値だけを取り出し、ソートしてグラデーションの基準を作成
-		elev_floats = [float(e.replace('m', '')) for e in pivot_table_formatted.index]
-		min_elev = min(elev_floats)
-		max_elev = max(elev_floats)
-		
-		# --- グラデーション関数 ---
-		def elevation_gradient(s):
-			# 各標高行に対応するグラデーションを適用する
-			styles = []
-			elev_str = s.name
-			elev_val = float(elev_str.replace('m', ''))
-			
-			# 0.1から0.7の範囲で青の濃淡を計算
-			normalized_elev = (elev_val - min_elev) / (max_elev - min_elev) if max_elev > min_elev else 0.5
-			# Hue=240(青), Saturation=70%, Lightness=70% - (normalized)*30% (標高が高いほど色が濃い青)
-			lightness = 70 - (normalized_elev * 30) 
-			
-			bg_color = f"hsl(240, 70%, {lightness}%)"
-			
-			
-			for _ in s.index:
-				styles.append(f'background-color: {bg_color}; color: white; text-align: center; font-size: 0.75em;')
-			return styles
-		# ------------------------------------
-
-		# Stylerを適用してHTMLテーブルとしてStreamlitに表示
+		# Plotly Heatmap (imshow) の代わりにPandas Stylerを使用 (スタイルは作成済みのものを当てるだけ)
 		st.dataframe(
-			pivot_table_formatted.style.apply(elevation_gradient, axis=1), 
+			condition_table['pivot'].style.apply(lambda _: condition_table['styles'], axis=None), 
 			use_container_width=True,
-			height=len(target_elevations) * 70
+			height=len(condition_table['pivot']) * 70
 		)
 		
 		st.markdown("---")
@@ -241,53 +302,80 @@ if model_loaded and feature_cache_data:
 		
 		col1, col2 = st.columns(2)
 		
-		unique_dates = df_combined['Date'].unique()
-		unique_elevs = df_combined['Course_Elev'].unique()
-
 		with col1:
-			selected_date = st.selectbox("予測日を選択", unique_dates)
+			selected_date = st.selectbox("予測日を選択", condition_table['dates'])
 			
 		with col2:
-			selected_elev = st.selectbox("コース標高を選択 (m)", unique_elevs)
+			selected_elev = st.selectbox("コース標高を選択 (m)", condition_table['elevs'])
 			
-		df_filtered = df_combined[
-			(df_combined['Date'] == selected_date) & 
-			(df_combined['Course_Elev'] == selected_elev)
-		].iloc[0]
-		
+		course_detail = build_course_detail(prediction_cache, prediction_version, base_key, selected_date, selected_elev)
 
 		st.markdown("<br><br>", unsafe_allow_html=True) 
 		
 		st.markdown("#### 💬 今日のアドバイス")
-		top_condition_for_comment = df_filtered['Top_Condition']
-		st.info(get_snow_condition_comment(top_condition_for_comment))
+		st.info(get_snow_condition_comment(course_detail['top_condition']))
 		
 		st.markdown("<br><br>", unsafe_allow_html=True) 
 		
-		prob_data = pd.DataFrame({
-			'Condition': list(CONDITIONS.values()),
-			'Probability': df_filtered['Probabilities']
-		})
+		# 円グラフの描画
+		st.plotly_chart(course_detail['figure'], use_container_width=True)
+		
+		# アンサンブルの信頼区間 (アンサンブルのキャッシュがある場合のみ)
+		try:
+			ensemble_cache, ensemble_version = shared_resources['ensembles'].snapshot()
+		except FileNotFoundError:
+			ensemble_cache = None
+		except Exception as e:
+			ensemble_cache = None
+			st.warning(f"注意: アンサンブル予測の読み込みに失敗しました。詳細: {e}")
+		
+		ensemble_key = f"{base_key}_{selected_elev}"
+		ensemble_rows = ensemble_cache['course_slices'].get(ensemble_key) if ensemble_cache else None
+		if ensemble_rows is not None and selected_date in ensemble_cache['dates'][ensemble_rows]:
+			st.plotly_chart(
+				build_ensemble_figure(ensemble_cache, ensemble_version, ensemble_key, selected_date, selected_elev),
+				use_container_width=True
+			)
+			st.caption("気温・風速・降雪量の予報に先の日ほど大きな誤差を与えた場合の平均確率です。誤差範囲は5〜95%の区間です。")
 		
-		prob_data['Probability'] = (prob_data['Probability'] * 100).round(1)
-		prob_data = prob_data.sort_values(by='Probability', ascending=False)
+		# 3. 標高プロファイル (プロファイルのキャッシュがある場合のみ)
+		try:
+			profile_cache, profile_version = shared_resources['profiles'].snapshot()
+		except FileNotFoundError:
+			profile_cache = None
+		except Exception as e:
+			profile_cache = None
+			st.warning(f"注意: 標高プロファイルの読み込みに失敗しました。詳細: {e}")
+		
+		profile = profile_cache['profiles'].get(base_key) if profile_cache else None
+		if profile is not None and selected_date in profile['dates']:
+			st.markdown("---")
+			st.subheader("3. ⛰️ 標高プロファイル")
+			st.caption(f"ベース〜山頂を {profile_cache['step']}m 間隔で予測した結果です。破線は最も確率の高い状態が変わる標高です。")
+			st.plotly_chart(
+				build_profile_figure(profile_cache, profile_version, base_key, selected_date),
+				use_container_width=True
+			)
 
-		# 円グラフの描画
-		prob_fig = px.pie(
-			prob_data, 
-			values='Probability', 
-			names='Condition', 
-			title=f"{selected_elev} / {selected_date} のバーン確率",
-			color='Condition',
-			color_discrete_map={
-				'パウダー': 'lightblue', 
-				'神バーン': 'green', 
-				'アイスバーン': 'red', 
-				'シャバ雪/ゴロゴロ雪': 'orange'
-			}
-		)
-		prob_fig.update_traces(textinfo='percent+label')
-		st.plotly_chart(prob_fig, use_container_width=True)
+		# 4. 時間帯別タイムライン (タイムラインのキャッシュがある場合のみ)
+		try:
+			timeline_cache, timeline_version = shared_resources['timelines'].snapshot()
+		except FileNotFoundError:
+			timeline_cache = None
+		except Exception as e:
+			timeline_cache = None
+			st.warning(f"注意: 時間帯別タイムラインの読み込みに失敗しました。詳細: {e}")
+		
+		timeline_key = f"{base_key}_{selected_elev}"
+		timeline_rows = timeline_cache['course_slices'].get(timeline_key) if timeline_cache else None
+		if timeline_rows is not None and np.char.startswith(timeline_cache['times'][timeline_rows], selected_date).any():
+			st.markdown("---")
+			st.subheader("4. 🕒 時間帯別タイムライン")
+			st.caption(f"{timeline_cache['slot_hours']}時間ごとの予報から、直前24時間の移動窓で特徴量を計算して予測した結果です。")
+			st.plotly_chart(
+				build_timeline_figure(timeline_cache, timeline_version, timeline_key, selected_date),
+				use_container_width=True
+			)
 
 	else:
 		st.warning("選択したリゾート、またはコースの予測データが見つかりませんでした。")
@@ -295,6 +383,11 @@ if model_loaded and feature_cache_data:
 else:
 	st.error("予測システムを起動できません。必要なファイルが揃っているか確認してください。")
 
+render_span.end()
+metrics.inc('renders_total')
+# アプリは常駐するため、メトリクスファイルは一定間隔でのみ書き直す
+metrics.flush_metrics(metrics.FLUSH_INTERVAL_SEC)
+
 # --- 実行 ---
 if __name__ == '__main__':
 	pass
\ No newline at end of file
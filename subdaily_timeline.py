@@ -0,0 +1,177 @@
+import argparse
+import os
+from datetime import datetime
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+import metrics
+from calculation import (
+    course_adjustment, station_adjustments, initial_history_from_states, current_station_states, MODEL_FEATURE_ORDER
+)
+from elevation_profile import predict_in_batches
+from prediction import load_model
+from resort_registry import load_resort_registry
+from snapshots import publish_artifacts, resolve_artifact
+from weather_store import open_store, latest_forecast_steps, WEATHER_DB_FILE
+
+# --- 定数とファイル名 ---
+# 3時間ごとの時間帯 × コースの予測結果
+TIMELINE_CACHE_FILE = 'XGBoost_Timeline_Cache.npz'
+# 予報の時間間隔 (OpenWeatherMap /forecast は3時間ごと)
+SLOT_HOURS = 3
+# 日別の特徴量に相当させる移動窓 (24時間分の時間帯数)
+SLOTS_PER_DAY = 24 // SLOT_HOURS
+
+
+# --- 移動窓 ---
+def trailing_windows(values, window, fill):
+    """各時間帯について、その時間帯を含む直前 window 個の値を並べる (T × window)
+
+    予報の開始前にあたる部分は fill で埋める。
+    """
+    values = np.asarray(values, dtype=float)
+    padded = np.concatenate([np.full(window - 1, fill), values])
+    return sliding_window_view(padded, window)
+
+
+# --- ベクトル化した時間帯別の特徴量 ---
+def compute_slot_feature_matrix(temp_max, temp_min, wind, snowfall, course_elevs, amedas_elev,
+                                prev_day_max_adj, cum_heat_base, max_snow_depth, window=SLOTS_PER_DAY):
+    """(コース × 時間帯) の特徴量行列を移動窓で一括計算する
+
+    日別の特徴量を直前24時間の移動窓に置き換えたもの:
+    - Snowfall / AvgWindSpeed は直前24時間 (その時間帯を含む) の合計 / 平均
+    - Adj_Temp_Min はその時間帯の補正後最低気温
+    - Night_Chill_Factor は直前24時間 (その時間帯を含まない) の補正後最高気温 − その時間帯の補正後最低気温
+    - Cumulative_Heat_History は直前24時間の補正後最高気温の正の部分を時間帯ごとに 1/window ずつ積算
+      (1日を通して同じ気温なら日別の累積熱履歴と同じ増え方になる)
+    - MaxSnowDepth は前の時間帯までの降雪量を繰り越す
+    気温の補正はコースごとに一定なので、移動窓は補正前の (T,) 配列で1回だけ計算する。
+    戻り値は (C, T, len(MODEL_FEATURE_ORDER))。
+    """
+    temp_max = np.asarray(temp_max, dtype=float)
+    temp_min = np.asarray(temp_min, dtype=float)
+    snowfall = np.asarray(snowfall, dtype=float)
+    course_elevs = np.asarray(course_elevs, dtype=float)
+    n_slots = len(temp_max)
+
+    # A. 移動窓 (T,)
+    max_windows = trailing_windows(temp_max, window + 1, -np.inf)
+    prev_max_raw = max_windows[:, :-1].max(axis=1)
+    day_max_raw = max_windows[:, 1:].max(axis=1)
+    snowfall_24h = trailing_windows(snowfall, window, 0.0).sum(axis=1)
+    wind_24h = np.nanmean(trailing_windows(wind, window, np.nan), axis=1)
+
+    # B. 標高補正 (C, T)
+    adjustment_value = course_adjustment(course_elevs, amedas_elev)[:, None]
+    adj_min = temp_min - adjustment_value
+    prev_max = prev_max_raw - adjustment_value
+    # 直前24時間が予報の開始前にかかる時間帯は、前日の補正後最高気温も候補に含める
+    prev_max = np.where(np.arange(n_slots) < window, np.maximum(prev_max, prev_day_max_adj), prev_max)
+    night_chill = prev_max - adj_min
+
+    # C. 累積熱履歴・最深積雪
+    heat_slot = np.maximum(0, day_max_raw - adjustment_value) / window
+    cum_heat = cum_heat_base + np.cumsum(heat_slot, axis=-1)
+    snow_depth = max_snow_depth + np.concatenate([[0.0], np.cumsum(snowfall)])[:-1]
+
+    # D. 雪面硬化リスク
+    hardening_risk = wind_24h**2 * np.where(adj_min < 0, 1.5, 1.0)
+
+    shape = adj_min.shape
+    columns = {
+        'MaxSnowDepth': snow_depth,
+        'Snowfall': snowfall_24h,
+        'AvgWindSpeed': wind_24h,
+        'Adj_Temp_Min': adj_min,
+        'Night_Chill_Factor': night_chill,
+        'Cumulative_Heat_History': cum_heat,
+        'Surface_Hardening_Risk': hardening_risk,
+        'Course_Elev': course_elevs[:, None],
+    }
+    return np.stack([np.broadcast_to(columns[feat], shape) for feat in MODEL_FEATURE_ORDER], axis=-1)
+
+
+# --- 一括計算 ---
+@metrics.timed('inference', mode='timeline')
+def generate_subdaily_timeline(base_dir, model=None):
+    """全リゾート・全コースの3時間ごとの時間帯を一括で予測し、コース → 時刻の順で保存する
+
+    引き継ぎ状態は calculation.py と同じ観測所チェックポイントを使う。
+    """
+    store_path = os.path.join(base_dir, WEATHER_DB_FILE)
+    if not os.path.exists(store_path):
+        print(f"エラー: 観測・予報ストア '{store_path}' が見つかりません。")
+        return None
+
+    registry = load_resort_registry()
+    conn = open_store(store_path)
+    adj_vals = station_adjustments(registry)
+    initial_history = initial_history_from_states(current_station_states(conn, base_dir, adj_vals), adj_vals)
+
+    # A. リゾートごとに (コース × 時間帯 × 特徴量) を一括計算
+    course_keys, course_elevs, row_counts, row_times, blocks = [], [], [], [], []
+    for resort in registry.resorts:
+        past_base = initial_history.get(registry.station_of(resort))
+        steps = latest_forecast_steps(conn, resort)
+        if past_base is None or len(steps['times']) == 0:
+            print(f"注意: {resort} の過去データまたは3時間ごとの予報が無いため、タイムラインをスキップします。")
+            continue
+        courses = registry.courses(resort)
+        features = compute_slot_feature_matrix(
+            steps['temp_max_c'], steps['temp_min_c'], steps['wind_ms'], steps['snowfall_cm'],
+            courses, registry.amedas_elev(resort),
+            past_base['PrevDayMaxTemp'], past_base['CumulativeHeatHistoryBase'], past_base['MaxSnowDepth']
+        )
+        times = np.datetime_as_string(steps['times'], unit='m')
+        for course_elev, course_matrix in zip(courses, features):
+            course_keys.append(f"{resort}_{course_elev}m")
+            course_elevs.append(course_elev)
+            row_counts.append(len(times))
+            row_times.append(times)
+            blocks.append(course_matrix)
+    conn.close()
+
+    # B. 全コース分を1つの行列にまとめてバッチ予測
+    matrix = np.concatenate(blocks).astype(np.float32) if blocks else np.empty((0, len(MODEL_FEATURE_ORDER)), np.float32)
+    if model is None:
+        model = load_model(base_dir)
+    probabilities = predict_in_batches(model, matrix)
+
+    arrays = dict(
+        course_keys=np.asarray(course_keys, dtype=str),
+        course_elevs=np.asarray(course_elevs, dtype=np.int64),
+        course_offsets=np.concatenate([[0], np.cumsum(row_counts, dtype=np.int64)]),
+        times=np.concatenate(row_times) if row_times else np.empty(0, str),
+        probabilities=probabilities,
+        classes=np.argmax(probabilities, axis=1).astype(np.int8) if len(probabilities) else np.empty(0, np.int8),
+        slot_hours=np.asarray(SLOT_HOURS),
+        timestamp=np.asarray(datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+    )
+    publish_artifacts(base_dir, {TIMELINE_CACHE_FILE: lambda f: np.savez(f, **arrays)})
+    print(f"✅ {len(course_keys)}コース / {len(matrix)}行の時間帯別タイムライン '{TIMELINE_CACHE_FILE}' を生成しました。")
+    return probabilities
+
+
+# --- 読み込み ---
+def load_timeline_cache(base_dir):
+    """時間帯別の予測結果を読み込む ('times' は 'YYYY-MM-DDTHH:MM' のローカル時刻)"""
+    from feature_cache import build_course_slices
+
+    with np.load(resolve_artifact(base_dir, TIMELINE_CACHE_FILE), allow_pickle=False) as npz:
+        cache = {key: npz[key] for key in npz.files}
+    cache['timestamp'] = str(cache['timestamp'])
+    cache['course_slices'] = build_course_slices(cache)
+    return cache
+
+
+# --- 実行 ---
+if __name__ == '__main__':
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        base_dir = os.getcwd()
+
+    argparse.ArgumentParser(description='3時間ごとの予報から時間帯別の雪面状態を予測する').parse_args()
+    generate_subdaily_timeline(base_dir)
@@ -0,0 +1,9 @@
+import os
+import sys
+import tempfile
+
+# モジュールはリポジトリ直下に平置きなので、テストから直接 import できるようにする
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# テスト中のメトリクス・構造化ログを本番の metrics/ に書かない (metrics は読み込み時に出力先を決める)
+os.environ.setdefault('GELACON_METRICS_DIR', tempfile.mkdtemp(prefix='gelacon-metrics-'))
@@ -0,0 +1,25 @@
+import os
+
+import numpy as np
+import pytest
+
+from model_registry import import_pickle_model, load_registered_model, NativeModel, NATIVE_MODEL_FILE
+from tree_model import PARITY_TOLERANCE
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_import_pickle_model_matches_pickle(tmp_path):
+    pytest.importorskip('xgboost')
+    pytest.importorskip('joblib')
+    from prediction import load_xgboost_model, MODEL_FILE
+
+    manifest = import_pickle_model(str(tmp_path), os.path.join(BASE_DIR, MODEL_FILE), version='imported')
+    xgb_model = load_xgboost_model(BASE_DIR)
+    rng = np.random.default_rng(0)
+    X = rng.uniform(-30.0, 300.0, size=(2000, xgb_model.n_features_in_)).astype(np.float32)
+
+    assert manifest['training']['source'] == MODEL_FILE
+    native = NativeModel(os.path.join(tmp_path, 'imported', NATIVE_MODEL_FILE))
+    for model in (load_registered_model(str(tmp_path), 'imported'), native):
+        np.testing.assert_allclose(model.predict_proba(X), xgb_model.predict_proba(X), atol=PARITY_TOLERANCE)
@@ -0,0 +1,62 @@
+import os
+import shutil
+
+import numpy as np
+
+from feature_cache import FEATURE_MATRIX_FILE, FEATURE_INDEX_FILE
+from prediction import generate_predictions, load_prediction_cache, PREDICTION_CACHE_FILE
+from resources import SnapshotResource
+from snapshots import artifact_version, list_versions, publish_artifacts, read_manifest, rollback_artifact
+from tree_model import TREE_MODEL_FILE
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_publish_reload_and_rollback_of_predictions(tmp_path):
+    """リポジトリの特徴量キャッシュとモデルで 公開 → 再読み込み → ロールバック を1周する"""
+    for name in (FEATURE_MATRIX_FILE, FEATURE_INDEX_FILE, TREE_MODEL_FILE):
+        shutil.copy(os.path.join(BASE_DIR, name), tmp_path)
+    base_dir = str(tmp_path)
+    resource = SnapshotResource(base_dir, [PREDICTION_CACHE_FILE], lambda: load_prediction_cache(base_dir))
+
+    first_probabilities = generate_predictions(base_dir)
+    first_version = artifact_version(base_dir, PREDICTION_CACHE_FILE)
+    first, version = resource.snapshot()
+    assert version == (first_version,)
+    np.testing.assert_allclose(first['probabilities'], first_probabilities, atol=1e-6)
+
+    generate_predictions(base_dir)
+    second_version = artifact_version(base_dir, PREDICTION_CACHE_FILE)
+    second, version = resource.snapshot()
+    assert second_version != first_version
+    assert version == (second_version,) and second is not first
+    assert resource.snapshot()[0] is second  # 変わっていなければ読み込み直さない
+
+    assert rollback_artifact(base_dir, PREDICTION_CACHE_FILE) == ([PREDICTION_CACHE_FILE], first_version)
+    restored, version = resource.snapshot()
+    assert version == (first_version,)
+    assert restored['timestamp'] == first['timestamp']
+    np.testing.assert_array_equal(restored['probabilities'], first['probabilities'])
+    assert list_versions(base_dir, PREDICTION_CACHE_FILE) == sorted([first_version, second_version])
+
+
+def test_rollback_restores_artifacts_published_together(tmp_path):
+    """特徴量行列とインデックスのように同時に公開した成果物は、片方の指定でまとめて戻る"""
+    base_dir = str(tmp_path)
+
+    def publish(payload):
+        return publish_artifacts(base_dir, {
+            FEATURE_MATRIX_FILE: lambda f: f.write(payload),
+            FEATURE_INDEX_FILE: lambda f: f.write(payload),
+        })
+
+    first_version = publish(b'first')
+    publish(b'second')
+
+    assert rollback_artifact(base_dir, FEATURE_MATRIX_FILE) == (
+        sorted([FEATURE_MATRIX_FILE, FEATURE_INDEX_FILE]), first_version)
+    artifacts = read_manifest(base_dir)['artifacts']
+    for name in (FEATURE_MATRIX_FILE, FEATURE_INDEX_FILE):
+        assert artifacts[name]['version'] == first_version
+        with open(os.path.join(base_dir, artifacts[name]['path']), 'rb') as f:
+            assert f.read() == b'first'
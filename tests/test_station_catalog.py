@@ -0,0 +1,44 @@
+import csv
+
+import pytest
+
+from resort_registry import ResortRegistry
+
+STATIONS = {
+    'valley': {'name': '谷', 'prec_no': 1, 'block_no': '0001', 'lat': 36.90, 'lon': 138.80, 'elev': 300},
+}
+CATALOG = [
+    # 谷の観測所とほぼ同じ位置だが標高が高い観測所と、水平方向に離れた観測所
+    {'key': 'ridge', 'name': '尾根', 'prec_no': 1, 'block_no': '0002', 'lat': 36.91, 'lon': 138.80, 'elev': 1500},
+    {'key': 'far', 'name': '遠方', 'prec_no': 2, 'block_no': '0003', 'lat': 37.60, 'lon': 139.50, 'elev': 1500},
+]
+
+
+def write_catalog(path):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=list(CATALOG[0]))
+        writer.writeheader()
+        writer.writerows(CATALOG)
+
+
+def test_resorts_without_station_get_nearest_by_distance_and_elevation(tmp_path):
+    pytest.importorskip('scipy')
+    catalog_path = tmp_path / 'station_catalog.csv'
+    write_catalog(catalog_path)
+    data = {
+        'stations': STATIONS,
+        'resorts': {
+            'low': {'name': '低', 'lat': 36.90, 'lon': 138.80, 'elev': 350, 'courses': [400]},
+            'high': {'name': '高', 'lat': 36.90, 'lon': 138.80, 'elev': 1450, 'courses': [1400]},
+            'fixed': {'name': '指定', 'lat': 37.60, 'lon': 139.50, 'elev': 1450, 'station': 'valley', 'courses': [1400]},
+        },
+    }
+    registry = ResortRegistry(data, str(catalog_path))
+
+    assert registry.station_of('low') == 'valley'
+    assert registry.station_of('high') == 'ridge'
+    # 指定済みのリゾートは割り当て直さない
+    assert registry.station_of('fixed') == 'valley'
+    # 割り当てた観測所は取得対象に加わり、予報の補正値もその観測所の標高から計算される
+    assert 'ridge' in registry.stations and 'far' not in registry.stations
+    assert registry.resorts['high']['forecast_adj_val'] == pytest.approx((1450 - 1500) / 100 * 0.6)
@@ -0,0 +1,62 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from tree_model import base_margin_of, flatten_booster, TreeEnsemble, PARITY_TOLERANCE
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parity_rows(n_features, n_rows=5000, seed=0):
+    """特徴量の範囲を広めに取った乱数 (欠損値を含む)"""
+    rng = np.random.default_rng(seed)
+    rows = rng.uniform(-30.0, 300.0, size=(n_rows, n_features)).astype(np.float32)
+    rows[rng.random(rows.shape) < 0.02] = np.nan
+    return rows
+
+
+def test_parity_with_committed_model():
+    pytest.importorskip('xgboost')
+    pytest.importorskip('joblib')
+    from prediction import load_xgboost_model
+
+    xgb_model = load_xgboost_model(BASE_DIR)
+    tree_model = TreeEnsemble(flatten_booster(xgb_model.get_booster()))
+    X = parity_rows(xgb_model.n_features_in_)
+
+    assert tree_model.n_classes_ == xgb_model.n_classes_
+    np.testing.assert_allclose(tree_model.predict_proba(X), xgb_model.predict_proba(X), atol=PARITY_TOLERANCE)
+    np.testing.assert_array_equal(tree_model.predict(X), np.argmax(xgb_model.predict_proba(X), axis=1))
+
+
+def test_parity_with_scalar_base_score():
+    xgb = pytest.importorskip('xgboost')
+
+    rng = np.random.default_rng(1)
+    X = rng.normal(size=(600, 5)).astype(np.float32)
+    y = rng.integers(0, 3, len(X))
+    xgb_model = xgb.XGBClassifier(n_estimators=8, max_depth=3, base_score=0.3).fit(X, y)
+    tree_model = TreeEnsemble(flatten_booster(xgb_model.get_booster()))
+
+    np.testing.assert_allclose(tree_model.predict_proba(X), xgb_model.predict_proba(X), atol=PARITY_TOLERANCE)
+
+
+def test_scalar_base_score_is_broadcast_to_classes():
+    learner = {
+        'objective': {'name': 'multi:softprob'},
+        'learner_model_param': {'base_score': '5E-1', 'num_class': '4'},
+    }
+    n_classes, base_margin = base_margin_of(learner)
+    assert n_classes == 4
+    np.testing.assert_array_equal(base_margin, np.full(4, 0.5))
+
+
+def test_unsupported_objective_is_rejected():
+    learner = {
+        'objective': {'name': 'binary:logistic'},
+        'learner_model_param': {'base_score': json.dumps(0.5), 'num_class': '0'},
+    }
+    with pytest.raises(ValueError):
+        base_margin_of(learner)
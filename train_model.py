@@ -0,0 +1,226 @@
+import argparse
+import itertools
+import json
+import os
+import resource
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+import xgboost as xgb
+
+from model_schema import MODEL_FEATURE_ORDER
+from training_features import load_training_matrix
+
+# --- 定数とファイル名 ---
+# 再学習したモデルとメトリクスの保存先 (バージョンごとにファイルを分ける)
+# モデルレジストリ (models/) とは分け、採用するモデルだけを model_registry.py register で登録する
+MODEL_DIR = 'training_runs'
+MODEL_PREFIX = 'gelacon_predictor'
+N_CLASSES = 4
+# 最新シーズンはテスト用 (報告する正解率のみ)、その前のシーズンは検証用 (早期終了とパラメータ選択)、残りで学習
+TEST_SEASONS = 1
+VALIDATION_SEASONS = 1
+# DataIter が一度に渡す行数 (メモリに載るのはこのチャンクと量子化済み行列だけ)
+CHUNK_ROWS = 100_000
+MAX_BIN = 256
+NUM_BOOST_ROUND = 1000
+EARLY_STOPPING_ROUNDS = 30
+
+# 探索するハイパーパラメータ (直積の全組み合わせを試す)
+# 元の gelacon_predictor_modela.pkl は learning_rate=0.1, max_depth=6 (既定), 200ラウンド
+SEARCH_SPACE = {
+    'max_depth': [4, 6, 8],
+    'eta': [0.05, 0.1],
+    'min_child_weight': [1, 5],
+    'subsample': [0.8, 1.0],
+}
+BASE_PARAMS = {
+    'objective': 'multi:softprob',
+    'num_class': N_CLASSES,
+    'eval_metric': 'mlogloss',
+    'tree_method': 'hist',
+    'max_bin': MAX_BIN,
+    'seed': 42,
+}
+
+
+# --- 行列のチャンク読み込み ---
+class MatrixChunkIter(xgb.DataIter):
+    """mmap した学習行列から指定行をチャンクごとに XGBoost へ渡す"""
+
+    def __init__(self, matrix, labels, rows, chunk_rows=CHUNK_ROWS, cache_prefix=None):
+        self.matrix = matrix
+        self.labels = labels
+        self.rows = rows
+        self.chunk_rows = chunk_rows
+        self._start = 0
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data):
+        if self._start >= len(self.rows):
+            return False
+        rows = self.rows[self._start:self._start + self.chunk_rows]
+        input_data(data=np.asarray(self.matrix[rows]), label=self.labels[rows], feature_names=MODEL_FEATURE_ORDER)
+        self._start += self.chunk_rows
+        return True
+
+    def reset(self):
+        self._start = 0
+
+
+def build_dmatrices(matrix, labels, train_rows, valid_rows, external_memory=False, cache_dir=None):
+    """学習・検証用の量子化行列を作る (external_memory ならページをディスクに置く)"""
+    if external_memory:
+        train_iter = MatrixChunkIter(matrix, labels, train_rows, cache_prefix=os.path.join(cache_dir, 'train'))
+        dtrain = xgb.ExtMemQuantileDMatrix(train_iter, max_bin=MAX_BIN)
+        valid_iter = MatrixChunkIter(matrix, labels, valid_rows, cache_prefix=os.path.join(cache_dir, 'valid'))
+        dvalid = xgb.ExtMemQuantileDMatrix(valid_iter, max_bin=MAX_BIN, ref=dtrain)
+    else:
+        dtrain = xgb.QuantileDMatrix(MatrixChunkIter(matrix, labels, train_rows), max_bin=MAX_BIN)
+        dvalid = xgb.QuantileDMatrix(MatrixChunkIter(matrix, labels, valid_rows), max_bin=MAX_BIN, ref=dtrain)
+    return dtrain, dvalid
+
+
+def split_by_season(index, validation_seasons=VALIDATION_SEASONS, test_seasons=TEST_SEASONS):
+    """最新シーズンをテスト用、その前を検証用、それ以前を学習用に分ける (行番号の配列を返す)
+
+    検証用は早期終了とパラメータ選択に使うので、報告する正解率は選択に使っていないテスト用で計算する。
+    """
+    seasons = np.unique(index['seasons'])
+    if len(seasons) <= validation_seasons + test_seasons:
+        raise ValueError(f"シーズン数 ({len(seasons)}) が少なすぎて検証用・テスト用に分けられません。")
+    test_set = seasons[len(seasons) - test_seasons:]
+    valid_set = seasons[len(seasons) - test_seasons - validation_seasons:len(seasons) - test_seasons]
+    is_test = np.isin(index['seasons'], test_set)
+    is_valid = np.isin(index['seasons'], valid_set)
+    return np.flatnonzero(~is_valid & ~is_test), np.flatnonzero(is_valid), np.flatnonzero(is_test)
+
+
+def peak_memory_mb():
+    """このプロセスの最大常駐メモリ (MB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# --- 評価 ---
+def evaluate(booster, matrix, labels, rows, chunk_rows=CHUNK_ROWS):
+    """クラスごとの正解率 (そのクラスの行のうち正しく予測できた割合)・全体の正解率・mlogloss"""
+    correct = np.zeros(N_CLASSES, dtype=np.int64)
+    total = np.zeros(N_CLASSES, dtype=np.int64)
+    log_loss = 0.0
+    for start in range(0, len(rows), chunk_rows):
+        chunk = rows[start:start + chunk_rows]
+        proba = booster.inplace_predict(np.asarray(matrix[chunk]))
+        predicted = np.argmax(proba, axis=1)
+        actual = labels[chunk]
+        total += np.bincount(actual, minlength=N_CLASSES)
+        correct += np.bincount(actual[predicted == actual], minlength=N_CLASSES)
+        log_loss -= np.log(np.clip(proba[np.arange(len(chunk)), actual], 1e-15, 1.0)).sum()
+    per_class = [float(c / t) if t else None for c, t in zip(correct, total)]
+    return per_class, float(correct.sum() / max(total.sum(), 1)), float(log_loss / max(total.sum(), 1))
+
+
+# --- 1試行 ---
+def run_trial(dtrain, dvalid, params, nthread):
+    """1つのハイパーパラメータで早期終了付きの学習を行い、モデルと検証のメトリクスを返す
+
+    量子化行列は全試行で共有する (試行ごとに作り直さない)。
+    """
+    start_time = time.perf_counter()
+    booster = xgb.train(
+        {**BASE_PARAMS, **params, 'nthread': nthread}, dtrain,
+        num_boost_round=NUM_BOOST_ROUND, evals=[(dvalid, 'valid')],
+        early_stopping_rounds=EARLY_STOPPING_ROUNDS, verbose_eval=False
+    )
+    return {
+        'params': params,
+        'best_iteration': int(booster.best_iteration),
+        'valid_mlogloss': float(booster.best_score),
+        'train_time_sec': time.perf_counter() - start_time,
+        'model': booster[:booster.best_iteration + 1],
+    }
+
+
+# --- 再学習 ---
+def search_grid(search_space=SEARCH_SPACE):
+    keys = list(search_space)
+    return [dict(zip(keys, values)) for values in itertools.product(*search_space.values())]
+
+
+def retrain(data_dir, output_dir, nthread=None, external_memory=False, search_space=SEARCH_SPACE):
+    """ハイパーパラメータ探索を行い、最良モデルとメトリクスをバージョン付きで保存する
+
+    量子化行列は1回だけ作り、各試行は同じプロセスで全コアを使って順に学習する
+    (試行ごとのプロセスで行列を作るとメモリが試行数倍になるため)。
+    パラメータは検証用シーズンで選び、報告する正解率はテスト用シーズンで計算する。
+    """
+    trials = search_grid(search_space)
+    nthread = nthread or os.cpu_count() or 1
+    matrix, index = load_training_matrix(data_dir)
+    labels = index['labels'].astype(np.int32)
+    train_rows, valid_rows, test_rows = split_by_season(index)
+    print(f"{len(trials)}通りのパラメータを {nthread}スレッドで学習します。"
+          f"(学習 {len(train_rows)}行 / 検証 {len(valid_rows)}行 / テスト {len(test_rows)}行)")
+
+    start_time = time.perf_counter()
+    results = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        dtrain, dvalid = build_dmatrices(matrix, labels, train_rows, valid_rows, external_memory, cache_dir)
+        for params in trials:
+            result = run_trial(dtrain, dvalid, params, nthread)
+            print(f"-> {result['params']} : mlogloss={result['valid_mlogloss']:.4f} "
+                  f"({result['best_iteration'] + 1}ラウンド, {result['train_time_sec']:.1f}秒)")
+            results.append(result)
+        del dtrain, dvalid
+
+    best = min(results, key=lambda r: r['valid_mlogloss'])
+    class_accuracy, test_accuracy, test_mlogloss = evaluate(best['model'], matrix, labels, test_rows)
+    version = datetime.now().strftime('%Y%m%d-%H%M%S')
+    os.makedirs(output_dir, exist_ok=True)
+    model_path = os.path.join(output_dir, f"{MODEL_PREFIX}_{version}.ubj")
+    with open(model_path, 'wb') as f:
+        f.write(bytes(best['model'].save_raw('ubj')))
+
+    report = {
+        'version': version,
+        'model_file': os.path.basename(model_path),
+        'feature_order': MODEL_FEATURE_ORDER,
+        'n_rows': int(len(index['labels'])),
+        'stations': sorted(str(s) for s in np.unique(index['stations'])),
+        'seasons': [int(s) for s in np.unique(index['seasons'])],
+        'validation_seasons': [int(s) for s in np.unique(index['seasons'][valid_rows])],
+        'test_seasons': [int(s) for s in np.unique(index['seasons'][test_rows])],
+        'external_memory': external_memory,
+        'best': {key: value for key, value in best.items() if key != 'model'},
+        'test_mlogloss': test_mlogloss,
+        'test_accuracy': test_accuracy,
+        'class_accuracy': class_accuracy,
+        'trials': [{key: value for key, value in r.items() if key != 'model'} for r in results],
+        'total_time_sec': time.perf_counter() - start_time,
+        'peak_memory_mb': peak_memory_mb(),
+    }
+    report_path = os.path.join(output_dir, f"{MODEL_PREFIX}_{version}.metrics.json")
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+
+    print(f"✅ モデル '{model_path}' を保存しました。テスト正解率: {test_accuracy:.3f} "
+          f"(クラス別: {class_accuracy})")
+    return model_path, report
+
+
+# --- 実行 ---
+if __name__ == '__main__':
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        base_dir = os.getcwd()
+
+    parser = argparse.ArgumentParser(description='学習用特徴量行列から予測モデルを再学習する')
+    parser.add_argument('--data-dir', default=base_dir, help='training_features.npy のあるディレクトリ')
+    parser.add_argument('--output-dir', default=os.path.join(base_dir, MODEL_DIR))
+    parser.add_argument('--nthread', type=int, default=None, help='学習に使うスレッド数 (既定は全コア)')
+    parser.add_argument('--external-memory', action='store_true', help='量子化行列のページをディスクに置く')
+    args = parser.parse_args()
+
+    retrain(args.data_dir, args.output_dir, args.nthread, args.external_memory)
@@ -0,0 +1,263 @@
+import argparse
+import csv
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from calculation import compute_feature_matrix, station_adjustments, MODEL_FEATURE_ORDER
+from jma_backfill import ARCHIVE_DB_FILE
+from jma_parser import FLAG_NO_PHENOMENON
+from model_schema import CONDITIONS
+from resort_registry import load_resort_registry
+from station_state import SEASON_START_MONTH
+
+# --- 定数とファイル名 ---
+# 学習用の特徴量行列 (float32, MODEL_FEATURE_ORDER順) とラベル・インデックス
+TRAINING_MATRIX_FILE = 'training_features.npy'
+TRAINING_INDEX_FILE = 'training_index.npz'
+
+# 観測所・日付ごとの実際の雪面状態ラベル (アーカイブ内のテーブル。--labels のCSVから取り込む)
+LABEL_TABLE = 'condition_labels'
+
+
+# --- ラベル ---
+def _label_value(text):
+    """ラベルはクラス番号 (0〜3) または雪面状態の名称 (CONDITIONS) で指定する"""
+    text = text.strip()
+    if text.isdigit() and int(text) in CONDITIONS:
+        return int(text)
+    names = {name: cls for cls, name in CONDITIONS.items()}
+    if text in names:
+        return names[text]
+    raise ValueError(f"不明なラベルです: {text!r} (クラス番号 {sorted(CONDITIONS)} または {list(names)})")
+
+
+def import_labels(db_path, csv_path):
+    """station,date,label の列を持つCSVをアーカイブのラベルテーブルに取り込む (同じ観測所・日付は上書き)"""
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        rows = [(row['station'], row['date'], _label_value(row['label'])) for row in csv.DictReader(f)]
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            conn.execute(f"""CREATE TABLE IF NOT EXISTS {LABEL_TABLE} (
+                station TEXT NOT NULL, date TEXT NOT NULL, label INTEGER NOT NULL,
+                PRIMARY KEY (station, date)
+            )""")
+            conn.executemany(f"INSERT OR REPLACE INTO {LABEL_TABLE} VALUES (?, ?, ?)", rows)
+    finally:
+        conn.close()
+    print(f"✅ ラベル {len(rows)}件を '{LABEL_TABLE}' に取り込みました。")
+    return len(rows)
+
+
+def count_labels(conn, stations):
+    """観測所に付いているラベルの件数 (テーブルが無ければ0)"""
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (LABEL_TABLE,)).fetchone():
+        return 0
+    placeholders = ', '.join('?' * len(stations))
+    return conn.execute(
+        f"SELECT COUNT(*) FROM {LABEL_TABLE} WHERE station IN ({placeholders})", list(stations)
+    ).fetchone()[0]
+
+
+# --- シーズン単位の特徴量計算 ---
+def read_season(db_path, station, season):
+    """アーカイブから1観測所・1シーズン分の日別観測値とラベル (無い日は NaN) を読み込む"""
+    start = f"{season}-{SEASON_START_MONTH:02d}-01"
+    end = f"{season + 1}-{SEASON_START_MONTH:02d}-01"
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            f"""SELECT o.date, o.temp_max_c, o.temp_min_c, o.wind_avg_ms, o.snowfall_cm, o.snowfall_cm_flag,
+                      o.snow_depth_max_cm, o.snow_depth_max_cm_flag, l.label
+               FROM daily_observations o
+               LEFT JOIN {LABEL_TABLE} l ON l.station = o.station AND l.date = o.date
+               WHERE o.station = ? AND o.date >= ? AND o.date < ? ORDER BY o.date""",
+            (station, start, end)
+        ).fetchall()
+    finally:
+        conn.close()
+
+    dates = np.asarray([r[0] for r in rows], dtype=str)
+    values = np.asarray([r[1:] for r in rows], dtype=float).reshape(len(rows), 8)
+    # "--" (該当現象なし) の降雪・積雪は0として扱う (予報側も0で入ってくる)
+    snowfall = np.where(values[:, 4].astype(np.int64) & FLAG_NO_PHENOMENON, 0.0, values[:, 3])
+    snow_depth = np.where(values[:, 6].astype(np.int64) & FLAG_NO_PHENOMENON, 0.0, values[:, 5])
+    return dates, values[:, 0], values[:, 1], values[:, 2], snowfall, snow_depth, values[:, 7]
+
+
+def target_days(dates, labels):
+    """ラベルがあり、前日・前々日の観測がそろっている日の位置
+
+    欠測日をはさむ場合は、前の行を前日として扱わず対象から外す。
+    """
+    days = dates.astype('datetime64[D]')
+    candidates = np.arange(2, len(dates))
+    consecutive = (days[candidates] - days[candidates - 1] == np.timedelta64(1, 'D')) & (
+        days[candidates - 1] - days[candidates - 2] == np.timedelta64(1, 'D'))
+    return candidates[consecutive & ~np.isnan(labels[candidates])]
+
+
+def station_courses(registry, station):
+    """観測所に紐づく全リゾートのコース (コースキー, 標高)"""
+    keys, elevs = [], []
+    for resort in registry.station_resorts[station]:
+        rows = registry.course_slices[resort]
+        keys.extend(registry.course_keys[rows])
+        elevs.extend(registry.course_elevs[rows])
+    return np.asarray(keys, dtype=str), np.asarray(elevs, dtype=np.int64)
+
+
+def build_season_features(db_path, station, season):
+    """1観測所・1シーズン分の (日 × コース) の特徴量とラベルを作る
+
+    コースは観測所に紐づく全リゾート分。各日の特徴量は、前日までの観測でチェックポイント
+    (station_state.py) を更新した状態から1日分の予報として compute_feature_matrix を適用したものと同じになる。
+    """
+    registry = load_resort_registry()
+    course_keys, course_elevs = station_courses(registry, station)
+    amedas_elev = registry.stations[station]['elev']
+    adj_val = station_adjustments(registry)[station]
+
+    dates, temp_max, temp_min, wind_avg, snowfall, snow_depth, day_labels = read_season(db_path, station, season)
+    n_features = len(MODEL_FEATURE_ORDER)
+    target = target_days(dates, day_labels)
+    if len(target) == 0:
+        return (np.empty((0, n_features), np.float32), np.empty(0, np.int8), np.empty(0, str),
+                np.empty(0, np.int64), np.empty(0, str))
+
+    # チェックポイントと同じ定義の状態 (観測所のトップコース補正)
+    station_max_adj = temp_max - adj_val
+    cum_heat = np.cumsum(np.where(np.isnan(station_max_adj), 0, np.maximum(0, station_max_adj - 0)))
+
+    # 対象日 i の状態は i-1 日までの観測 (前日の補正後最高気温は i-2 日)
+    features = compute_feature_matrix(
+        temp_min[target, None], temp_max[target, None], wind_avg[target, None], snowfall[target, None],
+        course_elevs, amedas_elev,
+        station_max_adj[target - 2, None], cum_heat[target - 1, None], snow_depth[target - 1, None]
+    )[:, :, 0, :]  # (日 × コース × 特徴量)
+
+    # ラベルは観測所・日付単位なので、観測所に紐づく全コースに同じラベルを付ける
+    n_days, n_courses = len(target), len(course_elevs)
+    return (
+        features.reshape(-1, n_features).astype(np.float32),
+        np.repeat(day_labels[target].astype(np.int8), n_courses),
+        np.repeat(dates[target], n_courses),
+        np.tile(course_elevs, n_days),
+        np.tile(course_keys, n_days)
+    )
+
+
+def _build_chunk(args):
+    db_path, station, season = args
+    return (station, season) + build_season_features(db_path, station, season)
+
+
+# --- 全体のビルド ---
+def season_chunks(db_path, stations):
+    """(観測所, シーズン, 対象日数) の一覧 (集計は SQL 側で行い、行を Python に読み込まない)
+
+    対象日は target_days と同じ条件 (ラベルがあり、同じシーズンの前日・前々日の観測がある日)。
+    ラベルが1件も無い場合は ValueError (ルールで作ったラベルで学習しないため)。
+    """
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        if count_labels(conn, stations) == 0:
+            raise ValueError(
+                f"観測所 {list(stations)} のラベルがありません。"
+                "station,date,label の列を持つCSVを --labels で取り込んでください。"
+            )
+        placeholders = ', '.join('?' * len(stations))
+        rows = conn.execute(
+            f"""WITH days AS (
+                    SELECT station, date,
+                           CAST(substr(date, 1, 4) AS INTEGER)
+                               - (CAST(substr(date, 6, 2) AS INTEGER) < {SEASON_START_MONTH:d}) AS season
+                    FROM daily_observations WHERE station IN ({placeholders})
+                )
+                SELECT d.station, d.season, COUNT(*) FROM days d
+                JOIN {LABEL_TABLE} l ON l.station = d.station AND l.date = d.date
+                JOIN daily_observations p1 ON p1.station = d.station AND p1.date = date(d.date, '-1 day')
+                JOIN daily_observations p2 ON p2.station = d.station AND p2.date = date(d.date, '-2 day')
+                WHERE p2.date >= printf('%04d-%02d-01', d.season, {SEASON_START_MONTH:d})
+                GROUP BY d.station, d.season ORDER BY d.station, d.season""",
+            list(stations)
+        ).fetchall()
+    finally:
+        conn.close()
+    return [(station, season, n) for station, season, n in rows]
+
+
+def build_training_matrix(db_path, output_dir, workers=None):
+    """アーカイブ全体から学習用の特徴量行列を作り、カラム形式で保存する
+
+    シーズンごとにプロセスプールで計算し、結果は事前に確保した .npy (mmap) に順に書き込むので、
+    メモリに載るのは処理中のシーズン分だけになる。
+    """
+    registry = load_resort_registry()
+    stations = registry.linked_stations()
+    chunks = season_chunks(db_path, stations)
+    n_courses = {station: len(station_courses(registry, station)[0]) for station in stations}
+    rows_per_chunk = [n_days * n_courses[station] for station, _, n_days in chunks]
+    total_rows = sum(rows_per_chunk)
+    print(f"{len(chunks)}シーズン分 / {total_rows}行の学習データを作成します。")
+
+    os.makedirs(output_dir, exist_ok=True)
+    matrix = np.lib.format.open_memmap(
+        os.path.join(output_dir, TRAINING_MATRIX_FILE), mode='w+', dtype=np.float32,
+        shape=(total_rows, len(MODEL_FEATURE_ORDER))
+    )
+    labels = np.empty(total_rows, dtype=np.int8)
+    dates = np.empty(total_rows, dtype='<U10')
+    course_elevs = np.empty(total_rows, dtype=np.int64)
+    course_keys = np.empty(total_rows, dtype=f"<U{max([len(k) for k in registry.course_keys] or [1])}")
+    row_stations = np.empty(total_rows, dtype=f"<U{max([len(s) for s in stations] or [1])}")
+    row_seasons = np.empty(total_rows, dtype=np.int16)
+
+    offsets = np.concatenate([[0], np.cumsum(rows_per_chunk)]).astype(np.int64)
+    tasks = [(db_path, station, season) for station, season, _ in chunks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for i, (station, season, X, y, d, elev, keys) in enumerate(executor.map(_build_chunk, tasks)):
+            rows = slice(offsets[i], offsets[i] + len(X))
+            matrix[rows], labels[rows], dates[rows], course_elevs[rows], course_keys[rows] = X, y, d, elev, keys
+            row_stations[rows], row_seasons[rows] = station, season
+
+    matrix.flush()
+    np.savez(
+        os.path.join(output_dir, TRAINING_INDEX_FILE),
+        labels=labels, dates=dates, course_elevs=course_elevs, course_keys=course_keys,
+        stations=row_stations, seasons=row_seasons,
+        feature_order=np.asarray(MODEL_FEATURE_ORDER)
+    )
+    counts = np.bincount(labels, minlength=4)
+    print(f"✅ 学習データ '{TRAINING_MATRIX_FILE}' を生成しました。ラベル件数: {counts.tolist()}")
+    return total_rows
+
+
+def load_training_matrix(base_dir, mmap=True):
+    """学習用の特徴量行列 (mmap) とラベル・インデックスを読み込む"""
+    matrix = np.load(os.path.join(base_dir, TRAINING_MATRIX_FILE), mmap_mode='r' if mmap else None)
+    with np.load(os.path.join(base_dir, TRAINING_INDEX_FILE), allow_pickle=False) as npz:
+        index = {key: npz[key] for key in npz.files}
+    return matrix, index
+
+
+# --- 実行 ---
+if __name__ == '__main__':
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        base_dir = os.getcwd()
+
+    parser = argparse.ArgumentParser(description='観測アーカイブから学習用の特徴量行列を作成する')
+    parser.add_argument('--db', default=os.path.join(base_dir, ARCHIVE_DB_FILE))
+    parser.add_argument('--output-dir', default=base_dir)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--labels', help='実際の雪面状態のラベル (station,date,label の列を持つCSV) を取り込んでから作成する')
+    args = parser.parse_args()
+
+    if args.labels:
+        import_labels(args.db, args.labels)
+    build_training_matrix(args.db, args.output_dir, args.workers)
@@ -0,0 +1,186 @@
+import numpy as np
+import json
+import os
+
+# --- 定数とファイル名 ---
+# XGBoostのツリーを連続配列に展開したモデル (xgboost なしで推論できる)
+TREE_MODEL_FILE = 'gelacon_predictor_trees.npz'
+# 書き出し時にXGBoostとの一致を確認する許容誤差 (確率)
+PARITY_TOLERANCE = 1e-5
+# 評価器が対応する目的関数 (softmax の ProbToMargin は恒等変換なので base_score をそのままマージンに足す)
+SUPPORTED_OBJECTIVES = ('multi:softmax', 'multi:softprob')
+
+
+# --- NumPy だけで動くツリー評価器 ---
+class TreeEnsemble:
+    """展開済みツリー配列から predict_proba を計算する (XGBClassifier 互換)
+
+    全ツリーのノードを1本の配列に連結し、全行 × 全ツリーを深さ方向に一括で辿る。
+    葉ノードは自分自身を子に持たせているので、最大深さ分だけ進めれば全行が葉に到達する。
+    """
+
+    def __init__(self, arrays):
+        self.feature = arrays['feature']
+        self.threshold = arrays['threshold']
+        self.left = arrays['left']
+        self.right = arrays['right']
+        self.default_left = arrays['default_left']
+        self.leaf_value = arrays['leaf_value']
+        self.tree_roots = arrays['tree_roots']
+        self.tree_class = arrays['tree_class']
+        self.base_margin = arrays['base_margin']
+        self.max_depth = int(arrays['max_depth'])
+        self.feature_names = [str(name) for name in arrays['feature_names']]
+        self.n_classes_ = int(arrays['n_classes']) if 'n_classes' in arrays else len(self.base_margin)
+        # 旧形式 (スカラーの base_score) の配列もクラス数に揃える
+        self.base_margin = np.broadcast_to(self.base_margin, (self.n_classes_,)).astype(np.float64)
+        # ツリー → クラスの集計行列 (T × K)
+        self._class_onehot = np.eye(self.n_classes_, dtype=np.float32)[self.tree_class]
+
+    def predict_margin(self, X, chunk_rows=4096):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n_features = X.shape[1]
+        margin = np.empty((len(X), self.n_classes_))
+
+        # 中間配列 (行 × ツリー) のメモリを抑えるため行をチャンクに分ける
+        for start in range(0, len(X), chunk_rows):
+            X_chunk = X[start:start + chunk_rows]
+            row_base = (np.arange(len(X_chunk), dtype=np.int64) * n_features)[:, None]
+            node = np.broadcast_to(self.tree_roots, (len(X_chunk), len(self.tree_roots))).copy()
+
+            for _ in range(self.max_depth):
+                values = np.take(X_chunk, row_base + np.take(self.feature, node))
+                go_left = values < np.take(self.threshold, node)
+                missing = np.isnan(values)
+                if missing.any():
+                    go_left = np.where(missing, np.take(self.default_left, node), go_left)
+                node = np.where(go_left, np.take(self.left, node), np.take(self.right, node))
+
+            margin[start:start + chunk_rows] = np.take(self.leaf_value, node) @ self._class_onehot
+        return margin + self.base_margin
+
+    def predict_proba(self, X):
+        margin = self.predict_margin(X)
+        margin = np.exp(margin - margin.max(axis=1, keepdims=True))
+        return margin / margin.sum(axis=1, keepdims=True)
+
+    def predict(self, X):
+        return np.argmax(self.predict_margin(X), axis=1)
+
+
+def load_tree_model(base_dir):
+    with np.load(os.path.join(base_dir, TREE_MODEL_FILE), allow_pickle=False) as npz:
+        return TreeEnsemble({key: npz[key] for key in npz.files})
+
+
+# --- XGBoost ブースターからの書き出し ---
+def base_margin_of(learner):
+    """learner_model_param からクラス数と初期マージン (クラス数の長さ) を求める
+
+    XGBoost 3.x は base_score をクラスごとのベクトルで、それより前はスカラーで保存する。
+    スカラーの場合は全クラスに同じ値を使う。
+    """
+    objective = learner['objective']['name']
+    if objective not in SUPPORTED_OBJECTIVES:
+        raise ValueError(f"ツリー評価器は目的関数 {objective} に対応していません ({', '.join(SUPPORTED_OBJECTIVES)} のみ)")
+    params = learner['learner_model_param']
+    n_classes = int(params['num_class'])
+    base_score = np.asarray(json.loads(params['base_score']), dtype=np.float64).reshape(-1)
+    if len(base_score) not in (1, n_classes):
+        raise ValueError(f"base_score の長さ {len(base_score)} がクラス数 {n_classes} と一致しません")
+    return n_classes, np.broadcast_to(base_score, (n_classes,)).copy()
+
+
+def flatten_booster(booster):
+    """ブースターのJSONダンプから連続配列 (特徴量番号・閾値・子ノード・葉の値) を作る"""
+    learner = json.loads(booster.save_raw('json'))['learner']
+    model = learner['gradient_booster']['model']
+    n_classes, base_margin = base_margin_of(learner)
+
+    features, thresholds, lefts, rights, defaults, leaves, roots = [], [], [], [], [], [], []
+    offset = 0
+    max_depth = 0
+    for tree in model['trees']:
+        left = np.asarray(tree['left_children'], dtype=np.int32)
+        right = np.asarray(tree['right_children'], dtype=np.int32)
+        conditions = np.asarray(tree['split_conditions'], dtype=np.float32)
+        n_nodes = len(left)
+        node_ids = np.arange(n_nodes, dtype=np.int32)
+        is_leaf = left == -1
+
+        # 葉は自分自身を指すようにし、ノード番号を全体の通し番号にする
+        lefts.append(np.where(is_leaf, node_ids, left) + offset)
+        rights.append(np.where(is_leaf, node_ids, right) + offset)
+        features.append(np.where(is_leaf, 0, tree['split_indices']).astype(np.int32))
+        thresholds.append(np.where(is_leaf, 0, conditions).astype(np.float32))
+        defaults.append(np.asarray(tree['default_left'], dtype=bool))
+        # JSONダンプでは葉の値は split_conditions に入っている
+        leaves.append(np.where(is_leaf, conditions, 0).astype(np.float32))
+        roots.append(offset)
+
+        # ツリーの深さ (親から順に1段ずつ)
+        depth = np.zeros(n_nodes, dtype=np.int32)
+        for node in range(n_nodes):
+            if not is_leaf[node]:
+                depth[left[node]] = depth[right[node]] = depth[node] + 1
+        max_depth = max(max_depth, int(depth.max()))
+        offset += n_nodes
+
+    return {
+        'feature': np.concatenate(features),
+        'threshold': np.concatenate(thresholds),
+        'left': np.concatenate(lefts),
+        'right': np.concatenate(rights),
+        'default_left': np.concatenate(defaults),
+        'leaf_value': np.concatenate(leaves),
+        'tree_roots': np.asarray(roots, dtype=np.int32),
+        'tree_class': np.asarray(model['tree_info'], dtype=np.int32),
+        'base_margin': base_margin,
+        'n_classes': np.asarray(n_classes),
+        'max_depth': np.asarray(max_depth),
+        'feature_names': np.asarray(booster.feature_names or [], dtype=str)
+    }
+
+
+def check_parity(xgb_model, tree_model, X):
+    """XGBoost と NumPy 評価器の予測確率の最大差を返す"""
+    return float(np.abs(xgb_model.predict_proba(X) - tree_model.predict_proba(X)).max())
+
+
+def export_tree_model(base_dir, xgb_model, X_check):
+    """XGBClassifier をツリー配列に書き出す (一致しない場合は書き出さない)"""
+    arrays = flatten_booster(xgb_model.get_booster())
+    tree_model = TreeEnsemble(arrays)
+
+    max_diff = check_parity(xgb_model, tree_model, X_check)
+    print(f"XGBoostとの予測確率の最大差: {max_diff:.2e} ({len(X_check)}行)")
+    if max_diff > PARITY_TOLERANCE:
+        raise ValueError(f"ツリー評価器の予測がXGBoostと一致しません (最大差 {max_diff:.2e})")
+
+    np.savez(os.path.join(base_dir, TREE_MODEL_FILE), **arrays)
+    return tree_model
+
+
+# --- 実行 (pkl からツリー配列を書き出す) ---
+if __name__ == '__main__':
+    from feature_cache import load_feature_cache
+    from prediction import load_xgboost_model
+
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        base_dir = os.getcwd()
+
+    xgb_model = load_xgboost_model(base_dir)
+
+    # 一致確認用データ: 特徴量キャッシュ + 特徴量の範囲を広めに取った乱数 (欠損値を含む)
+    matrix, _ = load_feature_cache(base_dir)
+    rng = np.random.default_rng(0)
+    low = np.nanmin(matrix, axis=0) - 10 if len(matrix) else np.full(matrix.shape[1], -20.0)
+    high = np.nanmax(matrix, axis=0) + 10 if len(matrix) else np.full(matrix.shape[1], 100.0)
+    random_rows = rng.uniform(low, high, size=(5000, matrix.shape[1])).astype(np.float32)
+    random_rows[rng.random(random_rows.shape) < 0.02] = np.nan
+    X_check = np.concatenate([np.asarray(matrix, dtype=np.float32), random_rows])
+
+    export_tree_model(base_dir, xgb_model, X_check)
+    print(f"✅ ツリー配列モデル '{TREE_MODEL_FILE}' を生成しました。")
@@ -0,0 +1,326 @@
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+from station_state import resolve_observation_date
+
+# --- 定数とファイル名 ---
+# 観測値 (気象庁) と予報 (OpenWeatherMap) を型付きの列で保持するデータベース
+WEATHER_DB_FILE = 'weather_store.sqlite'
+# 日付以外の気象要素 (past_data.json / CF_data.json のキーと同じ並び)
+WEATHER_KEYS = [
+    'precipitation_total_mm', 'temp_avg_c', 'temp_max_c', 'temp_min_c',
+    'wind_avg_ms', 'wind_max_ms', 'sunshine_h', 'snowfall_cm', 'snow_depth_max_cm'
+]
+# 3時間ごとの予報の気象要素 (OpenWeatherMap の list の各要素)
+STEP_KEYS = ['temp_c', 'temp_max_c', 'temp_min_c', 'wind_ms', 'snowfall_cm', 'precipitation_mm']
+OBSERVATION_SOURCE = 'jma'
+FORECAST_SOURCE = 'owm'
+# スキーマのバージョン (PRAGMA user_version)。1 で観測値を (地点, 日付, 取得元) ごとに最新の取得分だけにした
+SCHEMA_VERSION = 1
+# 並列に書き込むステージがロックの解放を待つ最大の秒数
+STORE_BUSY_TIMEOUT_SEC = 30.0
+# 予報を (リゾート, 取得元) ごとに残す取得回数 (読み込むのは最新の取得分だけ)
+FORECAST_RETENTION_RUNS = 1
+
+
+# --- データベース ---
+def open_store(db_path):
+    """ストアを開き、無ければテーブルを作成する
+
+    どのテーブルも (地点, 日付または時刻, 取得元, 取得時刻) を主キーにするので、
+    地点・日付の範囲検索は主キーのインデックスで行われる。
+    観測値は日ごとに最新の取得分だけを残す (古いストアは開いたときに1回だけ整理する)。
+    パイプラインでは取得と予報取得が並列に同じファイルへ書き込むので、WAL モードにして
+    読み込みが書き込みを待たないようにし、書き込み同士はロックが空くまで待つ。
+    """
+    conn = sqlite3.connect(db_path, timeout=STORE_BUSY_TIMEOUT_SEC)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA busy_timeout = {int(STORE_BUSY_TIMEOUT_SEC * 1000)}")
+    value_columns = ', '.join(f"{key} REAL" for key in WEATHER_KEYS)
+    flag_columns = ', '.join(f"{key}_flag INTEGER" for key in WEATHER_KEYS)
+    step_columns = ', '.join(f"{key} REAL" for key in STEP_KEYS)
+    conn.executescript(f"""
+        CREATE TABLE IF NOT EXISTS observations (
+            station TEXT NOT NULL, date TEXT NOT NULL, source TEXT NOT NULL, fetched_at TEXT NOT NULL,
+            {value_columns}, {flag_columns},
+            PRIMARY KEY (station, date, source, fetched_at)
+        );
+        CREATE TABLE IF NOT EXISTS forecasts (
+            resort TEXT NOT NULL, date TEXT NOT NULL, source TEXT NOT NULL, fetched_at TEXT NOT NULL,
+            {value_columns},
+            PRIMARY KEY (resort, date, source, fetched_at)
+        );
+        CREATE INDEX IF NOT EXISTS forecasts_run ON forecasts (resort, source, fetched_at);
+        CREATE TABLE IF NOT EXISTS forecast_steps (
+            resort TEXT NOT NULL, time TEXT NOT NULL, source TEXT NOT NULL, fetched_at TEXT NOT NULL,
+            {step_columns},
+            PRIMARY KEY (resort, time, source, fetched_at)
+        );
+        CREATE INDEX IF NOT EXISTS forecast_steps_run ON forecast_steps (resort, source, fetched_at);
+    """)
+    (user_version,) = conn.execute("PRAGMA user_version").fetchone()
+    if user_version < SCHEMA_VERSION:
+        with conn:
+            prune_observations(conn)
+            conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    return conn
+
+
+def prune_observations(conn):
+    """観測値のうち、同じ (地点, 日付, 取得元) のより新しい取得分がある行を削除する"""
+    return conn.execute(
+        """DELETE FROM observations WHERE fetched_at < (
+               SELECT MAX(fetched_at) FROM observations o
+               WHERE o.station = observations.station AND o.date = observations.date
+                 AND o.source = observations.source
+           )"""
+    ).rowcount
+
+
+def prune_forecasts(conn, keep_runs=FORECAST_RETENTION_RUNS):
+    """予報 (日別・3時間ごと) のうち、(リゾート, 取得元) ごとに新しい keep_runs 回より前の取得分を削除する
+
+    予報は取得のたびに1回分を丸ごと書き込むので、整理しないと3時間ごとの取得で行が増え続ける。
+    戻り値は削除した行数。
+    """
+    deleted = 0
+    with conn:
+        for table in ('forecasts', 'forecast_steps'):
+            deleted += conn.execute(
+                f"""DELETE FROM {table} WHERE fetched_at NOT IN (
+                        SELECT DISTINCT fetched_at FROM {table} f
+                        WHERE f.resort = {table}.resort AND f.source = {table}.source
+                        ORDER BY fetched_at DESC LIMIT ?
+                    )""",
+                (keep_runs,)
+            ).rowcount
+    return deleted
+
+
+def _iso(value):
+    return value.isoformat() if isinstance(value, (datetime.date, datetime.datetime)) else str(value)
+
+
+def _sql_values(values):
+    """NaN は NULL として保存する"""
+    return [None if v is None or (isinstance(v, float) and np.isnan(v)) else float(v) for v in values]
+
+
+# --- 一括書き込み ---
+def upsert_observations(conn, station, dates, values, flags=None, source=OBSERVATION_SOURCE, fetched_at=None):
+    """観測値 (日 × WEATHER_KEYS の配列) と品質フラグを1トランザクションで書き込む
+
+    保存済みの値・フラグと同じ日は書き込まず、値が変わった日だけ古い取得分と置き換える
+    (3時間ごとの再取得で行が増え続けないため)。保存済みより古い取得分は書き込まない。
+    戻り値は書き込んだ日数。
+    """
+    fetched_at = _iso(fetched_at or datetime.datetime.now().replace(microsecond=0))
+    values = np.asarray(values, dtype=float).reshape(len(dates), len(WEATHER_KEYS))
+    flags = np.zeros(values.shape, dtype=np.int64) if flags is None else np.asarray(flags, dtype=np.int64)
+    rows = [
+        (station, _iso(day), source, fetched_at, *_sql_values(row_values.tolist()), *row_flags.tolist())
+        for day, row_values, row_flags in zip(dates, values, flags)
+    ]
+    if not rows:
+        return 0
+    columns = ', '.join(WEATHER_KEYS + [f"{key}_flag" for key in WEATHER_KEYS])
+    placeholders = ', '.join(['?'] * (4 + 2 * len(WEATHER_KEYS)))
+    with conn:
+        stored = {
+            row[0]: (row[1], tuple(row[2:])) for row in conn.execute(
+                f"""SELECT date, fetched_at, {columns} FROM observations
+                    WHERE station = ? AND source = ? AND date >= ? AND date <= ?""",
+                (station, source, min(row[1] for row in rows), max(row[1] for row in rows))
+            )
+        }
+        changed = [
+            row for row in rows
+            if row[1] not in stored or (stored[row[1]][0] <= fetched_at and stored[row[1]][1] != tuple(row[4:]))
+        ]
+        conn.executemany(
+            "DELETE FROM observations WHERE station = ? AND source = ? AND date = ?",
+            [(station, source, row[1]) for row in changed]
+        )
+        conn.executemany(f"INSERT INTO observations VALUES ({placeholders})", changed)
+    return len(changed)
+
+
+def upsert_forecasts(conn, resort, dates, values, source=FORECAST_SOURCE, fetched_at=None):
+    """1回分の予報 (日 × WEATHER_KEYS の配列) を1トランザクションで書き込む"""
+    fetched_at = _iso(fetched_at or datetime.datetime.now().replace(microsecond=0))
+    values = np.asarray(values, dtype=float).reshape(len(dates), len(WEATHER_KEYS))
+    rows = [
+        (resort, _iso(day), source, fetched_at, *_sql_values(row_values.tolist()))
+        for day, row_values in zip(dates, values)
+    ]
+    placeholders = ', '.join(['?'] * (4 + len(WEATHER_KEYS)))
+    with conn:
+        conn.executemany(f"INSERT OR REPLACE INTO forecasts VALUES ({placeholders})", rows)
+    return len(rows)
+
+
+def upsert_forecast_steps(conn, resort, times, values, source=FORECAST_SOURCE, fetched_at=None):
+    """1回分の3時間ごとの予報 (時刻 × STEP_KEYS の配列) を1トランザクションで書き込む"""
+    fetched_at = _iso(fetched_at or datetime.datetime.now().replace(microsecond=0))
+    values = np.asarray(values, dtype=float).reshape(len(times), len(STEP_KEYS))
+    rows = [
+        (resort, _iso(time), source, fetched_at, *_sql_values(row_values.tolist()))
+        for time, row_values in zip(times, values)
+    ]
+    placeholders = ', '.join(['?'] * (4 + len(STEP_KEYS)))
+    with conn:
+        conn.executemany(f"INSERT OR REPLACE INTO forecast_steps VALUES ({placeholders})", rows)
+    return len(rows)
+
+
+# --- 範囲検索 (NumPy 配列で返す) ---
+def _to_arrays(rows, keys):
+    result = {'dates': np.asarray([row[0] for row in rows], dtype='datetime64[D]')}
+    for i, key in enumerate(keys):
+        result[key] = np.asarray([row[i + 1] for row in rows], dtype=float)
+    return result
+
+
+def observation_range(conn, station, start=None, end=None, keys=WEATHER_KEYS, source=OBSERVATION_SOURCE):
+    """start〜end (両端を含む) の観測値を日付順に返す (観測値は日ごとに最新の取得分だけが残っている)"""
+    columns = ', '.join(keys)
+    rows = conn.execute(
+        f"""SELECT date, {columns} FROM observations
+            WHERE station = ? AND source = ? AND date >= ? AND date <= ?
+            ORDER BY date""",
+        (station, source, _iso(start or '0000-01-01'), _iso(end or '9999-12-31'))
+    ).fetchall()
+    return _to_arrays(rows, keys)
+
+
+def latest_forecast(conn, resort, keys=WEATHER_KEYS, source=FORECAST_SOURCE):
+    """最新の取得時刻の予報を日付順に返す ('fetched_at' は無ければ None)"""
+    (fetched_at,) = conn.execute(
+        "SELECT MAX(fetched_at) FROM forecasts WHERE resort = ? AND source = ?", (resort, source)
+    ).fetchone()
+    columns = ', '.join(keys)
+    rows = conn.execute(
+        f"""SELECT date, {columns} FROM forecasts
+            WHERE resort = ? AND source = ? AND fetched_at = ? ORDER BY date""",
+        (resort, source, fetched_at)
+    ).fetchall()
+    result = _to_arrays(rows, keys)
+    result['fetched_at'] = fetched_at
+    return result
+
+
+def latest_forecast_steps(conn, resort, keys=STEP_KEYS, source=FORECAST_SOURCE):
+    """最新の取得時刻の3時間ごとの予報を時刻順に返す ('times' は datetime64[s])"""
+    (fetched_at,) = conn.execute(
+        "SELECT MAX(fetched_at) FROM forecast_steps WHERE resort = ? AND source = ?", (resort, source)
+    ).fetchone()
+    columns = ', '.join(keys)
+    rows = conn.execute(
+        f"""SELECT time, {columns} FROM forecast_steps
+            WHERE resort = ? AND source = ? AND fetched_at = ? ORDER BY time""",
+        (resort, source, fetched_at)
+    ).fetchall()
+    result = {'times': np.asarray([row[0] for row in rows], dtype='datetime64[s]')}
+    for i, key in enumerate(keys):
+        result[key] = np.asarray([row[i + 1] for row in rows], dtype=float)
+    result['fetched_at'] = fetched_at
+    return result
+
+
+# --- 内容のハッシュ (パイプラインの更新判定用) ---
+# テーブルごとに (地点の列, 最新の取得分を選ぶ単位の列, 値の列)。観測値は最新の取得分しか無いので選ばない
+_DIGEST_TABLES = {
+    'observations': ('station', None, WEATHER_KEYS),
+    'forecasts': ('resort', ('resort',), WEATHER_KEYS),
+    'forecast_steps': ('resort', ('resort',), STEP_KEYS),
+}
+
+
+def table_digest(conn, table):
+    """読み込み側が使う値 (観測は日ごと、予報はリゾートごとに最新の取得分) のハッシュ
+
+    取得時刻は含めないので、再取得しても値が変わっていなければ同じハッシュになる。
+    """
+    site, latest_by, keys = _DIGEST_TABLES[table]
+    time_column = 'time' if table == 'forecast_steps' else 'date'
+    columns = ', '.join(f"t.{key}" for key in keys)
+    if latest_by is None:
+        where = ''
+    else:
+        match = ' AND '.join(f"{col} = t.{col}" for col in latest_by + ('source',))
+        where = f"WHERE t.fetched_at = (SELECT MAX(fetched_at) FROM {table} WHERE {match})"
+    digest = hashlib.sha256()
+    rows = conn.execute(
+        f"""SELECT t.{site}, t.{time_column}, t.source, {columns} FROM {table} t {where}
+            ORDER BY t.{site}, t.source, t.{time_column}"""
+    )
+    for row in rows:
+        digest.update(json.dumps(row).encode('utf-8'))
+    return digest.hexdigest()
+
+
+# --- 旧JSONキャッシュの取り込み ---
+def _json_values(row):
+    values = []
+    for key in WEATHER_KEYS:
+        try:
+            values.append(float(row.get(key)))
+        except (TypeError, ValueError):
+            values.append(float('nan'))
+    return values
+
+
+def resolve_forecast_date(date_str, run_date):
+    """'01月02日' のような年なし日付を予報の取得日を基準に変換する (取得月より前の月は翌年)"""
+    month, day = date_str.replace('日', '').split('月')
+    month, day = int(month), int(day)
+    year = run_date.year + 1 if month < run_date.month else run_date.year
+    return datetime.date(year, month, day)
+
+
+def import_json_caches(conn, past_files=(), forecast_files=()):
+    """past_data.json / CF_data.json 形式のファイルを取り込む (取得時刻は metadata.date_run)"""
+    imported = 0
+    for path, resolve, upsert in (
+        [(p, resolve_observation_date, upsert_observations) for p in past_files]
+        + [(p, resolve_forecast_date, upsert_forecasts) for p in forecast_files]
+    ):
+        with open(path, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+        fetched_at = datetime.datetime.fromisoformat(cache['metadata']['date_run']).replace(microsecond=0)
+        for key, rows in cache.items():
+            if key == 'metadata' or not rows:
+                continue
+            dates = [resolve(row['date'], fetched_at.date()) for row in rows]
+            imported += upsert(conn, key, dates, [_json_values(row) for row in rows], fetched_at=fetched_at)
+    return imported
+
+
+# --- 実行 (旧JSONキャッシュの取り込み・内容確認) ---
+if __name__ == '__main__':
+    try:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        base_dir = os.getcwd()
+
+    parser = argparse.ArgumentParser(description='観測・予報ストアへのJSONキャッシュ取り込みと内容確認')
+    parser.add_argument('--db', default=os.path.join(base_dir, WEATHER_DB_FILE))
+    parser.add_argument('--past', nargs='*', default=[], help='past_data.json 形式のファイル')
+    parser.add_argument('--forecast', nargs='*', default=[], help='CF_data.json 形式のファイル')
+    args = parser.parse_args()
+
+    conn = open_store(args.db)
+    if args.past or args.forecast:
+        print(f"✅ {import_json_caches(conn, args.past, args.forecast)}行を取り込みました。")
+    for table, key in (('observations', 'station'), ('forecasts', 'resort')):
+        for name, n_rows, first, last in conn.execute(
+            f"SELECT {key}, COUNT(*), MIN(date), MAX(date) FROM {table} GROUP BY {key}"
+        ):
+            print(f"{table}: {name} {n_rows}行 ({first} 〜 {last})")
+    conn.close()